@@ -163,7 +163,7 @@ class ChatMessageAdmin(admin.ModelAdmin):
 # パフォーマンス指標管理
 @admin.register(PerformanceMetrics)
 class PerformanceMetricsAdmin(admin.ModelAdmin):
-    list_display = ['session_short', 'session_type', 'response_time', 'successful_booking', 'user_satisfaction', 'created_at']
+    list_display = ['session_short', 'session_type', 'number_of_turns', 'response_time', 'error_count', 'successful_booking', 'user_satisfaction', 'created_at']
     list_filter = ['session__session_type', 'successful_booking', 'user_satisfaction', 'created_at']
     ordering = ['-created_at']
     readonly_fields = ['created_at']
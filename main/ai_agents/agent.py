@@ -2,6 +2,7 @@ import os
 import sys
 import dotenv
 import json
+import time
 from asgiref.sync import sync_to_async
 from datetime import datetime
 from django.db.models import Q
@@ -14,458 +15,29 @@ dotenv.load_dotenv()
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings.settings')
 django.setup()
-from agents import Agent, Runner, RunConfig, function_tool, SQLiteSession, enable_verbose_stdout_logging, RunContextWrapper, GuardrailFunctionOutput, output_guardrail
+from django.conf import settings
+from agents import Agent, Runner, RunConfig, RunHooks, OpenAIProvider, function_tool, SessionABC, enable_verbose_stdout_logging, RunContextWrapper, GuardrailFunctionOutput, output_guardrail
 from main.models import Air, Accommodations, Booking
+from main.ai_agents.conversation_store import InMemoryConversationStore, SQLiteConversationStore
+from main.ai_agents.llm_client import get_async_openai_client, run_coroutine
+from main.ai_agents import travel_service
+from main.ai_agents import spans
+from main.ai_agents.spans import traced_tool
+from main import session_metrics
+from main.ai_agents.tool_format import format_tool_output, rank_label
 enable_verbose_stdout_logging()
 
 
-@function_tool
-@sync_to_async
-def search_air(place_from: str, place_to: str, departure_date: str = "") -> str:
-    """航空券をデータベースから検索（出発日未定でも対応）"""
-    try:
-        from django.utils import timezone
-        
-        # 現在の日時を取得
-        now = timezone.now()
-        
-        # 基本的な検索クエリ（現在時刻以降の航空券のみ）
-        query = Air.objects.filter(
-            place_from__icontains=place_from,
-            place_to__icontains=place_to,
-            departure_time__gt=now  # 現在時刻以降の航空券のみ
-        )
-        
-        # 出発日が指定されている場合
-        if departure_date:
-            try:
-                search_date = datetime.strptime(departure_date, '%Y-%m-%d').date()
-                query = query.filter(departure_time__date=search_date)
-            except ValueError:
-                # 日付形式が正しくない場合はすべての便を表示（ただし現在時刻以降のみ）
-                pass
-        
-        # 日付順でソート（最新の便から）
-        flights = query.order_by('departure_time')[:10]  # 最大10件
-        
-        if not flights:
-            # 便が見つからない場合、条件を緩和して検索（ただし現在時刻以降のみ）
-            fallback_query = Air.objects.filter(
-                Q(place_from__icontains=place_from) | Q(place_to__icontains=place_to),
-                departure_time__gt=now  # 現在時刻以降の航空券のみ
-            )
-            flights = fallback_query.order_by('departure_time')[:5]
-            
-            if not flights:
-                return f"{place_from}から{place_to}への航空券が見つかりませんでした。別の路線をお探しください。"
-        
-        results = []
-        for flight in flights:
-            # UTCからJSTに変換
-            departure_jst = flight.departure_time
-            arrival_jst = flight.arrival_time
-            
-            # Django設定でTIME_ZONE='Asia/Tokyo'の場合、自動的にJSTで表示される
-            # データベースはUTCで保存されているので、JSTに変換
-            try:
-                import zoneinfo
-                jst = zoneinfo.ZoneInfo('Asia/Tokyo')
-                
-                if flight.departure_time.tzinfo:
-                    # timezone awareの場合はJSTに変換
-                    departure_jst = flight.departure_time.astimezone(jst)
-                    arrival_jst = flight.arrival_time.astimezone(jst)
-                else:
-                    # timezone naiveの場合はUTCとして扱ってJSTに変換
-                    from django.utils import timezone
-                    departure_utc = timezone.make_aware(flight.departure_time, timezone.utc)
-                    arrival_utc = timezone.make_aware(flight.arrival_time, timezone.utc)
-                    departure_jst = departure_utc.astimezone(jst)
-                    arrival_jst = arrival_utc.astimezone(jst)
-            except ImportError:
-                # zoneinfoが利用できない場合はそのまま使用
-                departure_jst = flight.departure_time
-                arrival_jst = flight.arrival_time
-            
-            # 出発日が未定の場合は複数の日程オプションを表示
-            result_item = {
-                "便名": flight.flight_number,
-                "航空会社": flight.name,
-                "出発地": flight.place_from,
-                "目的地": flight.place_to,
-                "出発時刻": departure_jst.strftime('%Y-%m-%d %H:%M'),
-                "到着時刻": arrival_jst.strftime('%Y-%m-%d %H:%M'),
-                "料金": f"¥{flight.fee:,}",
-                "空席数": flight.available_seats,
-                "便種別": flight.get_flight_type_display()
-            }
-            
-            # 出発日が未定の場合は、曜日情報も追加
-            if not departure_date:
-                weekday_names = ['月', '火', '水', '木', '金', '土', '日']
-                weekday = weekday_names[departure_jst.weekday()]
-                result_item["曜日"] = weekday
-                result_item["出発日程"] = f"{departure_jst.strftime('%m月%d日')}({weekday})"
-            
-            results.append(result_item)
-        
-        # 出発日未定の場合の追加メッセージ
-        additional_info = ""
-        if not departure_date:
-            additional_info = "\n\n※出発日が未定のため、利用可能な便をご案内しています。具体的な日程が決まりましたら、お知らせください。"
-        
-        return json.dumps(results, ensure_ascii=False, indent=2) + additional_info
-    
-    except Exception as e:
-        return f"検索中にエラーが発生しました: {str(e)}"
-
-
-@function_tool
-@sync_to_async
-def search_accommodations(location: str, checkin_date: str = "", checkout_date: str = "", guests: int = 2) -> str:
-    """宿泊施設をデータベースから検索（日程未定でも対応、施設名にも地名検索対応）"""
-    try:
-        # 地名をキーワードに分割して検索精度を向上
-        location_keywords = location.replace(',', ' ').replace('、', ' ').split()
-        
-        # 基本検索：locationとnameの両方で包括的に検索
-        query = Accommodations.objects.all()
-        
-        # 各キーワードで OR検索を行う
-        search_conditions = Q()
-        
-        for keyword in location_keywords:
-            keyword = keyword.strip()
-            if keyword:  # 空文字列でない場合のみ
-                # location、name、descriptionの各フィールドで検索
-                keyword_condition = (
-                    Q(location__icontains=keyword) |
-                    Q(name__icontains=keyword) |
-                    Q(description__icontains=keyword)
-                )
-                search_conditions |= keyword_condition
-        
-        # 検索条件を適用
-        if search_conditions:
-            query = query.filter(search_conditions)
-        else:
-            # キーワードがない場合は元の検索方法を使用
-            query = query.filter(
-                Q(location__icontains=location) | Q(name__icontains=location)
-            )
-        
-        # 宿泊人数による簡易フィルタ（部屋数で判断）
-        if guests > 4:
-            query = query.filter(total_rooms__gte=2)  # 大人数の場合は複数部屋ある施設を優先
-        
-        # 関連度順でソート（より多くのキーワードにマッチするものを優先）
-        accommodations = query.order_by('price_per_night')[:10]  # 最大10件、料金順
-        
-        if not accommodations:
-            # 条件を緩和して再検索（単一キーワードでの検索）
-            fallback_conditions = Q()
-            for keyword in location_keywords:
-                keyword = keyword.strip()
-                if keyword:
-                    fallback_conditions |= (
-                        Q(location__icontains=keyword) |
-                        Q(name__icontains=keyword)
-                    )
-            
-            if fallback_conditions:
-                fallback_query = Accommodations.objects.filter(fallback_conditions)
-                accommodations = fallback_query.order_by('price_per_night')[:5]
-            
-            if not accommodations:
-                return f"{location}周辺で宿泊施設が見つかりませんでした。別の地域名や施設名をお試しください。"
-        
-        results = []
-        for acc in accommodations:
-            # 宿泊日数と料金の計算
-            nights = 1
-            total_cost = acc.price_per_night * nights * guests
-            
-            # チェックイン・チェックアウト日が指定されている場合
-            if checkin_date and checkout_date:
-                try:
-                    checkin = datetime.strptime(checkin_date, '%Y-%m-%d').date()
-                    checkout = datetime.strptime(checkout_date, '%Y-%m-%d').date()
-                    if checkout > checkin:
-                        nights = (checkout - checkin).days
-                        total_cost = acc.price_per_night * nights * guests
-                except ValueError:
-                    # 日付が正しくない場合はデフォルト値を使用
-                    pass
-            
-            # 検索キーワードとのマッチ情報を追加
-            match_info = []
-            for keyword in location_keywords:
-                keyword = keyword.strip().lower()
-                if keyword:
-                    if keyword in acc.location.lower():
-                        match_info.append(f"所在地: {keyword}")
-                    if keyword in acc.name.lower():
-                        match_info.append(f"施設名: {keyword}")
-                    if keyword in acc.description.lower():
-                        match_info.append(f"説明: {keyword}")
-            
-            # 宿泊施設情報を構築
-            result_item = {
-                "施設名": acc.name,
-                "所在地": acc.location,
-                "ランク": f"{'⭐' * acc.rank} ({acc.rank}つ星)",
-                "1泊料金": f"¥{acc.price_per_night:,}/泊",
-                "説明": acc.description[:100] + "..." if len(acc.description) > 100 else acc.description,
-                "設備": acc.amenities[:5] if acc.amenities else [],
-                "総部屋数": acc.total_rooms
-            }
-            
-            # マッチ情報を追加（デバッグ用、必要に応じて表示）
-            if match_info:
-                result_item["検索マッチ"] = ", ".join(match_info)
-            
-            # 日程が指定されている場合の料金計算
-            if checkin_date and checkout_date:
-                result_item["宿泊期間"] = f"{nights}泊"
-                result_item["総料金"] = f"¥{total_cost:,} ({guests}名)"
-            else:
-                # 日程未定の場合のサンプル料金表示
-                result_item["料金例"] = {
-                    "1泊": f"¥{acc.price_per_night * guests:,} ({guests}名)",
-                    "2泊": f"¥{acc.price_per_night * 2 * guests:,} ({guests}名)",
-                    "3泊": f"¥{acc.price_per_night * 3 * guests:,} ({guests}名)"
-                }
-            
-            # 予約の目安情報
-            if not checkin_date:
-                result_item["予約のご案内"] = "具体的な宿泊日程が決まりましたら、空室状況をご確認いたします。"
-            
-            results.append(result_item)
-        
-        # 日程未定の場合の追加メッセージ
-        additional_info = ""
-        if not checkin_date or not checkout_date:
-            additional_info = f"\n\n※{location}の宿泊施設をご案内しています。具体的な宿泊日程が決まりましたら、より詳細な料金と空室状況をお調べいたします。"
-            additional_info += f"\n※表示料金は{guests}名様でのご利用を想定しています。"
-        
-        return json.dumps(results, ensure_ascii=False, indent=2) + additional_info
-    
-    except Exception as e:
-        return f"検索中にエラーが発生しました: {str(e)}"
-
-
-@function_tool
-@sync_to_async
-def get_travel_recommendations(destination: str, budget: int = None, duration: int = None, departure_date: str = "") -> str:
-    """旅行先のおすすめ情報を提供（日程未定でも対応）"""
-    try:
-        # 航空券と宿泊施設の両方を検索
-        flight_query = Air.objects.filter(place_to__icontains=destination)
-        
-        # 出発日が指定されている場合
-        if departure_date:
-            try:
-                search_date = datetime.strptime(departure_date, '%Y-%m-%d').date()
-                flight_query = flight_query.filter(departure_time__date=search_date)
-            except ValueError:
-                pass
-        
-        flights = flight_query.order_by('fee')[:5]  # 料金の安い順
-        accommodations = Accommodations.objects.filter(location__icontains=destination).order_by('price_per_night')[:5]
-        
-        recommendations = {
-            "目的地": destination,
-            "おすすめフライト": [],
-            "おすすめ宿泊施設": [],
-            "予算目安": {},
-            "旅行プランニング情報": {}
-        }
-        
-        # フライト情報
-        for flight in flights:
-            recommendations["おすすめフライト"].append({
-                "便名": flight.flight_number,
-                "航空会社": flight.name,
-                "料金": f"¥{flight.fee:,}",
-                "所要時間": "約2時間"  # 実際の計算が必要な場合は追加
-            })
-        
-        # 宿泊施設情報
-        total_acc_cost = 0
-        for acc in accommodations:
-            acc_nights = duration or 2
-            acc_cost = acc.price_per_night * acc_nights
-            total_acc_cost += acc_cost
-            
-            recommendations["おすすめ宿泊施設"].append({
-                "施設名": acc.name,
-                "ランク": f"{acc.rank}つ星",
-                "料金": f"¥{acc.price_per_night:,}/泊",
-                f"{acc_nights}泊総額": f"¥{acc_cost:,}"
-            })
-        
-        # 予算目安
-        if flights and accommodations:
-            min_flight = min(flight.fee for flight in flights)
-            avg_acc = total_acc_cost // len(accommodations) if accommodations else 0
-            total_estimate = min_flight + avg_acc
-            
-            recommendations["予算目安"] = {
-                "最安航空券": f"¥{min_flight:,}",
-                "平均宿泊費": f"¥{avg_acc:,}",
-                "総額目安": f"¥{total_estimate:,}"
-            }
-        
-        return json.dumps(recommendations, ensure_ascii=False, indent=2)
-    
-    except Exception as e:
-        return f"おすすめ情報の取得中にエラーが発生しました: {str(e)}"
-
-
-@function_tool
-@sync_to_async
-def get_reservation_detail(reservation_number: str) -> str:
-    """予約番号に基づいて予約詳細情報を取得"""
-    try:
-        import uuid
-        
-        # UUID形式の文字列を適切に処理
-        try:
-            # 文字列をUUIDオブジェクトに変換して検証
-            uuid_obj = uuid.UUID(reservation_number)
-            booking = Booking.objects.get(reservation_number=uuid_obj)
-        except ValueError:
-            # UUID形式でない場合は、文字列として検索を試行
-            booking = Booking.objects.get(reservation_number=reservation_number)
-        
-        # 宿泊日数を計算
-        from datetime import date, datetime
-        
-        checkin_date = None
-        checkout_date = None
-        nights = 1
-        
-        if booking.from_date:
-            # 日付型に統一して変換
-            if isinstance(booking.from_date, datetime):
-                checkin_date = booking.from_date.date()
-            elif isinstance(booking.from_date, date):
-                checkin_date = booking.from_date
-            else:
-                try:
-                    checkin_date = datetime.strptime(str(booking.from_date), '%Y-%m-%d').date()
-                except (ValueError, TypeError):
-                    checkin_date = date.today()
-        
-        if booking.to_date:
-            if isinstance(booking.to_date, datetime):
-                checkout_date = booking.to_date.date()
-            elif isinstance(booking.to_date, date):
-                checkout_date = booking.to_date
-            else:
-                try:
-                    checkout_date = datetime.strptime(str(booking.to_date), '%Y-%m-%d').date()
-                except (ValueError, TypeError):
-                    checkout_date = date.today()
-        
-        # 宿泊日数計算
-        if checkin_date and checkout_date:
-            nights = (checkout_date - checkin_date).days
-            if nights <= 0:
-                nights = 1
-        
-        # チェックインまでの日数を計算
-        days_until_checkin = 0
-        if checkin_date:
-            days_until_checkin = (checkin_date - date.today()).days
-        
-        # 航空券情報を取得
-        flights = booking.air.all()
-        flights_info = []
-        flight_total = 0
-        
-        for flight in flights:
-            flight_cost = flight.fee * booking.num_of_people
-            flight_total += flight_cost
-            
-            flights_info.append({
-                "便名": flight.flight_number,
-                "航空会社": flight.name,
-                "出発地": flight.place_from,
-                "到着地": flight.place_to,
-                "出発日時": flight.departure_time.strftime('%Y年%m月%d日 %H:%M'),
-                "到着日時": flight.arrival_time.strftime('%Y年%m月%d日 %H:%M'),
-                "料金": f"¥{flight.fee:,}",
-                "料金合計": f"¥{flight_cost:,} ({booking.num_of_people}名分)",
-                "便種別": flight.get_flight_type_display()
-            })
-        
-        # 宿泊施設情報
-        accommodation_total = 0
-        accommodation_info = {}
-        
-        if booking.accommodations:
-            accommodation_cost = booking.accommodations.price_per_night * nights * booking.num_of_people
-            accommodation_total = accommodation_cost
-            
-            accommodation_info = {
-                "施設名": booking.accommodations.name,
-                "所在地": booking.accommodations.location,
-                "ランク": f"{'⭐' * booking.accommodations.rank} ({booking.accommodations.rank}つ星)",
-                "1泊料金": f"¥{booking.accommodations.price_per_night:,}",
-                "宿泊日数": f"{nights}泊",
-                "料金合計": f"¥{accommodation_cost:,} ({nights}泊 × {booking.num_of_people}名)",
-                "設備": booking.accommodations.amenities[:5] if booking.accommodations.amenities else []
-            }
-        
-        # 正しい合計金額を計算
-        calculated_total = accommodation_total + flight_total
-        
-        # 予約ステータス
-        status = "予約確定"
-        if days_until_checkin > 0:
-            status_detail = f"チェックインまで{days_until_checkin}日"
-        elif days_until_checkin == 0:
-            status_detail = "本日チェックイン"
-        else:
-            status_detail = "チェックイン済み"
-        
-        # 予約詳細を構築
-        reservation_detail = {
-            "予約番号": str(booking.reservation_number),
-            "予約ステータス": status,
-            "ステータス詳細": status_detail,
-            "お客様情報": {
-                "予約人数": f"{booking.num_of_people}名",
-                "旅行先": booking.place
-            },
-            "宿泊情報": accommodation_info if booking.accommodations else "宿泊施設なし",
-            "航空券情報": flights_info if flights_info else "航空券なし",
-            "日程": {
-                "チェックイン": checkin_date.strftime('%Y年%m月%d日') if checkin_date else "未設定",
-                "チェックアウト": checkout_date.strftime('%Y年%m月%d日') if checkout_date else "未設定",
-                "宿泊日数": f"{nights}泊",
-                "チェックインまで": f"{max(0, days_until_checkin)}日"
-            },
-            "料金詳細": {
-                "宿泊料金": f"¥{accommodation_total:,}" if accommodation_total > 0 else "¥0",
-                "航空券料金": f"¥{flight_total:,}" if flight_total > 0 else "¥0",
-                "合計金額": f"¥{calculated_total:,}",
-                "保存済み金額": f"¥{booking.total_fee:,}",
-                "金額一致": "はい" if calculated_total == booking.total_fee else "いいえ（人数反映後の金額を表示）"
-            }
-        }
-        
-        return json.dumps(reservation_detail, ensure_ascii=False, indent=2)
-        
-    except Booking.DoesNotExist:
-        return f"予約番号「{reservation_number}」の予約情報が見つかりませんでした。正しい予約番号を確認してください。"
-    except Exception as e:
-        return f"予約詳細の取得中にエラーが発生しました: {str(e)}"
+# 検索系ツールは共通の旅行検索サービスをfunction_toolとして公開する
+search_air = function_tool(sync_to_async(travel_service.search_air))
+search_accommodations = function_tool(sync_to_async(travel_service.search_accommodations))
+get_travel_recommendations = function_tool(sync_to_async(travel_service.get_travel_recommendations))
+get_reservation_detail = function_tool(sync_to_async(travel_service.get_reservation_detail))
 
 
 @function_tool
 @sync_to_async
+@traced_tool('make_reservation')
 def make_reservation(
     customer_name: str,
     customer_email: str,
@@ -651,6 +223,11 @@ def make_reservation(
         for flight_info in selected_flights:
             booking.air.add(flight_info['flight'])
         
+        # 会話中のチャットセッションの予約成功として記録（チャット外から呼ばれた場合は記録しない）
+        chat_session = session_metrics.current_session()
+        if chat_session is not None:
+            session_metrics.record_booking(chat_session)
+        
         # 予約詳細の構築
         flight_details = []
         for flight_info in selected_flights:
@@ -687,7 +264,7 @@ def make_reservation(
             "宿泊情報": {
                 "施設名": accommodation.name,
                 "所在地": accommodation.location,
-                "ランク": f"{'⭐' * accommodation.rank} ({accommodation.rank}つ星)",
+                "ランク": rank_label(accommodation.rank),
                 "チェックイン": checkin.strftime('%Y年%m月%d日'),
                 "チェックアウト": checkout.strftime('%Y年%m月%d日'),
                 "宿泊日数": f"{nights}泊",
@@ -710,7 +287,7 @@ def make_reservation(
         if special_requests:
             reservation_result["特記事項"] = special_requests
         
-        return json.dumps(reservation_result, ensure_ascii=False, indent=2)
+        return format_tool_output('make_reservation', reservation_result)
         
     except Exception as e:
         return json.dumps({
@@ -845,13 +422,50 @@ def setup_agent_network():
     pass
 
 
+class StoreBackedSession(SessionABC):
+    """ConversationStoreを介して会話履歴を読み書きするagents用セッション"""
+    
+    def __init__(self, session_id: str, store):
+        self.session_id = session_id
+        self.store = store
+    
+    async def get_items(self, limit: int | None = None) -> list:
+        with spans.span('persist', 'conversation_store.load'):
+            return await sync_to_async(self.store.load)(self.session_id, limit)
+    
+    async def add_items(self, items: list) -> None:
+        with spans.span('persist', 'conversation_store.append'):
+            await sync_to_async(self.store.append)(self.session_id, list(items))
+    
+    async def pop_item(self):
+        return await sync_to_async(self.store.pop)(self.session_id)
+    
+    async def clear_session(self) -> None:
+        await sync_to_async(self.store.clear)(self.session_id)
+
+
+class LLMSpanHooks(RunHooks):
+    """エージェント実行中のLLM呼び出しを処理区間として記録"""
+    
+    def __init__(self):
+        self._started = []
+    
+    async def on_llm_start(self, context, agent, system_prompt, input_items) -> None:
+        self._started.append(time.perf_counter())
+    
+    async def on_llm_end(self, context, agent, response) -> None:
+        if self._started:
+            spans.add_span('llm', agent.name, self._started.pop(), time.perf_counter())
+
+
 class TravelAgentSystem:
     """bookiniad.com マルチエージェントシステム（クラス版）"""
     
-    def __init__(self, session_id: str = "bookiniad_travel_chat", db_path: str = "./agents_conversation.db"):
-        """エージェントシステムの初期化"""
+    def __init__(self, session_id: str = "bookiniad_travel_chat", db_path: str = None, store=None):
+        """エージェントシステムの初期化（store未指定時はプロセス内メモリ、db_path指定時はそのSQLiteファイルに履歴を保存）"""
         self.session_id = session_id
         self.db_path = db_path
+        self.store = store
         self.runner = None
         self.config = None
         self.current_session = None
@@ -871,26 +485,32 @@ class TravelAgentSystem:
     def _init_system(self):
         """内部システムの初期化"""
         if self.runner is None:
-            # モデル設定
+            # モデル設定（プロセス共通のプール済み非同期クライアントを注入）
             self.config = RunConfig(
-                model="gpt-4o-mini"
+                model="gpt-4o-mini",
+                model_provider=OpenAIProvider(
+                    openai_client=get_async_openai_client(),
+                    use_responses=settings.OPENAI_AGENTS_USE_RESPONSES,
+                )
             )
             
             # ランナーを初期化（会話履歴を保持）
             self.runner = Runner()
             
-            # SQLiteSessionで会話履歴を永続化
-            self.current_session = SQLiteSession(
+            # ConversationStoreで会話履歴を永続化（どのワーカーからも同じ履歴を参照）
+            if self.store is None:
+                self.store = SQLiteConversationStore(self.db_path) if self.db_path else InMemoryConversationStore()
+            self.current_session = StoreBackedSession(
                 session_id=self.session_id,
-                db_path=self.db_path
+                store=self.store
             )
             
             print("🎯 エージェントシステムが初期化されました")
-            print(f"📁 セッションファイル: {self.db_path}")
+            print(f"📁 会話履歴ストア: {self.store.name}")
             print(f"セッションid: {self.session_id}")
     
     def chat(self, user_message: str, target_agent: str = "base_agent") -> str:
-        """指定されたエージェントでチャットを実行（SQLiteSessionで会話履歴を保持）"""
+        """指定されたエージェントでチャットを実行（ConversationStoreで会話履歴を保持）"""
         # 初期化チェック
         if self.runner is None:
             self._init_system()
@@ -898,13 +518,15 @@ class TravelAgentSystem:
         try:
             # 対象エージェントを選択
             
-            # SQLiteSessionを使用して会話履歴を保持しながらチャット実行
-            result = self.runner.run_sync(
+            # ストア経由のセッションを使用して会話履歴を保持しながらチャット実行
+            # （クライアントの接続プールを共有するため常駐イベントループ上で実行）
+            result = run_coroutine(self.runner.run(
                 input=user_message,
                 run_config=self.config,
                 starting_agent=base_agent,
-                session=self.current_session  # SQLiteSessionを直接使用
-            )
+                session=self.current_session,
+                hooks=LLMSpanHooks()
+            ))
             
             # 結果から応答を抽出（RunResultから最終的な出力を取得）
             try:
@@ -937,40 +559,27 @@ class TravelAgentSystem:
             return f"エラーが発生しました: {str(e)}"
     
     def clear_conversation(self):
-        """会話履歴をクリア（SQLiteSessionをリセット）"""
-        import uuid
-        
-        if self.current_session:
-            # 新しいセッションIDで新しいSQLiteSessionを作成して履歴をクリア
-            new_session_id = f"{self.session_id}_{uuid.uuid4().hex[:8]}"
-            self.current_session = SQLiteSession(
-                session_id=new_session_id,
-                db_path=self.db_path
-            )
-            self.session_id = new_session_id
+        """会話履歴をクリア（ストア上のセッション履歴を削除）"""
+        if self.store is not None:
+            self.store.clear(self.session_id)
         
-        print("🗑️ 会話履歴がクリアされました（新しいセッションを開始）")
+        print("🗑️ 会話履歴がクリアされました")
     
     def get_conversation_status(self) -> str:
         """現在の会話状態を取得"""
         if self.current_session is None:
             return "新しい会話セッション"
         else:
-            # SQLiteSessionの情報を取得
-            try:
-                # セッション内の会話数を取得（可能であれば）
-                return f"SQLiteセッション(ID: {self.session_id[:20]}...)"
-            except Exception:
-                return "SQLiteセッション"
+            return f"{self.store.name}セッション(ID: {self.session_id[:20]}...)"
     
     def get_conversation_history(self) -> str:
-        """会話履歴を表示（SQLiteSessionから取得）"""
+        """会話履歴を表示（ストアから取得）"""
         if self.current_session is None:
             return "会話履歴がありません"
         
         try:
-            # SQLiteSessionから履歴を取得する方法は実装依存
-            return f"SQLiteセッション({self.session_id})から履歴を取得中..."
+            items = self.store.load(self.session_id)
+            return json.dumps(items, ensure_ascii=False, indent=2) if items else "会話履歴がありません"
         except Exception as e:
             return f"履歴取得エラー: {str(e)}"
     
@@ -982,7 +591,7 @@ class TravelAgentSystem:
         """システム情報を取得"""
         return {
             "セッションID": self.session_id,
-            "データベースパス": self.db_path,
+            "会話履歴ストア": self.store.name if self.store else (self.db_path or 'memory'),
             "利用可能エージェント": self.get_available_agents(),
             "現在の状態": self.get_conversation_status()
         }
@@ -0,0 +1,153 @@
+import json
+
+from django.conf import settings
+
+# メッセージ1件あたりの固定オーバーヘッド（role・区切りトークン分）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text) -> int:
+    """テキストのトークン数を概算（ASCIIは約4文字/トークン、日本語等は約1文字/トークン）"""
+    if not text:
+        return 0
+    if not isinstance(text, str):
+        text = json.dumps(text, ensure_ascii=False)
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def estimate_message_tokens(message: dict) -> int:
+    """メッセージ1件のトークン数を概算"""
+    tokens = MESSAGE_OVERHEAD_TOKENS + estimate_tokens(message.get('content'))
+    for tool_call in message.get('tool_calls') or []:
+        function = tool_call.get('function', {})
+        tokens += estimate_tokens(function.get('name')) + estimate_tokens(function.get('arguments'))
+    return tokens
+
+
+def summarize_tool_result(name: str, content: str, max_chars: int = 160) -> str:
+    """過去のツール結果を短い要約に圧縮"""
+    if not content:
+        return f"[{name}の結果: なし]"
+    body = content.strip()
+    try:
+        data = json.loads(body)
+    except (ValueError, TypeError):
+        data = None
+    if isinstance(data, list):
+        preview = json.dumps(data[:2], ensure_ascii=False, separators=(',', ':'))
+        return f"[{name}の結果(要約): {len(data)}件 {preview[:max_chars]}]"
+    if len(body) <= max_chars:
+        return body
+    # compact形式（件数・ヘッダー・先頭行）やテキストは先頭数行だけを残す
+    head = ' / '.join(body.splitlines()[:3])
+    return f"[{name}の結果(要約): {head[:max_chars]}…]"
+
+
+def _group_blocks(history: list) -> list:
+    """tool_callとtool結果を1つのブロックにまとめる（対応が欠けたものは除外）"""
+    blocks = []
+    index = 0
+    while index < len(history):
+        message = history[index]
+        if message.get('role') == 'tool':
+            # 対応するtool_callのない孤立したtool結果はAPIエラーになるため除外
+            index += 1
+            continue
+        block = [message]
+        index += 1
+        if message.get('role') == 'assistant' and message.get('tool_calls'):
+            call_ids = {tool_call.get('id') for tool_call in message['tool_calls']}
+            while index < len(history) and history[index].get('role') == 'tool':
+                if history[index].get('tool_call_id') in call_ids:
+                    block.append(history[index])
+                index += 1
+            answered = {result.get('tool_call_id') for result in block[1:]}
+            if answered != call_ids:
+                continue
+        blocks.append(block)
+    return blocks
+
+
+class ContextWindowBuilder:
+    """トークン予算内でAPIに送るメッセージを組み立てる
+
+    - tool_callとtool結果のペアは必ず一緒に残す（片方だけを送らない）
+    - 直近keep_tool_turnsターンより古いtool結果は要約に置き換える
+    - 新しいブロックから予算に収まる分だけを残す
+    """
+
+    def __init__(self, budget_tokens: int = None, keep_tool_turns: int = None):
+        self.budget_tokens = budget_tokens or settings.ASSISTANT_CONTEXT_BUDGET_TOKENS
+        self.keep_tool_turns = keep_tool_turns if keep_tool_turns is not None else settings.ASSISTANT_CONTEXT_KEEP_TOOL_TURNS
+
+    def build(self, system_prompt: str, history: list, user_message: str = None):
+        """(メッセージリスト, 統計情報) を返す"""
+        system_message = {"role": "system", "content": system_prompt}
+        history_tokens = sum(estimate_message_tokens(message) for message in history)
+
+        blocks = _group_blocks(history)
+        compacted = 0
+
+        # ブロックごとに「何ターン前か」を数え、古いtool結果を要約する
+        turn_age = 0
+        prepared = []
+        for block in reversed(blocks):
+            if block[0].get('tool_calls') and turn_age >= self.keep_tool_turns:
+                names = {tool_call.get('id'): tool_call.get('function', {}).get('name', 'tool') for tool_call in block[0]['tool_calls']}
+                compact_block = [block[0]]
+                for result in block[1:]:
+                    summary = summarize_tool_result(result.get('name') or names.get(result.get('tool_call_id'), 'tool'), result.get('content') or '')
+                    if summary != result.get('content'):
+                        compacted += 1
+                    compact_block.append({**result, "content": summary})
+                block = compact_block
+            prepared.append(block)
+            if block[0].get('role') == 'user':
+                turn_age += 1
+        prepared.reverse()
+
+        # ターン途中（tool結果の直後）の場合、最後のユーザー発言以降は必ず送る
+        mandatory_start = len(prepared)
+        if prepared and prepared[-1][0].get('tool_calls'):
+            mandatory_start = max(
+                (position for position, block in enumerate(prepared) if block[0].get('role') == 'user'),
+                default=len(prepared) - 1
+            )
+
+        used = estimate_message_tokens(system_message)
+        if user_message is not None:
+            used += estimate_message_tokens({"role": "user", "content": user_message})
+        for block in prepared[mandatory_start:]:
+            used += sum(estimate_message_tokens(message) for message in block)
+
+        selected = []
+        for block in reversed(prepared[:mandatory_start]):
+            block_tokens = sum(estimate_message_tokens(message) for message in block)
+            if used + block_tokens > self.budget_tokens:
+                break
+            selected.append(block)
+            used += block_tokens
+        selected.reverse()
+        selected.extend(prepared[mandatory_start:])
+
+        messages = [system_message]
+        for block in selected:
+            messages.extend(block)
+        sent_messages = len(messages) - 1
+        if user_message is not None:
+            messages.append({"role": "user", "content": user_message})
+
+        history_sent_tokens = used - estimate_message_tokens(system_message)
+        if user_message is not None:
+            history_sent_tokens -= estimate_message_tokens({"role": "user", "content": user_message})
+        stats = {
+            'budget_tokens': self.budget_tokens,
+            'prompt_tokens': used,
+            'history_tokens': history_tokens,
+            'saved_tokens': max(0, history_tokens - history_sent_tokens),
+            'compacted_tool_results': compacted,
+            'dropped_messages': len(history) - sent_messages,
+            'over_budget': used > self.budget_tokens,
+        }
+        return messages, stats
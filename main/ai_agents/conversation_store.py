@@ -0,0 +1,226 @@
+import json
+import sqlite3
+import threading
+
+from django.conf import settings
+from django.db import transaction
+
+from main.models import ChatSession, ChatMessage
+
+
+def _item_text(item) -> str:
+    """会話アイテムから表示用のテキストを取り出す"""
+    content = item.get('content') if isinstance(item, dict) else None
+    if isinstance(content, str):
+        return content
+    if content is None:
+        return item.get('type', '') if isinstance(item, dict) else ''
+    return json.dumps(content, ensure_ascii=False)
+
+
+class ConversationStore:
+    """会話履歴ストアの基底クラス
+
+    会話アイテムはOpenAI形式の辞書（role/content/tool_calls等）で保持する。
+    TravelChatAssistantとTravelAgentSystemはこのインターフェースだけを介して
+    履歴を読み書きするため、どのワーカーでも同じ会話を継続できる。
+    """
+
+    name = 'base'
+
+    def load(self, session_id: str, limit: int = None) -> list:
+        """会話アイテムを古い順に取得（limit指定時は最新N件）"""
+        raise NotImplementedError
+
+    def append(self, session_id: str, items: list) -> None:
+        """会話アイテムを末尾に追加"""
+        raise NotImplementedError
+
+    def pop(self, session_id: str):
+        """最新の会話アイテムを削除して返す"""
+        raise NotImplementedError
+
+    def clear(self, session_id: str) -> None:
+        """セッションの会話履歴をすべて削除"""
+        raise NotImplementedError
+
+
+class InMemoryConversationStore(ConversationStore):
+    """プロセス内メモリに履歴を保持するストア（CLI・単一プロセス用）"""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def load(self, session_id, limit=None):
+        with self._lock:
+            items = list(self._items.get(session_id, []))
+        return items[-limit:] if limit else items
+
+    def append(self, session_id, items):
+        if not items:
+            return
+        with self._lock:
+            self._items.setdefault(session_id, []).extend(items)
+
+    def pop(self, session_id):
+        with self._lock:
+            items = self._items.get(session_id)
+            return items.pop() if items else None
+
+    def clear(self, session_id):
+        with self._lock:
+            self._items.pop(session_id, None)
+
+
+class DatabaseConversationStore(ConversationStore):
+    """ChatMessageテーブルに履歴を保持するストア（複数ワーカー・複数コンテナ対応）
+
+    LLMに渡す会話アイテムは message_type='context' の行として保存し、
+    アイテム本体は reasoning_process に格納する。
+    コンテキスト行はChatMessage.objects（既定のマネージャー）からは見えず、ChatMessage.all_objectsで読み書きする。
+    """
+
+    name = 'database'
+    message_type = 'context'
+
+    def _messages(self, session_id):
+        return ChatMessage.all_objects.filter(
+            session__session_id=session_id,
+            message_type=self.message_type
+        )
+
+    def load(self, session_id, limit=None):
+        queryset = self._messages(session_id).order_by('-id').values_list('reasoning_process', flat=True)
+        if limit:
+            queryset = queryset[:limit]
+        items = list(queryset)
+        items.reverse()
+        return items
+
+    def append(self, session_id, items):
+        if not items:
+            return
+        session_pk = ChatSession.objects.filter(session_id=session_id).values_list('pk', flat=True).first()
+        if session_pk is None:
+            raise ChatSession.DoesNotExist(f"セッション「{session_id}」が見つかりません")
+        ChatMessage.all_objects.bulk_create([
+            ChatMessage(
+                session_id=session_pk,
+                message_type=self.message_type,
+                content=_item_text(item),
+                reasoning_process=item
+            )
+            for item in items
+        ])
+
+    def pop(self, session_id):
+        with transaction.atomic():
+            message = self._messages(session_id).order_by('-id').first()
+            if message is None:
+                return None
+            message.delete()
+            return message.reasoning_process
+
+    def clear(self, session_id):
+        self._messages(session_id).delete()
+
+
+class SQLiteConversationStore(ConversationStore):
+    """SQLiteファイルに履歴を保持するストア（Django DBを使わない構成向け）"""
+
+    name = 'sqlite'
+
+    def __init__(self, db_path: str):
+        self.db_path = str(db_path)
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    connection.execute(
+                        'CREATE TABLE IF NOT EXISTS conversation_items ('
+                        'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                        'session_id TEXT NOT NULL, '
+                        'item TEXT NOT NULL, '
+                        'created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)'
+                    )
+                    connection.execute(
+                        'CREATE INDEX IF NOT EXISTS idx_conversation_items_session '
+                        'ON conversation_items (session_id, id)'
+                    )
+                    connection.commit()
+                    self._initialized = True
+        return connection
+
+    def load(self, session_id, limit=None):
+        connection = self._connection()
+        if limit:
+            rows = connection.execute(
+                'SELECT item FROM conversation_items WHERE session_id = ? ORDER BY id DESC LIMIT ?',
+                (session_id, limit)
+            ).fetchall()
+            rows.reverse()
+        else:
+            rows = connection.execute(
+                'SELECT item FROM conversation_items WHERE session_id = ? ORDER BY id',
+                (session_id,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def append(self, session_id, items):
+        if not items:
+            return
+        connection = self._connection()
+        with connection:
+            connection.executemany(
+                'INSERT INTO conversation_items (session_id, item) VALUES (?, ?)',
+                [(session_id, json.dumps(item, ensure_ascii=False)) for item in items]
+            )
+
+    def pop(self, session_id):
+        connection = self._connection()
+        with connection:
+            row = connection.execute(
+                'SELECT id, item FROM conversation_items WHERE session_id = ? ORDER BY id DESC LIMIT 1',
+                (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute('DELETE FROM conversation_items WHERE id = ?', (row[0],))
+        return json.loads(row[1])
+
+    def clear(self, session_id):
+        connection = self._connection()
+        with connection:
+            connection.execute('DELETE FROM conversation_items WHERE session_id = ?', (session_id,))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_conversation_store() -> ConversationStore:
+    """設定（CONVERSATION_STORE）に応じたプロセス共通のストアを取得"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                backend = getattr(settings, 'CONVERSATION_STORE', 'database')
+                if backend == 'sqlite':
+                    _store = SQLiteConversationStore(settings.CONVERSATION_STORE_PATH)
+                elif backend == 'memory':
+                    _store = InMemoryConversationStore()
+                else:
+                    _store = DatabaseConversationStore()
+    return _store
@@ -0,0 +1,72 @@
+from django.conf import settings
+
+from main.ai_agents.intents import IntentClassifier, chat_classifier
+
+# LLMを呼ばずに定型文で応答するルーティング（挨拶・お礼・よくある質問）
+
+# 検索・予約・おすすめなど、LLM（ツール呼び出し）が必要なインテント
+SUBSTANTIVE_INTENTS = {'flight_search', 'accommodation_search', 'travel_recommendation'}
+
+TRIVIAL_INTENTS = [
+    ('greeting', 0.95, ['こんにちは', 'こんばんは', 'おはよう', 'はじめまして', 'hello']),
+    ('thanks', 0.95, ['ありがとう', 'thank', 'thanks', '助かりました']),
+]
+
+# よくある質問（内容はルールベースBotのFAQと同じ）
+# キーワードは「込み」「変更」のような語幹ではなく句で書く（「申し込み」「パスワードを変更」に一致させない）
+FAQ_TOPICS = [
+    ('cancel', 0.9, ['キャンセル', '取り消し', '取消']),
+    ('change', 0.9, ['予約を変更', '予約の変更', '予約変更', '日程を変更', '日程の変更', '日程変更']),
+    ('price_includes', 0.9, ['料金に含まれる', '含まれるもの', '税金', '税込', '込みの料金', '込みの値段']),
+    ('booking_check', 0.9, ['予約の確認', '予約確認', '予約を確認', '予約内容', '予約照会']),
+    ('how_to_book', 0.85, ['予約方法', '予約の方法', '予約の仕方', '申し込み方法']),
+]
+
+TEMPLATES = {
+    'greeting': ('こんにちは！bookiniad.comです。\n'
+                 '航空券・宿泊施設の検索やご予約の確認をお手伝いします。\n'
+                 '行き先やご希望の日程を教えてください。'),
+    'thanks': ('どういたしまして！\n'
+               '他にもご旅行についてお手伝いできることがあれば、お気軽にお聞きください。'),
+    'cancel': ('予約のキャンセルは出発日の3日前まで可能です。\n'
+               'ご予約内容は予約照会ページ（/booking/inquiry/）からご確認いただけます。'),
+    'change': ('予約の変更は出発日の7日前まで可能です。\n'
+               'ご予約内容は予約照会ページ（/booking/inquiry/）からご確認いただけます。'),
+    'price_includes': '表示料金には宿泊費、航空券代、税金が含まれます。',
+    'booking_check': ('ご予約の確認は予約照会ページ（/booking/inquiry/）で予約番号を入力してください。\n'
+                      'このチャットに予約番号を送っていただいても確認できます。'),
+    'how_to_book': ('航空券検索（/flights/）または宿泊施設検索（/accommodations/）から'
+                    'ご希望の便・施設をカートに追加し、カートから予約手続きに進んでください。\n'
+                    '条件を教えていただければ、このチャットでもお探しします。'),
+}
+
+trivial_classifier = IntentClassifier(TRIVIAL_INTENTS, default_intent=None, default_confidence=0.0)
+faq_classifier = IntentClassifier(FAQ_TOPICS, default_intent=None, default_confidence=0.0)
+
+
+def route(message: str):
+    """定型文で応答できる場合は {'route', 'intent', 'confidence', 'content'} を返す（LLMが必要ならNone）"""
+    if not getattr(settings, 'FAST_PATH_ENABLED', True) or not message:
+        return None
+
+    # 検索・おすすめなど実質的な要求を含む場合、予約番号を含む場合はLLMへ
+    chat_scores = chat_classifier.scores(message)
+    if SUBSTANTIVE_INTENTS & chat_scores.keys() or any(char.isdigit() for char in message):
+        return None
+
+    min_confidence = settings.FAST_PATH_MIN_CONFIDENCE
+
+    # よくある質問
+    topic, confidence = faq_classifier.classify(message)
+    if topic and confidence >= min_confidence:
+        return {'route': 'fast_path_faq', 'intent': 'info', 'faq_topic': topic,
+                'confidence': confidence, 'content': TEMPLATES[topic]}
+
+    # 挨拶・お礼は短いメッセージのみ（「こんにちは、〜したい」のような続きはLLMへ）
+    if len(message) > settings.FAST_PATH_MAX_LENGTH:
+        return None
+    intent, confidence = trivial_classifier.classify(message)
+    if intent and confidence >= min_confidence:
+        return {'route': f'fast_path_{intent}', 'intent': 'greeting' if intent == 'greeting' else 'courtesy',
+                'confidence': confidence, 'content': TEMPLATES[intent]}
+    return None
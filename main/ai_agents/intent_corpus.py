@@ -0,0 +1,65 @@
+# 意図検出のラベル付きコーパス（テストとベンチマーク用）
+# (メッセージ, 期待するインテント)
+
+CHAT_CORPUS = [
+    ('東京から沖縄への航空券を探しています', 'flight_search'),
+    ('来週のフライトはありますか', 'flight_search'),
+    ('飛行機で大阪に行きたい', 'flight_search'),
+    ('NH103便の空席は？', 'flight_search'),
+    ('Air ticket to Fukuoka', 'flight_search'),
+    ('沖縄のホテルを教えて', 'accommodation_search'),
+    ('京都で宿泊したい', 'accommodation_search'),
+    ('札幌の泊まりはどこがいい？', 'accommodation_search'),
+    ('hotel in Tokyo please', 'accommodation_search'),
+    ('温泉宿に泊まりたい', 'accommodation_search'),
+    ('予約番号を照会したい', 'booking_inquiry'),
+    ('予約内容を見たい', 'booking_inquiry'),
+    ('my booking status', 'booking_inquiry'),
+    ('沖縄のおすすめは？', 'travel_recommendation'),
+    ('北海道旅行のプランを考えて', 'travel_recommendation'),
+    ('Recommend a trip for the weekend', 'travel_recommendation'),
+    ('こんにちは', 'greeting'),
+    ('はじめまして、よろしくお願いします', 'greeting'),
+    ('Hello!', 'greeting'),
+    ('こんばんは', 'greeting'),
+    ('ありがとうございました', 'courtesy'),
+    ('Thanks a lot', 'courtesy'),
+    ('すみません、もう一度', 'courtesy'),
+    ('予約の確認方法', 'info'),
+    ('キャンセルはどうすればいいですか', 'info'),
+    ('支払いはカードでできますか', 'info'),
+    ('このサイトの使い方を教えて', 'info'),
+    ('天気はどう？', 'general'),
+    ('', 'general'),
+]
+
+BOT_MENU_CORPUS = [
+    ('こんにちは', 'greeting'),
+    ('リセット', 'greeting'),
+    ('もどる', 'greeting'),
+    ('1', 'search_menu'),
+    ('旅行を検索したい', 'search_menu'),
+    ('ホテルを探す', 'search_menu'),
+    ('2', 'booking_inquiry'),
+    ('予約確認', 'booking_inquiry'),
+    ('booking', 'booking_inquiry'),
+    ('3', 'faq'),
+    ('よくある質問', 'faq'),
+    ('FAQ', 'faq'),
+    ('うーん', 'fallback'),
+]
+
+BOT_SEARCH_TYPE_CORPUS = [
+    ('宿泊', 'accommodation_search_start'),
+    ('ホテルがいい', 'accommodation_search_start'),
+    ('泊まる場所', 'accommodation_search_start'),
+    ('航空券', 'flight_search_start'),
+    ('フライトで', 'flight_search_start'),
+    ('飛行機', 'flight_search_start'),
+    ('パッケージ', 'package_search_start'),
+    ('セットで', 'package_search_start'),
+    ('旅行全部', 'package_search_start'),
+    ('最初から', 'reset'),
+    ('戻る', 'reset'),
+    ('東京', None),
+]
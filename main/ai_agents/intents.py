@@ -0,0 +1,111 @@
+import re
+
+# インテントのキーワード表（上から優先度順、confidenceは単独キーワード一致時の信頼度）
+# AIエージェント/アシスタントの意図検出
+CHAT_INTENTS = [
+    ('flight_search', 0.9, ['航空券', 'フライト', '飛行機', 'air', '便']),
+    ('accommodation_search', 0.9, ['ホテル', '宿泊', '泊まり', 'hotel', 'accommodation', '宿']),
+    # 「〜できますか」で終わる検索の質問を検索として扱うため、検索より下に置く
+    ('info', 0.85, ['方法', '使い方', 'どうやって', 'どうすれば', 'とは', 'できますか']),
+    ('booking_inquiry', 0.9, ['予約', 'booking', '予約番号', '照会']),
+    ('travel_recommendation', 0.8, ['推奨', 'おすすめ', 'recommend', '旅行', 'travel']),
+    ('greeting', 0.95, ['こんにちは', 'hello', 'はじめまして', 'こんばんは']),
+    ('courtesy', 0.9, ['ありがとう', 'thank', 'thanks', 'すみません']),
+]
+
+# ルールベースBotのメインメニュー
+BOT_MENU_INTENTS = [
+    ('greeting', 1.0, ['こんにちは', 'hello', 'はじめまして', 'リセット', 'もどる']),
+    ('search_menu', 1.0, ['検索', '探す', '1']),
+    ('booking_inquiry', 1.0, ['予約', 'booking', '予約確認', '予約照会', '2']),
+    ('faq', 1.0, ['faq', 'よくある質問', '質問', '3']),
+]
+
+# ルールベースBotの検索タイプ選択
+BOT_SEARCH_TYPE_INTENTS = [
+    ('accommodation_search_start', 1.0, ['宿泊', 'ホテル', '泊まる']),
+    ('flight_search_start', 1.0, ['航空券', 'フライト', '飛行機']),
+    ('package_search_start', 1.0, ['パッケージ', 'セット', '旅行']),
+    ('reset', 1.0, ['リセット', 'もどる', '戻る', '最初']),
+]
+
+# detect_intent_advanced用（複数ラベル）
+ADVANCED_INTENTS = [
+    ('search', 1.0, ['検索', '探す', 'search', '探して']),
+    ('booking', 1.0, ['予約', 'booking', '申し込み']),
+    ('greeting', 1.0, ['こんにちは', 'hello', 'はじめまして']),
+]
+
+# 同じインテントのキーワードが複数一致した場合の信頼度の上乗せ幅
+MULTI_MATCH_BONUS = 0.03
+
+
+def _trie_pattern(keywords) -> str:
+    """キーワード集合を共通接頭辞でまとめた正規表現に変換（最長一致）"""
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # ここで終わるキーワードがある場合は続きを省略可能にする（貪欲なので長い方が優先）
+        return f'(?:{body})?' if '' in node else body
+
+    return build(trie)
+
+
+class IntentClassifier:
+    """キーワード表を1つの正規表現にまとめ、メッセージを1回の走査で分類する"""
+
+    def __init__(self, table, default_intent: str = 'general', default_confidence: float = 0.8):
+        self.table = table
+        self.default_intent = default_intent
+        self.default_confidence = default_confidence
+        self._priority = {intent: index for index, (intent, _, _) in enumerate(table)}
+        self._base_confidence = {intent: confidence for intent, confidence, _ in table}
+
+        # キーワード→インテントの対応と、全キーワードをまとめた1つの正規表現
+        self._keyword_intent = {}
+        for intent, _, keywords in table:
+            for keyword in keywords:
+                self._keyword_intent.setdefault(keyword.lower(), intent)
+        self._pattern = re.compile(_trie_pattern(self._keyword_intent))
+
+    def _confidence(self, intent: str, count: int) -> float:
+        """一致数に応じた信頼度（同じインテントのキーワードが多いほど高い）"""
+        base = self._base_confidence[intent]
+        return base if base >= 1.0 else min(0.99, base + MULTI_MATCH_BONUS * (count - 1))
+
+    def scores(self, message: str) -> dict:
+        """一致したインテントごとの信頼度"""
+        hits = {}
+        for keyword in self._pattern.findall((message or '').lower()):
+            intent = self._keyword_intent[keyword]
+            hits[intent] = hits.get(intent, 0) + 1
+        return {intent: self._confidence(intent, count) for intent, count in hits.items()}
+
+    def classify(self, message: str):
+        """最も優先度の高いインテントと信頼度を返す（一致なしはデフォルト）"""
+        keywords = self._pattern.findall((message or '').lower())
+        if not keywords:
+            return self.default_intent, self.default_confidence
+        intents = [self._keyword_intent[keyword] for keyword in keywords]
+        intent = min(intents, key=self._priority.__getitem__)
+        return intent, self._confidence(intent, intents.count(intent))
+
+    def match_all(self, message: str) -> list:
+        """一致したインテントをすべて表の順で返す"""
+        scores = self.scores(message)
+        return sorted(scores, key=self._priority.__getitem__)
+
+
+chat_classifier = IntentClassifier(CHAT_INTENTS)
+bot_menu_classifier = IntentClassifier(BOT_MENU_INTENTS, default_intent='fallback', default_confidence=0.0)
+bot_search_type_classifier = IntentClassifier(BOT_SEARCH_TYPE_INTENTS, default_intent=None, default_confidence=0.0)
+advanced_classifier = IntentClassifier(ADVANCED_INTENTS)
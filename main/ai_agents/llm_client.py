@@ -0,0 +1,99 @@
+import asyncio
+import contextvars
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+
+# プロセス共通のクライアント（接続プールとkeep-aliveを全セッションで共有）
+_sync_client = None
+_async_client = None
+_client_lock = threading.Lock()
+
+# 非同期クライアント専用のイベントループ（接続プールはループに紐づくため使い回す）
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _http_options() -> dict:
+    """接続数上限・keep-alive・タイムアウトの設定を構築"""
+    import httpx
+
+    return {
+        'limits': httpx.Limits(
+            max_connections=settings.OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY,
+        ),
+        'timeout': httpx.Timeout(
+            settings.OPENAI_TIMEOUT,
+            connect=settings.OPENAI_CONNECT_TIMEOUT,
+        ),
+    }
+
+
+def _api_key() -> str:
+    """APIキーを取得（未設定の場合は設定方法を示して失敗する）"""
+    if not settings.OPENAI_API_KEY:
+        raise ImproperlyConfigured('OPENAI_API_KEYが設定されていません。環境変数または.envファイルで設定してください。')
+    return settings.OPENAI_API_KEY
+
+
+def get_openai_client() -> OpenAI:
+    """プール済みの同期OpenAIクライアントを取得（TravelChatAssistant用）"""
+    global _sync_client
+    if _sync_client is None:
+        with _client_lock:
+            if _sync_client is None:
+                _sync_client = OpenAI(
+                    api_key=_api_key(),
+                    base_url=settings.OPENAI_BASE_URL,
+                    max_retries=settings.OPENAI_MAX_RETRIES,
+                    http_client=DefaultHttpxClient(**_http_options()),
+                )
+    return _sync_client
+
+
+def get_async_openai_client() -> AsyncOpenAI:
+    """プール済みの非同期OpenAIクライアントを取得（agentsのRunConfig用）"""
+    global _async_client
+    if _async_client is None:
+        with _client_lock:
+            if _async_client is None:
+                _async_client = AsyncOpenAI(
+                    api_key=_api_key(),
+                    base_url=settings.OPENAI_BASE_URL,
+                    max_retries=settings.OPENAI_MAX_RETRIES,
+                    http_client=DefaultAsyncHttpxClient(**_http_options()),
+                )
+    return _async_client
+
+
+def _get_loop():
+    """非同期クライアント用のイベントループを常駐スレッドで起動"""
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name='llm-event-loop', daemon=True)
+                thread.start()
+                _loop = loop
+    return _loop
+
+
+async def _run_in_context(coro, context):
+    """呼び出し元スレッドのcontextvarsを引き継いでコルーチンを実行"""
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+
+def run_coroutine(coro, timeout: float = None):
+    """常駐イベントループでコルーチンを実行し、結果を同期的に待つ"""
+    future = asyncio.run_coroutine_threadsafe(
+        _run_in_context(coro, contextvars.copy_context()),
+        _get_loop()
+    )
+    return future.result(timeout)
@@ -0,0 +1,155 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from django.conf import settings
+
+from main.ai_agents.intents import chat_classifier
+from main.ai_agents.slots import extract_slots
+
+# 会話の状態に依存しないインテントのみキャッシュ対象（検索・予約は履歴や在庫に依存するため対象外）
+DEFAULT_CACHEABLE_INTENTS = ('greeting', 'courtesy', 'info')
+
+# 検索条件・予約に関わるインテント（キーワードが1つでも含まれる質問はキャッシュしない）
+SUBSTANTIVE_INTENTS = ('flight_search', 'accommodation_search', 'booking_inquiry', 'travel_recommendation')
+
+_DIGIT_PATTERN = re.compile(r'\d')
+
+# 予約番号（UUID）
+_UUID_PATTERN = re.compile(r'[0-9a-f]{8}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{12}', re.IGNORECASE)
+
+# 正規化時に取り除く記号・空白
+_STRIP_PATTERN = re.compile(r'[\s\W_]+', re.UNICODE)
+
+
+def normalize_message(message: str) -> str:
+    """全角半角・大小文字・記号・空白の違いを吸収した文字列に変換"""
+    text = unicodedata.normalize('NFKC', message or '').lower()
+    return _STRIP_PATTERN.sub('', text)
+
+
+def fingerprint(normalized: str) -> frozenset:
+    """文字n-gram（3文字、短文は2文字）の集合"""
+    size = 3 if len(normalized) >= 6 else 2
+    if len(normalized) <= size:
+        return frozenset([normalized]) if normalized else frozenset()
+    return frozenset(normalized[index:index + size] for index in range(len(normalized) - size + 1))
+
+
+def similarity(left: frozenset, right: frozenset) -> float:
+    """Jaccard係数"""
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+
+class ResponseCache:
+    """FAQ的な質問への応答をn-gram類似度で再利用するキャッシュ"""
+
+    def __init__(self, maxsize: int = 200, ttl: float = 3600, threshold: float = 0.8):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, scope: str, message: str, intent: str):
+        """類似する過去の質問の応答を返す（なければNone）"""
+        normalized = normalize_message(message)
+        if not normalized:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            # 完全一致（正規化後）を優先
+            entry = self._entries.get((scope, normalized))
+            best_key, best_score = ((scope, normalized), 1.0) if entry else (None, 0.0)
+            if entry is None:
+                query = fingerprint(normalized)
+                for key, candidate in self._entries.items():
+                    if key[0] != scope or candidate['intent'] != intent or candidate['expires_at'] <= now:
+                        continue
+                    score = similarity(query, candidate['fingerprint'])
+                    if score > best_score:
+                        best_key, best_score = key, score
+                if best_score < self.threshold:
+                    return None
+                entry = self._entries[best_key]
+            if entry['expires_at'] <= now:
+                del self._entries[best_key]
+                return None
+            self._entries.move_to_end(best_key)
+            return {
+                'content': entry['content'],
+                'intent': entry['intent'],
+                'similarity': round(best_score, 3),
+                'matched_message': entry['message'],
+            }
+
+    def store(self, scope: str, message: str, intent: str, content: str):
+        normalized = normalize_message(message)
+        if not normalized or not content:
+            return
+        with self._lock:
+            key = (scope, normalized)
+            self._entries[key] = {
+                'message': message,
+                'intent': intent,
+                'content': content,
+                'fingerprint': fingerprint(normalized),
+                'expires_at': time.monotonic() + self.ttl,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """プロセス共通の応答キャッシュを取得"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(
+                    maxsize=settings.RESPONSE_CACHE_MAXSIZE,
+                    ttl=settings.RESPONSE_CACHE_TTL,
+                    threshold=settings.RESPONSE_CACHE_THRESHOLD,
+                )
+    return _cache
+
+
+def is_cacheable(intent: str, message: str) -> bool:
+    """応答キャッシュが有効で、キャッシュ対象のインテントかつ条件を含まない質問か
+
+    検索・予約のキーワード、地名、日付、数字のいずれかを含む質問は、似た文面でも
+    答えが変わる（別の都市・日程の応答を返してしまう）ためキャッシュしない。
+    """
+    if not getattr(settings, 'RESPONSE_CACHE_ENABLED', False):
+        return False
+    if intent not in getattr(settings, 'RESPONSE_CACHE_INTENTS', DEFAULT_CACHEABLE_INTENTS):
+        return False
+    text = unicodedata.normalize('NFKC', message or '')
+    if _DIGIT_PATTERN.search(text) or any(matched in SUBSTANTIVE_INTENTS for matched in chat_classifier.scores(text)):
+        return False
+    slots = extract_slots(text)
+    return not slots['locations'] and not slots['dates']
+
+
+def is_storable_answer(content: str) -> bool:
+    """他の利用者にも返してよい応答か（数字・予約番号を含む応答やエラー応答は保存しない）
+
+    料金・日程・予約番号などはそのセッションの会話から作られた値のため、他の利用者に返さない。
+    """
+    if not content or 'エラーが発生しました' in content:
+        return False
+    text = unicodedata.normalize('NFKC', content)
+    return not _DIGIT_PATTERN.search(text) and not _UUID_PATTERN.search(text)
@@ -0,0 +1,30 @@
+from datetime import date
+
+# スロット抽出のラベル付きコーパス（テストとベンチマーク用）
+# (メッセージ, 期待するスロット) ※相対日付は SLOT_CORPUS_TODAY（水曜日）を基準にする
+
+SLOT_CORPUS_TODAY = date(2025, 8, 13)
+
+SLOT_CORPUS = [
+    ('2025-08-20', {'dates': [date(2025, 8, 20)]}),
+    ('2025/08/20から', {'dates': [date(2025, 8, 20)]}),
+    ('８月２０日', {'dates': [date(2025, 8, 20)]}),
+    ('2026年1月5日にチェックイン', {'dates': [date(2026, 1, 5)]}),
+    ('1月5日', {'dates': [date(2026, 1, 5)]}),
+    ('8/20', {'dates': [date(2025, 8, 20)]}),
+    ('明日', {'dates': [date(2025, 8, 14)]}),
+    ('あさってから泊まりたい', {'dates': [date(2025, 8, 15)]}),
+    ('来週金曜', {'dates': [date(2025, 8, 22)]}),
+    ('再来週の月曜日', {'dates': [date(2025, 8, 25)]}),
+    ('金曜日', {'dates': [date(2025, 8, 15)]}),
+    ('2月30日', {'dates': []}),
+    ('8月20日から8月22日まで3名', {'dates': [date(2025, 8, 20), date(2025, 8, 22)], 'people': 3}),
+    ('3名', {'people': 3}),
+    ('大人2人です', {'people': 2}),
+    ('4', {'people': 4}),
+    ('よろしく', {'dates': [], 'people': None}),
+    ('東京から沖縄', {'locations': ['東京', '沖縄']}),
+    ('名古屋で2名', {'locations': ['名古屋'], 'people': 2}),
+    ('予約番号は abc12345-def6-7890-abcd-1234567890ab です',
+     {'reservation_number': 'abc12345-def6-7890-abcd-1234567890ab', 'dates': []}),
+]
@@ -0,0 +1,99 @@
+import re
+import unicodedata
+from datetime import date, timedelta
+
+from django.utils import timezone
+
+# ルールベースBotの入力から日付・人数・地名・予約番号を取り出す（正規表現はすべて事前コンパイル）
+
+LOCATIONS = ['東京', '大阪', '沖縄', '札幌', '京都', '福岡', '北海道', '神戸', '横浜', '名古屋']
+
+WEEKDAYS = '月火水木金土日'
+RELATIVE_DAYS = {'今日': 0, '本日': 0, '明日': 1, 'あした': 1, '明後日': 2, 'あさって': 2}
+WEEK_OFFSETS = {'今週': 0, '来週': 1, '再来週': 2}
+
+RESERVATION_NUMBER_PATTERN = re.compile(
+    r'[a-fA-F0-9]{8}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{12}'
+)
+NUMBER_ONLY_PATTERN = re.compile(r'\s*(\d+)\s*')
+
+# スロットの先頭になりうる文字（それ以外の位置は先読みで即座に読み飛ばす）
+_FIRST_CHARS = set('0123456789abcdefABCDEFの' + WEEKDAYS)
+_FIRST_CHARS.update(word[0] for word in [*RELATIVE_DAYS, *WEEK_OFFSETS, *LOCATIONS])
+
+# すべてのスロットを1つの正規表現にまとめ、メッセージを1回走査する（先に書いたものが優先）
+SLOT_PATTERN = re.compile('(?=[' + re.escape(''.join(sorted(_FIRST_CHARS))) + '])(?:' + '|'.join([
+    r'(?P<reservation>' + RESERVATION_NUMBER_PATTERN.pattern + ')',
+    r'(?P<iso_year>\d{4})[-/](?P<iso_month>\d{1,2})[-/](?P<iso_day>\d{1,2})',
+    r'(?:(?P<jp_year>\d{4})年)?(?P<jp_month>\d{1,2})月(?P<jp_day>\d{1,2})日',
+    r'(?P<slash_month>\d{1,2})/(?P<slash_day>\d{1,2})',
+    r'(?P<relative>' + '|'.join(sorted(RELATIVE_DAYS, key=len, reverse=True)) + ')',
+    r'(?P<week>再来週|来週|今週)?の?(?P<weekday>[' + WEEKDAYS + '])曜日?',
+    r'(?P<people>\d+)\s*(?:名|人|様)',
+    r'(?P<location>' + '|'.join(LOCATIONS) + ')',
+]) + ')')
+
+
+def _resolve_month_day(month: int, day: int, year: int, today: date):
+    """年の省略された月日は今日以降で最も近い日付にする"""
+    try:
+        value = date(year or today.year, month, day)
+        if not year and value < today:
+            value = date(today.year + 1, month, day)
+        return value
+    except ValueError:
+        return None
+
+
+def _resolve_weekday(week: str, weekday: str, today: date) -> date:
+    """「来週金曜」は翌週（月曜始まり）の金曜、週の指定がなければ今日以降で最も近い曜日"""
+    target = WEEKDAYS.index(weekday)
+    if week:
+        monday = today - timedelta(days=today.weekday()) + timedelta(weeks=WEEK_OFFSETS[week])
+        return monday + timedelta(days=target)
+    return today + timedelta(days=(target - today.weekday()) % 7)
+
+
+def extract_slots(message: str, today: date = None) -> dict:
+    """メッセージからスロットを1回の走査で抽出（dates / people / locations / reservation_number）"""
+    today = today or timezone.localdate()
+    text = unicodedata.normalize('NFKC', message or '')
+    slots = {'dates': [], 'people': None, 'locations': [], 'reservation_number': None}
+
+    for match in SLOT_PATTERN.finditer(text):
+        kind = match.lastgroup
+        value = None
+        if kind == 'iso_day':
+            year, month, day = match.group('iso_year', 'iso_month', 'iso_day')
+            value = _resolve_month_day(int(month), int(day), int(year), today)
+        elif kind == 'jp_day':
+            year, month, day = match.group('jp_year', 'jp_month', 'jp_day')
+            value = _resolve_month_day(int(month), int(day), int(year or 0), today)
+        elif kind == 'slash_day':
+            value = _resolve_month_day(int(match.group('slash_month')), int(match.group('slash_day')), 0, today)
+        elif kind == 'relative':
+            value = today + timedelta(days=RELATIVE_DAYS[match.group()])
+        elif kind == 'weekday':
+            value = _resolve_weekday(match.group('week'), match.group('weekday'), today)
+        elif kind == 'people':
+            slots['people'] = slots['people'] or int(match.group('people'))
+        elif kind == 'location':
+            if match.group() not in slots['locations']:
+                slots['locations'].append(match.group())
+        elif kind == 'reservation':
+            slots['reservation_number'] = slots['reservation_number'] or match.group()
+        if value:
+            slots['dates'].append(value)
+
+    # 数字だけの入力は人数とみなす（例：「2」）
+    if slots['people'] is None:
+        number = NUMBER_ONLY_PATTERN.fullmatch(text)
+        if number:
+            slots['people'] = int(number.group(1))
+    return slots
+
+
+def find_location(message: str):
+    """メッセージ中の最初の地名（なければNone）"""
+    locations = extract_slots(message)['locations']
+    return locations[0] if locations else None
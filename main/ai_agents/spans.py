@@ -0,0 +1,123 @@
+import contextvars
+import functools
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+from main import metrics
+
+# チャット1ターン内の処理区間（キュー待ち・LLM呼び出し・ツール実行・保存）の計測
+# SystemResponse.api_call_infoに区間の一覧と区間種別ごとの合計時間を記録する
+
+# 区間の種別（otherは処理時間のうちLLM・ツール・保存以外）
+STAGES = [
+    ('queue', 'キュー待ち'),
+    ('llm', 'LLM呼び出し'),
+    ('tool', 'ツール実行'),
+    ('persist', '履歴・保存'),
+    ('other', 'その他'),
+]
+
+# 1ターンに記録する区間数の上限（api_call_infoの肥大化を防ぐ）
+MAX_SPANS = 50
+
+_turn_trace = contextvars.ContextVar('turn_trace', default=None)
+
+
+@contextmanager
+def track_turn(started: float = None):
+    """このブロック内（同じコンテキスト）の処理区間を記録（startedはperf_counterの基準時刻）"""
+    trace = {'started': started or time.perf_counter(), 'spans': [], 'dropped': 0}
+    token = _turn_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _turn_trace.reset(token)
+
+
+def add_span(kind: str, name: str, start: float, end: float, **extra):
+    """区間を1件記録（計測中のターンがなければ何もしない）"""
+    trace = _turn_trace.get()
+    if trace is None:
+        return
+    if len(trace['spans']) >= MAX_SPANS:
+        trace['dropped'] += 1
+        return
+    trace['spans'].append({
+        'kind': kind,
+        'name': name,
+        'start_ms': round((start - trace['started']) * 1000, 1),
+        'duration_ms': round((end - start) * 1000, 1),
+        **extra,
+    })
+
+
+@contextmanager
+def span(kind: str, name: str, count_queries: bool = False):
+    """ブロックの実行時間を区間として記録（count_queriesならこのスレッドのSQL件数と時間も記録）
+
+    区間の付加情報（SQL件数など）の辞書を返す。計測中のターンがなければ空の辞書。
+    """
+    extra = {}
+    if _turn_trace.get() is None:
+        yield extra
+        return
+    start = time.perf_counter()
+    try:
+        if count_queries:
+            extra.update(queries=0, query_ms=0.0)
+            with connection.execute_wrapper(functools.partial(_count_query, extra)):
+                yield extra
+        else:
+            yield extra
+    finally:
+        if count_queries:
+            extra['query_ms'] = round(extra['query_ms'], 1)
+        add_span(kind, name, start, time.perf_counter(), **extra)
+
+
+def _count_query(counter, execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        counter['queries'] += 1
+        counter['query_ms'] += (time.perf_counter() - start) * 1000
+
+
+def traced_tool(name: str):
+    """ツール関数の実行時間とSQL件数を区間として記録するデコレータ"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            metrics.inc('bookiniad_tool_calls_total', tool=name)
+            with span('tool', name, count_queries=True) as extra:
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    if extra.get('queries'):
+                        metrics.inc('bookiniad_tool_db_queries_total', extra['queries'], tool=name)
+
+        return wrapper
+
+    return decorator
+
+
+def stage_totals(trace: dict, processing_time: float, processed_at: float) -> dict:
+    """区間種別ごとの合計時間（ミリ秒）
+
+    otherは処理時間（processed_atまで）のうちLLM・ツール・保存の区間以外の時間。
+    並列実行されたツールは合計が実時間を超えうるため、otherは0未満にしない。
+    """
+    totals = {kind: 0.0 for kind, _ in STAGES}
+    # 区間の開始位置と同じ精度で比べる（処理後の区間を処理中と誤判定しない）
+    processed_ms = round((processed_at - trace['started']) * 1000, 1)
+    measured = 0.0
+    for item in trace['spans']:
+        totals[item['kind']] = totals.get(item['kind'], 0.0) + item['duration_ms']
+        if item['kind'] in ('llm', 'tool', 'persist') and item['start_ms'] < processed_ms:
+            measured += item['duration_ms']
+    totals['other'] = max(0.0, processing_time * 1000 - measured)
+    return {kind: round(value, 1) for kind, value in totals.items()}
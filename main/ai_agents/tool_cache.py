@@ -0,0 +1,142 @@
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+
+from main import metrics
+from main.models import Air, Accommodations, AccommodationAvailability, FlightAvailability
+from main.ai_agents.tool_format import is_compact
+
+# ターンごとのキャッシュ命中数（SystemResponse.api_call_infoに記録）
+_turn_stats = contextvars.ContextVar('tool_cache_turn_stats', default=None)
+
+
+class ToolError(str):
+    """ツールのエラー応答（LLMには通常の文字列として渡し、キャッシュはしない）"""
+
+
+class TTLCache:
+    """有効期限つきのLRUキャッシュ（スレッドセーフ）"""
+
+    def __init__(self, maxsize: int = 256, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """(見つかったか, 値) を返す"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value, ttl: float = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+_cache = TTLCache(
+    maxsize=getattr(settings, 'TOOL_CACHE_MAXSIZE', 256),
+    ttl=getattr(settings, 'TOOL_CACHE_TTL', 60),
+)
+
+
+def get_tool_cache() -> TTLCache:
+    """プロセス共通のツール結果キャッシュを取得"""
+    return _cache
+
+
+def _normalize(value):
+    """キャッシュキー用に引数を正規化（前後の空白・連続空白・英字の大小を無視）"""
+    if isinstance(value, str):
+        return ' '.join(value.split()).lower()
+    return value
+
+
+def _record(hit: bool):
+    metrics.inc('bookiniad_cache_requests_total', cache='tool', result='hit' if hit else 'miss')
+    stats = _turn_stats.get()
+    if stats is not None:
+        stats['hits' if hit else 'misses'] += 1
+
+
+def cached_tool(name: str, ttl: float = None):
+    """ツール関数の結果を正規化した引数をキーにキャッシュするデコレータ"""
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not getattr(settings, 'TOOL_CACHE_ENABLED', True):
+                return func(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (name, is_compact()) + tuple(_normalize(value) for value in bound.arguments.values())
+            found, value = _cache.get(key)
+            _record(found)
+            if found:
+                return value
+            value = func(*args, **kwargs)
+            # 一時的なエラーはキャッシュせず、次の呼び出しで再実行する
+            if not isinstance(value, ToolError):
+                _cache.set(key, value, ttl)
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def track_turn():
+    """このブロック内（同じコンテキスト）でのキャッシュ命中数を集計"""
+    stats = {'hits': 0, 'misses': 0}
+    token = _turn_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _turn_stats.reset(token)
+
+
+def invalidate_tool_cache(sender=None, **kwargs):
+    """航空券・宿泊施設・空き状況の更新時にキャッシュを破棄
+
+    キャッシュはプロセスごとに持つため、破棄されるのは更新を行ったプロセスのキャッシュだけ。
+    他のワーカープロセスや管理画面・管理コマンドなど別プロセスからの更新では、
+    最大TOOL_CACHE_TTL秒の間は古い結果が返る。
+    """
+    _cache.clear()
+
+
+for _model in (Air, Accommodations, AccommodationAvailability, FlightAvailability):
+    post_save.connect(invalidate_tool_cache, sender=_model, dispatch_uid=f'tool_cache_{_model.__name__}_save')
+    post_delete.connect(invalidate_tool_cache, sender=_model, dispatch_uid=f'tool_cache_{_model.__name__}_delete')
@@ -0,0 +1,85 @@
+import json
+
+from django.conf import settings
+
+# ツールごとにLLMへ返す列（compact形式のみ適用、未登録のツールは全列を返す）
+# 曜日・料金例・予約のご案内などの装飾的・重複した項目はここで落とす
+TOOL_FIELDS = {
+    'search_air': ['便名', '航空会社', '出発地', '目的地', '出発時刻', '到着時刻', '料金', '空席数', '便種別'],
+    'search_accommodations': ['施設名', '所在地', 'ランク', '1泊料金', '説明', '設備', '総部屋数', '宿泊期間', '総料金'],
+}
+
+# 表形式のセル区切り文字
+CELL_SEPARATOR = '|'
+
+
+def is_compact() -> bool:
+    """ツール出力をcompact形式で返すかどうか（TOOL_OUTPUT_FORMAT='verbose'でデバッグ用の整形JSON）"""
+    return getattr(settings, 'TOOL_OUTPUT_FORMAT', 'compact') != 'verbose'
+
+
+def rank_label(rank: int) -> str:
+    """宿泊施設ランクの表示（compact形式では星の絵文字を省略）"""
+    if is_compact():
+        return f"{rank}つ星"
+    return f"{'⭐' * rank} ({rank}つ星)"
+
+
+def _cell(value) -> str:
+    """表の1セル分の文字列に変換"""
+    if value is None:
+        return ''
+    if isinstance(value, (list, tuple)):
+        return '/'.join(_cell(item) for item in value)
+    if isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+    return str(value).replace(CELL_SEPARATOR, '｜').replace('\n', ' ')
+
+
+def _is_table(value) -> bool:
+    return isinstance(value, list) and bool(value) and all(isinstance(item, dict) for item in value)
+
+
+def encode_table(rows: list, columns: list = None) -> str:
+    """辞書のリストを「ヘッダー1行 + 値の行」の表形式に変換"""
+    if columns is None:
+        columns = []
+        for row in rows:
+            columns.extend(key for key in row if key not in columns)
+    else:
+        # 実際に値を持つ列だけを残す
+        columns = [column for column in columns if any(column in row for row in rows)]
+    lines = [CELL_SEPARATOR.join(columns)]
+    for row in rows:
+        lines.append(CELL_SEPARATOR.join(_cell(row.get(column)) for column in columns))
+    return '\n'.join(lines)
+
+
+def encode_compact(data, columns: list = None) -> str:
+    """ツール結果をインデントなしの省トークン形式に変換"""
+    if _is_table(data):
+        return f"{len(data)}件\n" + encode_table(data, columns)
+    if isinstance(data, dict):
+        lines = []
+        for key, value in data.items():
+            if value in (None, '', [], {}):
+                continue
+            if _is_table(value):
+                lines.append(f"{key}({len(value)}件):")
+                lines.append(encode_table(value))
+            elif isinstance(value, dict):
+                lines.append(f"{key}: " + '; '.join(f"{name}={_cell(item)}" for name, item in value.items()))
+            else:
+                lines.append(f"{key}: {_cell(value)}")
+        return '\n'.join(lines)
+    return _cell(data)
+
+
+def format_tool_output(tool_name: str, data, note: str = '') -> str:
+    """ツール結果を設定された形式（compact / verbose）の文字列に変換"""
+    if not is_compact():
+        return json.dumps(data, ensure_ascii=False, indent=2) + note
+    output = encode_compact(data, TOOL_FIELDS.get(tool_name))
+    if note:
+        output += '\n' + note.strip()
+    return output
@@ -0,0 +1,559 @@
+import uuid
+from datetime import date, datetime, time, timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+from main.models import Air, Accommodations, Booking, AccommodationAvailability, FlightAvailability
+from main.ai_agents.tool_format import format_tool_output, rank_label
+from main.ai_agents.tool_cache import ToolError, cached_tool
+from main.ai_agents.spans import traced_tool
+
+# 旅行検索の共通サービス
+# AIエージェント（function_tool）・AIアシスタント（OpenAI tools）・ルールベースBotは
+# すべてこのモジュールを経由してDBを検索する（最適化は1か所で全システムに反映される）
+
+WEEKDAY_NAMES = ['月', '火', '水', '木', '金', '土', '日']
+
+
+def parse_date(value):
+    """YYYY-MM-DD形式の文字列を日付に変換（空・不正な形式はNone）"""
+    if not value:
+        return None
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(str(value).strip(), '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def day_range(day: date) -> tuple:
+    """日付を現在のタイムゾーンでのその日の範囲 [開始, 翌日の開始) に変換（departure_timeのインデックスで絞り込める）"""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def split_keywords(text: str) -> list:
+    """地名・施設名の入力を検索キーワードに分割"""
+    return [keyword for keyword in (text or '').replace(',', ' ').replace('、', ' ').split() if keyword]
+
+
+# ===== クエリ層（モデルのリストを返す） =====
+
+def find_flights(place_from: str, place_to: str, departure_date=None, limit: int = 10, fallback: bool = True) -> list:
+    """出発地・目的地・出発日で今後の航空券を検索（該当なしの場合はどちらか一方の一致で再検索）"""
+    now = timezone.now()
+    query = Air.objects.filter(departure_time__gt=now)
+    if place_from:
+        query = query.filter(place_from__icontains=place_from)
+    if place_to:
+        query = query.filter(place_to__icontains=place_to)
+
+    search_date = parse_date(departure_date)
+    if search_date:
+        day_start, day_end = day_range(search_date)
+        query = query.filter(departure_time__gte=day_start, departure_time__lt=day_end)
+
+    flights = list(query.order_by('departure_time')[:limit])
+    if flights or not fallback or not (place_from or place_to):
+        return flights
+
+    # 条件を緩和して検索（出発地か目的地のどちらかが一致）
+    fallback_conditions = Q()
+    if place_from:
+        fallback_conditions |= Q(place_from__icontains=place_from)
+    if place_to:
+        fallback_conditions |= Q(place_to__icontains=place_to)
+    return list(
+        Air.objects.filter(fallback_conditions, departure_time__gt=now).order_by('departure_time')[:max(1, limit // 2)]
+    )
+
+
+def find_accommodations(location: str, guests: int = 2, limit: int = 10, fallback: bool = True) -> list:
+    """地名・施設名・説明のキーワードで宿泊施設を料金の安い順に検索"""
+    keywords = split_keywords(location)
+
+    # 各キーワードで所在地・施設名・説明をOR検索
+    conditions = Q()
+    for keyword in keywords:
+        conditions |= Q(location__icontains=keyword) | Q(name__icontains=keyword) | Q(description__icontains=keyword)
+
+    query = Accommodations.objects.all()
+    if conditions:
+        query = query.filter(conditions)
+    elif location:
+        query = query.filter(Q(location__icontains=location) | Q(name__icontains=location))
+
+    # 大人数の場合は複数部屋ある施設に限定
+    if guests and guests > 4:
+        query = query.filter(total_rooms__gte=2)
+
+    accommodations = list(query.order_by('price_per_night')[:limit])
+    if accommodations or not fallback or not keywords:
+        return accommodations
+
+    # 条件を緩和して再検索（所在地・施設名のみ）
+    fallback_conditions = Q()
+    for keyword in keywords:
+        fallback_conditions |= Q(location__icontains=keyword) | Q(name__icontains=keyword)
+    return list(Accommodations.objects.filter(fallback_conditions).order_by('price_per_night')[:max(1, limit // 2)])
+
+
+def filter_available_accommodations(accommodations, checkin_date, checkout_date, limit: int = None) -> list:
+    """指定期間の全泊に空室がある施設だけを返す（候補全件の空き状況を1クエリで取得）"""
+    checkin, checkout = parse_date(checkin_date), parse_date(checkout_date)
+    if not accommodations or not checkin or not checkout or checkout <= checkin:
+        return list(accommodations)[:limit]
+
+    rooms = {
+        (accommodation_id, day): available_rooms
+        for accommodation_id, day, available_rooms in AccommodationAvailability.objects.filter(
+            accommodation_id__in=[accommodation.id for accommodation in accommodations],
+            date__gte=checkin,
+            date__lt=checkout,
+        ).values_list('accommodation_id', 'date', 'available_rooms')
+    }
+    nights = [checkin + timedelta(days=offset) for offset in range((checkout - checkin).days)]
+
+    available = []
+    for accommodation in accommodations:
+        # 空き状況データがない日は総部屋数で判定（予約画面と同じ基準）
+        if all(rooms.get((accommodation.id, night), accommodation.total_rooms) >= 1 for night in nights):
+            accommodation.available_for_dates = True
+            available.append(accommodation)
+            if limit and len(available) >= limit:
+                break
+    return available
+
+
+def filter_available_flights(flights, passengers: int = 1, limit: int = None) -> list:
+    """出発日に搭乗者数分の空席がある便だけを返す（候補全件の空き状況を1クエリで取得）"""
+    if not flights:
+        return []
+    passengers = max(1, int(passengers or 1))
+    departure_dates = {flight.id: timezone.localdate(flight.departure_time) for flight in flights}
+
+    seats = {
+        (flight_id, day): available_seats
+        for flight_id, day, available_seats in FlightAvailability.objects.filter(
+            flight_id__in=list(departure_dates),
+            date__in=set(departure_dates.values()),
+        ).values_list('flight_id', 'date', 'available_seats')
+    }
+
+    available = []
+    for flight in flights:
+        # 空き状況データがない場合は便の空席数で判定（予約画面と同じ基準）
+        flight.available_seats_for_date = seats.get((flight.id, departure_dates[flight.id]), flight.available_seats)
+        if flight.available_seats_for_date >= passengers:
+            flight.available_for_date = True
+            available.append(flight)
+            if limit and len(available) >= limit:
+                break
+    return available
+
+
+def get_booking(reservation_number: str) -> Booking:
+    """予約番号で予約を取得（宿泊施設・航空券もまとめて読み込む）"""
+    try:
+        reservation_number = uuid.UUID(str(reservation_number).strip())
+    except ValueError:
+        # 予約番号はUUIDのため、形式が異なるものは該当なしとして扱う
+        raise Booking.DoesNotExist(f"予約番号「{reservation_number}」が見つかりません")
+    return (
+        Booking.objects
+        .select_related('accommodations')
+        .prefetch_related('air')
+        .get(reservation_number=reservation_number)
+    )
+
+
+# ===== ツール層（LLMに返す文字列を生成） =====
+# 検索系は引数ごとに結果をキャッシュする（予約照会は常に最新を返すためキャッシュしない）
+
+@traced_tool('search_air')
+@cached_tool('search_air')
+def search_air(place_from: str, place_to: str, departure_date: str = "") -> str:
+    """航空券をデータベースから検索（出発日未定でも対応）"""
+    try:
+        flights = find_flights(place_from, place_to, departure_date)
+        if not flights:
+            return f"{place_from}から{place_to}への航空券が見つかりませんでした。別の路線をお探しください。"
+
+        results = []
+        for flight in flights:
+            departure_jst = timezone.localtime(flight.departure_time)
+            arrival_jst = timezone.localtime(flight.arrival_time)
+            result_item = {
+                "便名": flight.flight_number,
+                "航空会社": flight.name,
+                "出発地": flight.place_from,
+                "目的地": flight.place_to,
+                "出発時刻": departure_jst.strftime('%Y-%m-%d %H:%M'),
+                "到着時刻": arrival_jst.strftime('%Y-%m-%d %H:%M'),
+                "料金": f"¥{flight.fee:,}",
+                "空席数": flight.available_seats,
+                "便種別": flight.get_flight_type_display()
+            }
+
+            # 出発日が未定の場合は、曜日情報も追加
+            if not departure_date:
+                weekday = WEEKDAY_NAMES[departure_jst.weekday()]
+                result_item["曜日"] = weekday
+                result_item["出発日程"] = f"{departure_jst.strftime('%m月%d日')}({weekday})"
+
+            results.append(result_item)
+
+        additional_info = ""
+        if not departure_date:
+            additional_info = "\n\n※出発日が未定のため、利用可能な便をご案内しています。具体的な日程が決まりましたら、お知らせください。"
+
+        return format_tool_output('search_air', results, additional_info)
+
+    except Exception as e:
+        return ToolError(f"検索中にエラーが発生しました: {str(e)}")
+
+
+@traced_tool('search_accommodations')
+@cached_tool('search_accommodations')
+def search_accommodations(location: str, checkin_date: str = "", checkout_date: str = "", guests: int = 2) -> str:
+    """宿泊施設をデータベースから検索（日程未定でも対応、施設名にも地名検索対応）"""
+    try:
+        accommodations = find_accommodations(location, guests)
+        if not accommodations:
+            return f"{location}周辺で宿泊施設が見つかりませんでした。別の地域名や施設名をお試しください。"
+
+        # 宿泊日数の計算（日程が正しく指定されている場合のみ）
+        nights = 1
+        checkin = parse_date(checkin_date)
+        checkout = parse_date(checkout_date)
+        if checkin and checkout and checkout > checkin:
+            nights = (checkout - checkin).days
+
+        keywords = [keyword.lower() for keyword in split_keywords(location)]
+        results = []
+        for acc in accommodations:
+            total_cost = acc.price_per_night * nights * guests
+
+            # 検索キーワードとのマッチ情報
+            match_info = []
+            for keyword in keywords:
+                if keyword in acc.location.lower():
+                    match_info.append(f"所在地: {keyword}")
+                if keyword in acc.name.lower():
+                    match_info.append(f"施設名: {keyword}")
+                if keyword in acc.description.lower():
+                    match_info.append(f"説明: {keyword}")
+
+            result_item = {
+                "施設名": acc.name,
+                "所在地": acc.location,
+                "ランク": rank_label(acc.rank),
+                "1泊料金": f"¥{acc.price_per_night:,}/泊",
+                "説明": acc.description[:100] + "..." if len(acc.description) > 100 else acc.description,
+                "設備": acc.amenities[:5] if acc.amenities else [],
+                "総部屋数": acc.total_rooms
+            }
+
+            if match_info:
+                result_item["検索マッチ"] = ", ".join(match_info)
+
+            # 日程が指定されている場合の料金計算
+            if checkin_date and checkout_date:
+                result_item["宿泊期間"] = f"{nights}泊"
+                result_item["総料金"] = f"¥{total_cost:,} ({guests}名)"
+            else:
+                result_item["料金例"] = {
+                    "1泊": f"¥{acc.price_per_night * guests:,} ({guests}名)",
+                    "2泊": f"¥{acc.price_per_night * 2 * guests:,} ({guests}名)",
+                    "3泊": f"¥{acc.price_per_night * 3 * guests:,} ({guests}名)"
+                }
+
+            if not checkin_date:
+                result_item["予約のご案内"] = "具体的な宿泊日程が決まりましたら、空室状況をご確認いたします。"
+
+            results.append(result_item)
+
+        additional_info = ""
+        if not checkin_date or not checkout_date:
+            additional_info = f"\n\n※{location}の宿泊施設をご案内しています。具体的な宿泊日程が決まりましたら、より詳細な料金と空室状況をお調べいたします。"
+            additional_info += f"\n※表示料金は{guests}名様でのご利用を想定しています。"
+
+        return format_tool_output('search_accommodations', results, additional_info)
+
+    except Exception as e:
+        return ToolError(f"検索中にエラーが発生しました: {str(e)}")
+
+
+@traced_tool('get_travel_recommendations')
+@cached_tool('get_travel_recommendations')
+def get_travel_recommendations(destination: str, budget: int = None, duration: int = None, departure_date: str = "") -> str:
+    """旅行先のおすすめ情報を提供（日程未定でも対応）"""
+    try:
+        flight_query = Air.objects.filter(place_to__icontains=destination, departure_time__gt=timezone.now())
+        search_date = parse_date(departure_date)
+        if search_date:
+            day_start, day_end = day_range(search_date)
+            flight_query = flight_query.filter(departure_time__gte=day_start, departure_time__lt=day_end)
+
+        # 料金の安い順に5件ずつ
+        flights = list(flight_query.order_by('fee')[:5])
+        accommodations = list(Accommodations.objects.filter(location__icontains=destination).order_by('price_per_night')[:5])
+
+        recommendations = {
+            "目的地": destination,
+            "おすすめフライト": [],
+            "おすすめ宿泊施設": [],
+            "予算目安": {},
+            "旅行プランニング情報": {}
+        }
+
+        for flight in flights:
+            recommendations["おすすめフライト"].append({
+                "便名": flight.flight_number,
+                "航空会社": flight.name,
+                "料金": f"¥{flight.fee:,}",
+                "所要時間": "約2時間"
+            })
+
+        acc_nights = duration or 2
+        total_acc_cost = 0
+        for acc in accommodations:
+            acc_cost = acc.price_per_night * acc_nights
+            total_acc_cost += acc_cost
+            recommendations["おすすめ宿泊施設"].append({
+                "施設名": acc.name,
+                "ランク": f"{acc.rank}つ星",
+                "料金": f"¥{acc.price_per_night:,}/泊",
+                f"{acc_nights}泊総額": f"¥{acc_cost:,}"
+            })
+
+        if flights and accommodations:
+            min_flight = min(flight.fee for flight in flights)
+            avg_acc = total_acc_cost // len(accommodations)
+            recommendations["予算目安"] = {
+                "最安航空券": f"¥{min_flight:,}",
+                "平均宿泊費": f"¥{avg_acc:,}",
+                "総額目安": f"¥{min_flight + avg_acc:,}"
+            }
+
+        return format_tool_output('get_travel_recommendations', recommendations)
+
+    except Exception as e:
+        return ToolError(f"おすすめ情報の取得中にエラーが発生しました: {str(e)}")
+
+
+def _as_date(value):
+    """DateTimeField/DateFieldの値を日付に統一"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return timezone.localtime(value).date() if timezone.is_aware(value) else value.date()
+    if isinstance(value, date):
+        return value
+    return parse_date(value) or date.today()
+
+
+@traced_tool('get_reservation_detail')
+def get_reservation_detail(reservation_number: str) -> str:
+    """予約番号に基づいて予約詳細情報を取得"""
+    try:
+        booking = get_booking(reservation_number)
+
+        checkin_date = _as_date(booking.from_date)
+        checkout_date = _as_date(booking.to_date)
+
+        nights = 1
+        if checkin_date and checkout_date:
+            nights = max(1, (checkout_date - checkin_date).days)
+
+        days_until_checkin = (checkin_date - date.today()).days if checkin_date else 0
+
+        # 航空券情報（prefetch済みのため追加クエリなし）
+        flights_info = []
+        flight_total = 0
+        for flight in booking.air.all():
+            flight_cost = flight.fee * booking.num_of_people
+            flight_total += flight_cost
+            flights_info.append({
+                "便名": flight.flight_number,
+                "航空会社": flight.name,
+                "出発地": flight.place_from,
+                "到着地": flight.place_to,
+                "出発日時": timezone.localtime(flight.departure_time).strftime('%Y年%m月%d日 %H:%M'),
+                "到着日時": timezone.localtime(flight.arrival_time).strftime('%Y年%m月%d日 %H:%M'),
+                "料金": f"¥{flight.fee:,}",
+                "料金合計": f"¥{flight_cost:,} ({booking.num_of_people}名分)",
+                "便種別": flight.get_flight_type_display()
+            })
+
+        # 宿泊施設情報（select_related済み）
+        accommodation_total = 0
+        accommodation_info = {}
+        accommodation = booking.accommodations
+        if accommodation:
+            accommodation_total = accommodation.price_per_night * nights * booking.num_of_people
+            accommodation_info = {
+                "施設名": accommodation.name,
+                "所在地": accommodation.location,
+                "ランク": rank_label(accommodation.rank),
+                "1泊料金": f"¥{accommodation.price_per_night:,}",
+                "宿泊日数": f"{nights}泊",
+                "料金合計": f"¥{accommodation_total:,} ({nights}泊 × {booking.num_of_people}名)",
+                "設備": accommodation.amenities[:5] if accommodation.amenities else []
+            }
+
+        calculated_total = accommodation_total + flight_total
+
+        if days_until_checkin > 0:
+            status_detail = f"チェックインまで{days_until_checkin}日"
+        elif days_until_checkin == 0:
+            status_detail = "本日チェックイン"
+        else:
+            status_detail = "チェックイン済み"
+
+        reservation_detail = {
+            "予約番号": str(booking.reservation_number),
+            "予約ステータス": "予約確定",
+            "ステータス詳細": status_detail,
+            "お客様情報": {
+                "予約人数": f"{booking.num_of_people}名",
+                "旅行先": booking.place
+            },
+            "宿泊情報": accommodation_info if accommodation else "宿泊施設なし",
+            "航空券情報": flights_info if flights_info else "航空券なし",
+            "日程": {
+                "チェックイン": checkin_date.strftime('%Y年%m月%d日') if checkin_date else "未設定",
+                "チェックアウト": checkout_date.strftime('%Y年%m月%d日') if checkout_date else "未設定",
+                "宿泊日数": f"{nights}泊",
+                "チェックインまで": f"{max(0, days_until_checkin)}日"
+            },
+            "料金詳細": {
+                "宿泊料金": f"¥{accommodation_total:,}",
+                "航空券料金": f"¥{flight_total:,}",
+                "合計金額": f"¥{calculated_total:,}",
+                "保存済み金額": f"¥{booking.total_fee:,}",
+                "金額一致": "はい" if calculated_total == booking.total_fee else "いいえ（人数反映後の金額を表示）"
+            }
+        }
+
+        return format_tool_output('get_reservation_detail', reservation_detail)
+
+    except Booking.DoesNotExist:
+        return f"予約番号「{reservation_number}」の予約情報が見つかりませんでした。正しい予約番号を確認してください。"
+    except Exception as e:
+        return ToolError(f"予約詳細の取得中にエラーが発生しました: {str(e)}")
+
+
+# OpenAI Chat Completions形式のツール定義（AIアシスタント用）
+TOOL_SCHEMAS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "search_air",
+            "description": "航空券をデータベースから検索します。出発日が未定でも利用可能な便を表示できます。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "place_from": {
+                        "type": "string",
+                        "description": "出発地（例：東京、大阪）",
+                    },
+                    "place_to": {
+                        "type": "string",
+                        "description": "目的地（例：沖縄、福岡）",
+                    },
+                    "departure_date": {
+                        "type": "string",
+                        "description": "出発日（YYYY-MM-DD形式、例：2025-08-20）。未定の場合は空文字列を指定。",
+                    }
+                },
+                "required": ["place_from", "place_to"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "search_accommodations",
+            "description": "宿泊施設をデータベースから検索します。チェックイン・チェックアウト日が未定でも宿泊施設の情報を提供できます。地名だけでなく、施設名にも地名が含まれている場合も検索対象となります。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "location": {
+                        "type": "string",
+                        "description": "宿泊地または施設名に含まれる地名（例：東京、沖縄、大阪、新宿、渋谷、ディズニーランド周辺など）",
+                    },
+                    "checkin_date": {
+                        "type": "string",
+                        "description": "チェックイン日（YYYY-MM-DD形式）。未定の場合は空文字列を指定。",
+                    },
+                    "checkout_date": {
+                        "type": "string",
+                        "description": "チェックアウト日（YYYY-MM-DD形式）。未定の場合は空文字列を指定。",
+                    },
+                    "guests": {
+                        "type": "integer",
+                        "description": "宿泊人数（デフォルト：2名）",
+                    }
+                },
+                "required": ["location"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_travel_recommendations",
+            "description": "旅行先のおすすめ情報と予算目安を提供します。出発日未定でも利用可能です。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "destination": {
+                        "type": "string",
+                        "description": "旅行先（例：沖縄、北海道）",
+                    },
+                    "budget": {
+                        "type": "integer",
+                        "description": "予算（円）",
+                    },
+                    "duration": {
+                        "type": "integer",
+                        "description": "旅行日数",
+                    },
+                    "departure_date": {
+                        "type": "string",
+                        "description": "出発日（YYYY-MM-DD形式）。未定の場合は空文字列を指定。",
+                    }
+                },
+                "required": ["destination"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_reservation_detail",
+            "description": "渡された予約番号をもとに予約内容を照会することができます",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "reservation_number": {
+                        "type": "string",
+                        "description": "予約番号（UUID形式または文字列形式）",
+                    }
+                },
+                "required": ["reservation_number"],
+            }
+        }
+    }
+]
+
+# ツール名と実装の対応表
+TOOL_FUNCTIONS = {
+    'search_air': search_air,
+    'search_accommodations': search_accommodations,
+    'get_travel_recommendations': get_travel_recommendations,
+    'get_reservation_detail': get_reservation_detail,
+}
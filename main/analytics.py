@@ -0,0 +1,328 @@
+import math
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, Min, Q, Sum
+from django.utils import timezone
+
+from main import session_metrics
+from main.ai_agents import spans
+from main.models import ChatSession, PerformanceMetrics, SystemResponse, ResponseRollup, RollupCheckpoint
+
+# チャット応答の分析
+# SystemResponseを分・時間・日単位のResponseRollupに畳み込み、分析画面は集計テーブルだけを読む
+
+SYSTEM_NAMES = dict(ChatSession.SESSION_TYPES)
+
+# エラー応答として数えるインテント
+ERROR_INTENTS = session_metrics.ERROR_INTENTS
+
+ROLLUP_CHECKPOINT = 'system_response_hourly'
+
+GRANULARITIES = [value for value, _ in ResponseRollup.GRANULARITIES]
+
+
+class LatencyHistogram:
+    """対数バケットの処理時間ヒストグラム（HDRヒストグラムと同じ考え方で、相対誤差が一定）
+
+    バケット i は (MIN_VALUE * GROWTH^(i-1), MIN_VALUE * GROWTH^i] の範囲を表す。
+    件数を足し合わせるだけでマージでき、パーセンタイルの誤差は約 GROWTH-1 に収まる。
+    """
+
+    MIN_VALUE = 0.001
+    GROWTH = 1.05
+
+    def __init__(self, counts: dict = None):
+        self.counts = {int(index): count for index, count in (counts or {}).items()}
+
+    @classmethod
+    def bucket(cls, value: float) -> int:
+        if value <= cls.MIN_VALUE:
+            return 0
+        return math.ceil(math.log(value / cls.MIN_VALUE) / math.log(cls.GROWTH))
+
+    @classmethod
+    def upper_bound(cls, index: int) -> float:
+        return cls.MIN_VALUE * cls.GROWTH ** index
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def add(self, value: float, count: int = 1):
+        index = self.bucket(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        return self
+
+    def percentile(self, q: float):
+        """q（0〜100）パーセンタイルの近似値（データがなければNone）"""
+        total = self.total
+        if not total:
+            return None
+        rank = max(1, math.ceil(total * q / 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return self.upper_bound(index)
+        return self.upper_bound(max(self.counts))
+
+    def to_dict(self) -> dict:
+        # JSONFieldに保存するためキーは文字列にする
+        return {str(index): count for index, count in self.counts.items()}
+
+
+def bucket_start(timestamp, granularity: str):
+    """集計期間の開始（分・時間はUTC、日は現地時間の0時）"""
+    if granularity == 'day':
+        return timezone.localtime(timestamp).replace(hour=0, minute=0, second=0, microsecond=0)
+    timestamp = timestamp.astimezone(dt_timezone.utc)
+    if granularity == 'minute':
+        return timestamp.replace(second=0, microsecond=0)
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def raw_retention_cutoff(now=None):
+    """これより古い生の応答行は削除対象（保持期間が0なら削除しない）"""
+    days = settings.ANALYTICS_RAW_RETENTION_DAYS
+    if not days:
+        return None
+    return (now or timezone.now()) - timedelta(days=days)
+
+
+def refresh_rollups(lag_seconds: float = None, batch_size: int = 5000) -> int:
+    """前回以降のSystemResponseを分・時間・日単位の集計に畳み込む（畳み込んだ件数を返す）
+
+    書き込み途中の行を取りこぼさないよう、直近lag_seconds秒の行は次回に回す。
+    """
+    if lag_seconds is None:
+        lag_seconds = settings.ANALYTICS_ROLLUP_LAG_SECONDS
+    cutoff = timezone.now() - timedelta(seconds=lag_seconds)
+    folded = 0
+    while True:
+        checkpoint, _ = RollupCheckpoint.objects.get_or_create(name=ROLLUP_CHECKPOINT)
+        fetched = list(
+            SystemResponse.objects
+            .filter(id__gt=checkpoint.last_id)
+            .order_by('id')
+            .values_list('id', 'session_id', 'session__session_type', 'intent_detected', 'processing_time', 'timestamp',
+                         'api_call_info__stages')
+            [:batch_size]
+        )
+        # ID順に見て、直近の行が現れたらそこで止める（それより後の行は次回まとめて処理）
+        rows = []
+        for row in fetched:
+            if row[5] > cutoff:
+                break
+            rows.append(row)
+        if not rows:
+            return folded
+        if not _fold(checkpoint.last_id, rows):
+            # 他のワーカーが同じ範囲を処理済み
+            continue
+        folded += len(rows)
+        if len(rows) < batch_size:
+            return folded
+
+
+def last_rollup_time():
+    """最後に応答を集計テーブルへ畳み込んだ日時（未集計ならNone）"""
+    return RollupCheckpoint.objects.filter(name=ROLLUP_CHECKPOINT).values_list('updated_at', flat=True).first()
+
+
+def _fold(last_id: int, rows: list) -> bool:
+    """1バッチ分を集計テーブルに加算（処理済み位置を楽観ロックで進められた場合のみTrue）"""
+    # このバッチより前に応答がないセッション＝このバッチで開始したセッション
+    session_ids = {row[1] for row in rows}
+    seen_sessions = set(
+        SystemResponse.objects
+        .filter(session_id__in=session_ids, id__lte=last_id)
+        .values_list('session_id', flat=True)
+        .distinct()
+    )
+
+    # (集計単位, 期間, セッションタイプ, インテント) ごとにメモリ上で集計
+    buckets = {}
+    for _, session_pk, session_type, intent, processing_time, timestamp, stages in rows:
+        is_new_session = session_pk not in seen_sessions
+        seen_sessions.add(session_pk)
+        for granularity in GRANULARITIES:
+            key = (granularity, bucket_start(timestamp, granularity), session_type, intent or '')
+            bucket = buckets.setdefault(key, {
+                'count': 0, 'error_count': 0, 'session_count': 0, 'total_time': 0.0,
+                'min_time': None, 'max_time': None, 'histogram': LatencyHistogram(),
+                'stage_count': 0, 'stage_time': {},
+            })
+            bucket['count'] += 1
+            bucket['error_count'] += intent in ERROR_INTENTS
+            bucket['session_count'] += is_new_session
+            bucket['total_time'] += processing_time
+            bucket['min_time'] = processing_time if bucket['min_time'] is None else min(bucket['min_time'], processing_time)
+            bucket['max_time'] = processing_time if bucket['max_time'] is None else max(bucket['max_time'], processing_time)
+            bucket['histogram'].add(processing_time)
+            if stages:
+                bucket['stage_count'] += 1
+                _add_stages(bucket['stage_time'], stages)
+
+    with transaction.atomic():
+        # 処理済み位置を先に進める（同時実行時は片方だけが成功し、二重加算を防ぐ）
+        advanced = RollupCheckpoint.objects.filter(name=ROLLUP_CHECKPOINT, last_id=last_id).update(
+            last_id=rows[-1][0], updated_at=timezone.now()
+        )
+        if not advanced:
+            return False
+        for (granularity, start, session_type, intent), bucket in buckets.items():
+            rollup, _ = ResponseRollup.objects.select_for_update().get_or_create(
+                granularity=granularity, bucket_start=start, session_type=session_type, intent=intent
+            )
+            rollup.count += bucket['count']
+            rollup.error_count += bucket['error_count']
+            rollup.session_count += bucket['session_count']
+            rollup.total_time += bucket['total_time']
+            rollup.min_time = bucket['min_time'] if rollup.min_time is None else min(rollup.min_time, bucket['min_time'])
+            rollup.max_time = bucket['max_time'] if rollup.max_time is None else max(rollup.max_time, bucket['max_time'])
+            rollup.latency_histogram = LatencyHistogram(rollup.latency_histogram).merge(bucket['histogram']).to_dict()
+            rollup.stage_count += bucket['stage_count']
+            rollup.stage_time = _add_stages(dict(rollup.stage_time), bucket['stage_time'])
+            rollup.save()
+    return True
+
+
+def _add_stages(totals: dict, stages: dict) -> dict:
+    """区間種別ごとの合計時間を足し込む"""
+    for kind, value in stages.items():
+        totals[kind] = round(totals.get(kind, 0.0) + value, 1)
+    return totals
+
+
+def prune(now=None) -> dict:
+    """保持期間を過ぎた生の応答行と細かい単位の集計を削除（削除件数を返す）
+
+    生の応答行は集計済みのものだけを削除し、開始セッション数の判定に使う各セッションの最初の応答は残す。
+    日単位の集計は削除しない。
+    """
+    now = now or timezone.now()
+    deleted = {'raw': 0}
+    cutoff = raw_retention_cutoff(now)
+    if cutoff:
+        checkpoint = RollupCheckpoint.objects.filter(name=ROLLUP_CHECKPOINT).first()
+        if checkpoint:
+            first_responses = SystemResponse.objects.values('session').annotate(first_id=Min('id')).values('first_id')
+            deleted['raw'], _ = (
+                SystemResponse.objects
+                .filter(timestamp__lt=cutoff, id__lte=checkpoint.last_id)
+                .exclude(id__in=first_responses)
+                .delete()
+            )
+    for granularity, days in settings.ANALYTICS_ROLLUP_RETENTION_DAYS.items():
+        deleted[granularity], _ = ResponseRollup.objects.filter(
+            granularity=granularity, bucket_start__lt=now - timedelta(days=days)
+        ).delete()
+    return deleted
+
+
+def summarize(since=None, granularity: str = 'day') -> dict:
+    """システムごとの指標（応答数・平均/p50/p90/p99・エラー率・セッションあたりターン数・インテント内訳）
+
+    sinceを指定した場合はsinceを含む期間以降の集計を対象にする。
+    """
+    rollups = ResponseRollup.objects.filter(granularity=granularity)
+    if since:
+        rollups = rollups.filter(bucket_start__gte=bucket_start(since, granularity))
+
+    summary = {}
+    for row in rollups.values('session_type', 'intent', 'count', 'error_count', 'session_count', 'total_time',
+                              'min_time', 'max_time', 'latency_histogram', 'stage_count', 'stage_time'):
+        system = summary.setdefault(row['session_type'], {
+            'count': 0, 'error_count': 0, 'session_count': 0, 'total_time': 0.0,
+            'min_time': None, 'max_time': None, 'histogram': LatencyHistogram(), 'intents': {},
+            'stage_count': 0, 'stage_time': {},
+        })
+        system['count'] += row['count']
+        system['error_count'] += row['error_count']
+        system['session_count'] += row['session_count']
+        system['total_time'] += row['total_time']
+        if row['min_time'] is not None:
+            system['min_time'] = row['min_time'] if system['min_time'] is None else min(system['min_time'], row['min_time'])
+            system['max_time'] = row['max_time'] if system['max_time'] is None else max(system['max_time'], row['max_time'])
+        system['histogram'].merge(LatencyHistogram(row['latency_histogram']))
+        system['stage_count'] += row['stage_count']
+        _add_stages(system['stage_time'], row['stage_time'])
+        intent = row['intent'] or 'unknown'
+        system['intents'][intent] = system['intents'].get(intent, 0) + row['count']
+
+    results = {}
+    for session_type, system in summary.items():
+        if not system['count']:
+            continue
+        histogram = system['histogram']
+
+        def percentile(q):
+            # バケットの上限は実測の最大値を超えうるため、最大値で頭打ちにする
+            return round(min(histogram.percentile(q), system['max_time']), 3)
+
+        results[session_type] = {
+            'system_name': SYSTEM_NAMES.get(session_type, session_type),
+            'total_responses': system['count'],
+            'total_sessions': system['session_count'],
+            'avg_response_time': round(system['total_time'] / system['count'], 3),
+            'min_response_time': round(system['min_time'], 3),
+            'max_response_time': round(system['max_time'], 3),
+            'p50_response_time': percentile(50),
+            'p90_response_time': percentile(90),
+            'p99_response_time': percentile(99),
+            'error_rate': round(system['error_count'] / system['count'] * 100, 1),
+            'turns_per_session': round(system['count'] / system['session_count'], 1) if system['session_count'] else None,
+            'intent_breakdown': sorted(system['intents'].items(), key=lambda item: item[1], reverse=True),
+            'stage_breakdown': _stage_breakdown(system['stage_count'], system['stage_time']),
+        }
+    return results
+
+
+def _stage_breakdown(stage_count: int, stage_time: dict) -> list:
+    """1応答あたりの区間種別ごとの平均時間と割合（積み上げ表示用）"""
+    if not stage_count:
+        return []
+    total = sum(stage_time.get(kind, 0.0) for kind, _ in spans.STAGES) or 1.0
+    return [
+        {
+            'kind': kind,
+            'label': label,
+            'avg_ms': round(stage_time.get(kind, 0.0) / stage_count, 1),
+            'percent': round(stage_time.get(kind, 0.0) / total * 100, 1),
+        }
+        for kind, label in spans.STAGES
+    ]
+
+
+def session_outcomes() -> dict:
+    """システムごとのセッション単位の成果（PerformanceMetricsを1回の集計クエリで読む）"""
+    booked = Q(successful_booking=True)
+    rows = (
+        PerformanceMetrics.objects
+        .values('session__session_type')
+        .annotate(
+            sessions=Count('pk'),
+            bookings=Count('pk', filter=booked),
+            turns=Sum('number_of_turns'),
+            errors=Sum('error_count'),
+            booking_turns=Avg('number_of_turns', filter=booked),
+        )
+    )
+    results = {}
+    for row in rows:
+        sessions = row['sessions']
+        results[row['session__session_type']] = {
+            'sessions': sessions,
+            'bookings': row['bookings'],
+            'booking_rate': round(row['bookings'] / sessions * 100, 1),
+            'avg_turns': round(row['turns'] / sessions, 1),
+            'errors_per_session': round(row['errors'] / sessions, 2),
+            'turns_to_booking': round(row['booking_turns'], 1) if row['booking_turns'] is not None else None,
+        }
+    return results
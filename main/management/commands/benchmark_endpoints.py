@@ -0,0 +1,364 @@
+import json
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time as dt_time, timedelta
+from http.cookiejar import CookieJar
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from main.models import AccommodationAvailability, Accommodations, Air, FlightAvailability
+
+# 検索・カート・予約・チャットのエンドポイントの負荷試験
+# 起動中のサーバーに対して並列にリクエストを送り、スループット・p50/p99応答時間・DBクエリ数を計測する。
+# クエリ数はServer-Timingヘッダーから読むため、サーバーはQUERY_PROFILER_ENABLED=trueで起動しておく。
+
+# 計測用データの目印（再投入時にこの名前・便名のデータだけを削除する）
+BENCH_NAME_PREFIX = 'BENCH '
+BENCH_FLIGHT_PREFIX = 'BX'
+
+LOCATIONS = ['東京', '大阪', '沖縄', '札幌', '京都', '福岡']
+AMENITIES = ['WiFi', '駐車場', '温泉', 'レストラン', 'フィットネス', 'プール', '朝食']
+AIRLINES = ['ANA', 'JAL', 'スカイマーク', 'ピーチ']
+
+# チャットに送る会話（1回の試行で順に送る）
+CHAT_MESSAGES = ['{location}のホテルを探しています', '{checkin}から2泊、2名です', 'ありがとう']
+
+_QUERY_PATTERN = re.compile(r'\bdb;desc="(\d+) queries"')
+_SESSION_ID_PATTERN = re.compile(r"const sessionId = '([0-9a-f-]+)'")
+
+
+def seed_dataset(hotels: int, flights: int, days: int, seed: int = 0) -> dict:
+    """計測用の宿泊施設・航空券・空き状況を投入（以前の計測用データは削除して作り直す）
+
+    航空券は出発地・到着地の組み合わせを巡回しながら、1日あたりflights便を翌日からdays日分作成する。
+    """
+    rng = random.Random(seed)
+    start_date = timezone.localdate() + timedelta(days=1)
+    dates = [start_date + timedelta(days=offset) for offset in range(days)]
+    routes = [(place_from, place_to) for place_from in LOCATIONS for place_to in LOCATIONS if place_from != place_to]
+
+    with transaction.atomic():
+        Accommodations.objects.filter(name__startswith=BENCH_NAME_PREFIX).delete()
+        Air.objects.filter(flight_number__startswith=BENCH_FLIGHT_PREFIX).delete()
+
+        accommodations = Accommodations.objects.bulk_create([
+            Accommodations(
+                name=f'{BENCH_NAME_PREFIX}{LOCATIONS[index % len(LOCATIONS)]}ホテル{index + 1}',
+                rank=rng.randint(1, 5),
+                location=LOCATIONS[index % len(LOCATIONS)],
+                description='負荷試験用の宿泊施設',
+                amenities=rng.sample(AMENITIES, rng.randint(1, 4)),
+                price_per_night=rng.randrange(5000, 40000, 500),
+                total_rooms=rng.randint(10, 100),
+            )
+            for index in range(hotels)
+        ])
+        AccommodationAvailability.objects.bulk_create([
+            AccommodationAvailability(accommodation=accommodation, date=date,
+                                      available_rooms=rng.randint(0, accommodation.total_rooms))
+            for accommodation in accommodations
+            for date in dates
+        ], batch_size=1000)
+
+        air = []
+        for date in dates:
+            for index in range(flights):
+                place_from, place_to = routes[index % len(routes)]
+                departure = timezone.make_aware(datetime.combine(date, dt_time(6 + index % 16, rng.choice([0, 15, 30, 45]))))
+                air.append(Air(
+                    name=rng.choice(AIRLINES),
+                    flight_number=f'{BENCH_FLIGHT_PREFIX}{len(air) + 1:05d}',
+                    place_from=place_from,
+                    place_to=place_to,
+                    departure_time=departure,
+                    arrival_time=departure + timedelta(minutes=rng.randint(60, 180)),
+                    fee=rng.randrange(8000, 60000, 100),
+                    available_seats=rng.randint(0, 180),
+                ))
+        air = Air.objects.bulk_create(air, batch_size=1000)
+        FlightAvailability.objects.bulk_create([
+            FlightAvailability(flight=flight, date=timezone.localtime(flight.departure_time).date(),
+                               available_seats=flight.available_seats)
+            for flight in air
+        ], batch_size=1000)
+
+    return {
+        'hotels': hotels, 'flights_per_day': flights, 'days': days, 'seed': seed,
+        'start_date': start_date.isoformat(),
+        'accommodation_ids': [accommodation.id for accommodation in accommodations],
+        'flight_ids': [flight.id for flight in air],
+    }
+
+
+def load_dataset() -> dict:
+    """投入済みの計測用データのIDと日付の範囲（--seedを指定しない場合に使う）"""
+    accommodation_ids = list(Accommodations.objects.filter(name__startswith=BENCH_NAME_PREFIX).values_list('id', flat=True))
+    flights = Air.objects.filter(flight_number__startswith=BENCH_FLIGHT_PREFIX)
+    first = flights.order_by('departure_time').first()
+    if not accommodation_ids or first is None:
+        raise CommandError('計測用データがありません。--seedを指定して投入してください')
+    start_date = max(timezone.localtime(first.departure_time).date(), timezone.localdate() + timedelta(days=1))
+    days = (timezone.localtime(flights.order_by('-departure_time').first().departure_time).date() - start_date).days + 1
+    return {
+        'hotels': len(accommodation_ids), 'days': max(days, 1),
+        'start_date': start_date.isoformat(),
+        'accommodation_ids': accommodation_ids,
+        'flight_ids': list(flights.values_list('id', flat=True)),
+    }
+
+
+def percentile(values: list, p: float) -> float:
+    """最近傍順位法による百分位数（空ならNone）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize_samples(samples: list, elapsed: float) -> dict:
+    """ラベルごとの計測結果（samplesは(ラベル, 応答時間秒, ステータス, クエリ数)）"""
+    by_label = {}
+    for label, duration, status, queries in samples:
+        by_label.setdefault(label, []).append((duration, status, queries))
+
+    results = {}
+    for label, rows in by_label.items():
+        latencies = [duration * 1000 for duration, _, _ in rows]
+        queries = [count for _, _, count in rows if count is not None]
+        results[label] = {
+            'requests': len(rows),
+            'errors': sum(1 for _, status, _ in rows if not 200 <= status < 400),
+            'throughput': round(len(rows) / elapsed, 2) if elapsed else None,
+            'p50_ms': round(percentile(latencies, 50), 1),
+            'p99_ms': round(percentile(latencies, 99), 1),
+            'avg_queries': round(sum(queries) / len(queries), 1) if queries else None,
+            'max_queries': max(queries) if queries else None,
+        }
+    return results
+
+
+def compare_results(current: dict, baseline: dict) -> dict:
+    """基準の結果からの変化率（%）をラベル・指標ごとに計算（どちらかにない値は除く）"""
+    changes = {}
+    for label, result in current.items():
+        base = baseline.get(label)
+        if not base:
+            continue
+        changes[label] = {
+            key: round((result[key] - base[key]) / base[key] * 100, 1)
+            for key in ('throughput', 'p50_ms', 'p99_ms', 'avg_queries')
+            if result.get(key) is not None and base.get(key)
+        }
+    return changes
+
+
+class BenchmarkClient:
+    """ブラウザ1人分のHTTPクライアント（Cookieでセッション・カート・CSRFトークンを保持）"""
+
+    def __init__(self, base_url: str, samples: list, lock: threading.Lock):
+        self.base_url = base_url.rstrip('/')
+        self.cookies = CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+        self.samples = samples
+        self.lock = lock
+
+    def cookie(self, name: str) -> str:
+        return next((cookie.value for cookie in self.cookies if cookie.name == name), '')
+
+    def request(self, label: str, path: str, params: dict = None, json_body: dict = None, form: dict = None):
+        """リクエストを送り、応答時間・ステータス・クエリ数を記録して(ステータス, 本文)を返す"""
+        url = self.base_url + path
+        if params:
+            url += '?' + urllib.parse.urlencode(params)
+        headers = {}
+        data = None
+        if json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            data = urllib.parse.urlencode(form).encode()
+            headers['X-CSRFToken'] = self.cookie('csrftoken')
+        request = urllib.request.Request(url, data=data, headers=headers)
+
+        start = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                body = response.read()
+                status, server_timing = response.status, response.headers.get('Server-Timing', '')
+        except urllib.error.HTTPError as error:
+            body = error.read()
+            status, server_timing = error.code, error.headers.get('Server-Timing', '')
+        except urllib.error.URLError as error:
+            raise CommandError(f'{self.base_url} に接続できません（{error.reason}）。サーバーを起動してください')
+        duration = time.perf_counter() - start
+
+        match = _QUERY_PATTERN.search(server_timing or '')
+        with self.lock:
+            self.samples.append((label, duration, status, int(match.group(1)) if match else None))
+        return status, body.decode('utf-8', errors='replace')
+
+    def post_json(self, label: str, path: str, payload: dict) -> dict:
+        _, body = self.request(label, path, json_body=payload)
+        try:
+            return json.loads(body)
+        except ValueError:
+            return {}
+
+
+class Scenarios:
+    """1回の試行で送る一連のリクエスト（シナリオ名 → メソッド）"""
+
+    names = ['accommodation_search', 'flight_search', 'cart', 'checkout', 'chat']
+
+    def __init__(self, dataset: dict, rng: random.Random, chat_system: str = 'rule_bot'):
+        self.dataset = dataset
+        self.rng = rng
+        self.chat_system = chat_system
+        self.start_date = datetime.fromisoformat(dataset['start_date']).date()
+
+    def _stay(self):
+        checkin = self.start_date + timedelta(days=self.rng.randrange(max(self.dataset['days'] - 2, 1)))
+        return checkin, checkin + timedelta(days=2)
+
+    def accommodation_search(self, client: BenchmarkClient):
+        checkin, checkout = self._stay()
+        client.request('accommodation_search', '/accommodations/', params={
+            'location': self.rng.choice(LOCATIONS), 'checkin_date': checkin.isoformat(),
+            'checkout_date': checkout.isoformat(), 'guests': 2,
+        })
+
+    def flight_search(self, client: BenchmarkClient):
+        place_from, place_to = self.rng.sample(LOCATIONS, 2)
+        client.request('flight_search', '/flights/', params={
+            'departure': place_from, 'destination': place_to,
+            'departure_date': self._stay()[0].isoformat(), 'passengers': 1,
+        })
+
+    def _add_accommodation(self, client: BenchmarkClient, label: str) -> dict:
+        checkin, checkout = self._stay()
+        return client.post_json(label, '/api/cart/add-accommodation/', {
+            'accommodation_id': self.rng.choice(self.dataset['accommodation_ids']),
+            'checkin_date': checkin.isoformat(), 'checkout_date': checkout.isoformat(),
+        })
+
+    def cart(self, client: BenchmarkClient):
+        added = [
+            self._add_accommodation(client, 'cart_add'),
+            client.post_json('cart_add', '/api/cart/add-flight/', {'flight_id': self.rng.choice(self.dataset['flight_ids'])}),
+        ]
+        for result in added:
+            if result.get('item_id'):
+                client.post_json('cart_remove', '/api/cart/remove/', {'item_id': result['item_id']})
+
+    def checkout(self, client: BenchmarkClient):
+        self._add_accommodation(client, 'checkout_cart_add')
+        # カート画面でCSRFトークンのCookieを受け取ってから予約を送信
+        client.request('cart_page', '/cart/')
+        client.request('checkout', '/booking/from-cart/', form={
+            'customer_name': '負荷試験', 'customer_email': 'bench@example.com',
+            'customer_phone': '090-0000-0000', 'guests': 1,
+        })
+
+    def chat(self, client: BenchmarkClient):
+        _, page = client.request('chat_page', f'/chat/{self.chat_system}/')
+        match = _SESSION_ID_PATTERN.search(page)
+        if not match:
+            return
+        checkin = self._stay()[0]
+        values = {'location': self.rng.choice(LOCATIONS), 'checkin': f'{checkin.month}月{checkin.day}日'}
+        for message in CHAT_MESSAGES:
+            client.post_json('chat', '/api/chat/', {'session_id': match.group(1), 'message': message.format(**values)})
+
+
+class Command(BaseCommand):
+    help = '検索・カート・予約・チャットのエンドポイントに並列でリクエストを送り、スループット・応答時間・クエリ数を計測します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true', help='計測前に計測用データを投入し直す')
+        parser.add_argument('--hotels', type=int, default=200, help='投入する宿泊施設数（デフォルト: 200）')
+        parser.add_argument('--flights', type=int, default=100, help='投入する1日あたりの航空券数（デフォルト: 100）')
+        parser.add_argument('--days', type=int, default=30, help='投入する日数（デフォルト: 30日）')
+        parser.add_argument('--random-seed', type=int, default=0, help='データ・リクエスト内容の乱数シード（デフォルト: 0）')
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='計測対象のサーバー（デフォルト: http://127.0.0.1:8000）')
+        parser.add_argument('--concurrency', type=int, default=8, help='並列数（デフォルト: 8）')
+        parser.add_argument('--requests', type=int, default=50, help='シナリオごとの試行回数（デフォルト: 50回）')
+        parser.add_argument('--scenario', action='append', choices=Scenarios.names, help='計測するシナリオ（複数指定可、省略時はすべて）')
+        parser.add_argument(
+            '--chat-system', choices=['rule_bot', 'ai_agent', 'ai_assistant'], default='rule_bot',
+            help='chatシナリオの対象（デフォルト: rule_bot。AIはstub_llm_serverに向けて計測できる）',
+        )
+        parser.add_argument('--output', help='結果を保存するJSONファイル')
+        parser.add_argument('--compare', help='比較する基準の結果（--outputで保存したJSONファイル）')
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            dataset = seed_dataset(options['hotels'], options['flights'], options['days'], options['random_seed'])
+            self.stdout.write(
+                f'計測用データを投入しました: 宿泊施設 {options["hotels"]}件 × {options["days"]}日、'
+                f'航空券 {len(dataset["flight_ids"])}便'
+            )
+        else:
+            dataset = load_dataset()
+
+        results = {}
+        for name in options['scenario'] or Scenarios.names:
+            samples = []
+            lock = threading.Lock()
+            concurrency = options['concurrency']
+
+            def run(worker):
+                # 並列数ごとに1人のブラウザ（Cookie）として、試行を順に実行
+                client = BenchmarkClient(options['base_url'], samples, lock)
+                for index in range(worker, options['requests'], concurrency):
+                    # 試行ごとに乱数を分け、並列数によらず同じリクエスト内容にする
+                    rng = random.Random(f'{options["random_seed"]}:{name}:{index}')
+                    getattr(Scenarios(dataset, rng, options['chat_system']), name)(client)
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                for future in [executor.submit(run, worker) for worker in range(concurrency)]:
+                    future.result()
+            results.update(summarize_samples(samples, time.perf_counter() - start))
+
+        self.stdout.write(f'\n{"ラベル":<22}{"件数":>6}{"エラー":>6}{"req/s":>9}{"p50(ms)":>10}{"p99(ms)":>10}{"クエリ数":>9}')
+        for label, result in results.items():
+            queries = '-' if result['avg_queries'] is None else f'{result["avg_queries"]}'
+            self.stdout.write(
+                f'{label:<22}{result["requests"]:>6}{result["errors"]:>6}{result["throughput"]:>9}'
+                f'{result["p50_ms"]:>10}{result["p99_ms"]:>10}{queries:>9}'
+            )
+        if all(result['avg_queries'] is None for result in results.values()):
+            self.stdout.write(self.style.WARNING(
+                'Server-Timingヘッダーがないためクエリ数は計測できませんでした（QUERY_PROFILER_ENABLED=trueでサーバーを起動してください）'
+            ))
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            self.stdout.write(f'\n基準（{options["compare"]}）からの変化:')
+            for label, changes in compare_results(results, baseline['results']).items():
+                summary = '、'.join(f'{key} {value:+.1f}%' for key, value in changes.items())
+                self.stdout.write(f'  {label}: {summary or "比較できる値がありません"}')
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'created_at': timezone.now().isoformat(),
+                    'base_url': options['base_url'],
+                    'concurrency': options['concurrency'],
+                    'requests': options['requests'],
+                    'chat_system': options['chat_system'],
+                    'dataset': {key: dataset[key] for key in ('hotels', 'days', 'start_date')},
+                    'results': results,
+                }, f, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'\n結果を {options["output"]} に保存しました'))
+
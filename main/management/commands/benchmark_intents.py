@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.ai_agents.intents import chat_classifier, bot_menu_classifier, bot_search_type_classifier, CHAT_INTENTS
+from main.ai_agents.intent_corpus import CHAT_CORPUS, BOT_MENU_CORPUS, BOT_SEARCH_TYPE_CORPUS
+
+
+def legacy_chat_intent(message):
+    """従来方式（キーワードリストごとにlower()してany()で走査）の意図検出"""
+    for intent, confidence, keywords in CHAT_INTENTS:
+        if any(word in message.lower() for word in keywords):
+            return intent, confidence
+    return 'general', 0.8
+
+
+class Command(BaseCommand):
+    help = '意図検出エンジンの正解率と処理時間を計測します'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=2000,
+            help='コーパス全体を分類する回数（デフォルト: 2000回）',
+        )
+
+    def measure(self, classify, messages, iterations):
+        """1メッセージあたりの平均処理時間（マイクロ秒）"""
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for message in messages:
+                classify(message)
+        return (time.perf_counter() - start) / (iterations * len(messages)) * 1_000_000
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+
+        # 正解率
+        self.stdout.write('ラベル付きコーパスでの正解率:')
+        for name, classifier, corpus in [
+            ('chat', chat_classifier, CHAT_CORPUS),
+            ('bot_menu', bot_menu_classifier, BOT_MENU_CORPUS),
+            ('bot_search_type', bot_search_type_classifier, BOT_SEARCH_TYPE_CORPUS),
+        ]:
+            errors = [(message, expected, classifier.classify(message)[0])
+                      for message, expected in corpus if classifier.classify(message)[0] != expected]
+            correct = len(corpus) - len(errors)
+            self.stdout.write(f'  {name}: {correct}/{len(corpus)}')
+            for message, expected, actual in errors:
+                self.stdout.write(self.style.WARNING(f'    「{message}」 期待: {expected} 結果: {actual}'))
+
+        # 処理時間（AIエージェント/アシスタント用の表で従来方式と比較）
+        messages = [message for message, _ in CHAT_CORPUS]
+        legacy = self.measure(legacy_chat_intent, messages, iterations)
+        compiled = self.measure(chat_classifier.classify, messages, iterations)
+        self.stdout.write(f'\n処理時間（{len(messages)}件 × {iterations}回の平均）:')
+        self.stdout.write(f'  従来方式（any()チェーン）: {legacy:.2f}µs/件')
+        self.stdout.write(f'  コンパイル済み正規表現: {compiled:.2f}µs/件')
+        self.stdout.write(self.style.SUCCESS(f'  {legacy / compiled:.1f}倍'))
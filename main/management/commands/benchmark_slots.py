@@ -0,0 +1,66 @@
+import re
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.ai_agents.slots import extract_slots
+from main.ai_agents.slot_corpus import SLOT_CORPUS, SLOT_CORPUS_TODAY
+
+
+def legacy_slots(message):
+    """従来方式（項目ごとにパターン文字列でre.searchし、一致後に再検索）のスロット抽出"""
+    slots = {}
+    date_pattern = r'(\d{4})-(\d{1,2})-(\d{1,2})|(\d{1,2})月(\d{1,2})日'
+    if re.search(date_pattern, message):
+        slots['date'] = re.search(date_pattern, message).group()
+    match = re.search(r'(\d+)[名人]?', message)
+    if match:
+        slots['people'] = match.group(1)
+    reservation_pattern = r'[a-fA-F0-9]{8}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{12}'
+    if re.search(reservation_pattern, message):
+        slots['reservation_number'] = re.search(reservation_pattern, message).group()
+    locations = ['東京', '大阪', '沖縄', '札幌', '京都', '福岡', '北海道', '神戸', '横浜', '名古屋']
+    slots['locations'] = [loc for loc in locations if loc in message]
+    return slots
+
+
+class Command(BaseCommand):
+    help = 'ルールベースBotのスロット抽出（日付・人数・地名・予約番号）の正解率と処理時間を計測します'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=2000,
+            help='コーパス全体を抽出する回数（デフォルト: 2000回）',
+        )
+
+    def measure(self, extract, messages, iterations):
+        """1メッセージあたりの平均処理時間（マイクロ秒）"""
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for message in messages:
+                extract(message)
+        return (time.perf_counter() - start) / (iterations * len(messages)) * 1_000_000
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+
+        # 正解率（期待値に書かれた項目のみ比較）
+        errors = []
+        for message, expected in SLOT_CORPUS:
+            actual = extract_slots(message, today=SLOT_CORPUS_TODAY)
+            if any(actual[key] != value for key, value in expected.items()):
+                errors.append((message, expected, actual))
+        self.stdout.write(f'ラベル付きコーパスでの正解率: {len(SLOT_CORPUS) - len(errors)}/{len(SLOT_CORPUS)}')
+        for message, expected, actual in errors:
+            self.stdout.write(self.style.WARNING(f'  「{message}」 期待: {expected} 結果: {actual}'))
+
+        # 処理時間（従来方式は日付の形式が少ないため、同じコーパスでの参考値）
+        messages = [message for message, _ in SLOT_CORPUS]
+        legacy = self.measure(legacy_slots, messages, iterations)
+        compiled = self.measure(lambda message: extract_slots(message, today=SLOT_CORPUS_TODAY), messages, iterations)
+        self.stdout.write(f'\n処理時間（{len(messages)}件 × {iterations}回の平均）:')
+        self.stdout.write(f'  従来方式（項目ごとのre.search）: {legacy:.2f}µs/件')
+        self.stdout.write(f'  事前コンパイル済み・1回走査: {compiled:.2f}µs/件')
+        self.stdout.write(self.style.SUCCESS(f'  {legacy / compiled:.1f}倍'))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from main import analytics
+from main.models import ResponseRollup
+
+
+class Command(BaseCommand):
+    help = 'チャット応答（SystemResponse）を分・時間・日単位の集計に畳み込み、保持期間を過ぎた行を削除します'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lag',
+            type=float,
+            default=None,
+            help='直近何秒の応答を次回に回すか（デフォルト: ANALYTICS_ROLLUP_LAG_SECONDS）',
+        )
+        parser.add_argument(
+            '--prune',
+            action='store_true',
+            help='集計後に保持期間を過ぎた生の応答行と分・時間単位の集計を削除する',
+        )
+
+    def handle(self, *args, **options):
+        folded = analytics.refresh_rollups(lag_seconds=options['lag'])
+        self.stdout.write(f'集計: {folded}件の応答を畳み込みました')
+
+        if options['prune']:
+            deleted = analytics.prune()
+            labels = dict(ResponseRollup.GRANULARITIES)
+            self.stdout.write(
+                f"削除: 応答 {deleted.pop('raw')}件 / "
+                + ' / '.join(f'{labels[granularity]}単位の集計 {count}件' for granularity, count in deleted.items())
+            )
+        self.stdout.write(self.style.SUCCESS('完了しました'))
@@ -0,0 +1,214 @@
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand, CommandError
+
+# OpenAI互換のChat Completions APIのスタブサーバー（外部APIなしでai_agent・ai_assistantの負荷試験をする）
+# 決められたルールでツール呼び出し・応答を返し、応答までの遅延を設定できる。
+# OPENAI_BASE_URL=http://127.0.0.1:<port>/v1、OPENAI_AGENTS_USE_RESPONSES=false、OPENAI_API_KEY（任意の値）でアプリを起動して使う。
+
+_LOCATION = '東京|大阪|沖縄|札幌|京都|福岡|北海道|神戸|横浜|名古屋'
+
+# 既定のスクリプト（上から順に、ユーザーの最後の発言に一致し、提供されたツールのうち
+# このターンでまだ呼んでいないものを呼ぶ。argumentsの{名前}は正規表現の名前付きグループで置き換える）
+DEFAULT_SCRIPT = {
+    'rules': [
+        {
+            'pattern': rf'(?P<place_from>{_LOCATION})から(?P<place_to>{_LOCATION}).*(航空券|フライト|便|飛行機)',
+            'tool': 'search_air',
+            'arguments': {'place_from': '{place_from}', 'place_to': '{place_to}'},
+        },
+        {
+            'pattern': rf'(?P<location>{_LOCATION}).*(ホテル|宿|旅館)',
+            'tool': 'search_accommodations',
+            'arguments': {'location': '{location}'},
+        },
+        {
+            'pattern': rf'(?P<destination>{_LOCATION}).*(おすすめ|観光)',
+            'tool': 'get_travel_recommendations',
+            'arguments': {'destination': '{destination}'},
+        },
+        {
+            'pattern': r'(?P<reservation_number>[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})',
+            'tool': 'get_reservation_detail',
+            'arguments': {'reservation_number': '{reservation_number}'},
+        },
+    ],
+    # ツールを呼ばない場合の応答
+    'reply': 'ご希望の出発地・目的地や日程を教えてください。',
+    # ツールの結果を受け取った後の応答（{tools}は呼んだツール名、{result}は最後の結果の先頭）
+    'final_reply': '{tools}の結果をお知らせします。\n{result}',
+}
+
+
+def _text(content) -> str:
+    """メッセージのcontent（文字列またはパーツの配列）を文字列に変換"""
+    if isinstance(content, list):
+        return ''.join(part.get('text', '') for part in content if isinstance(part, dict))
+    return content or ''
+
+
+def plan_response(body: dict, script: dict) -> dict:
+    """リクエストに対するアシスタントのメッセージ（tool_callsの引数は辞書のまま）を決める"""
+    messages = body.get('messages', [])
+    last_user = max((index for index, message in enumerate(messages) if message.get('role') == 'user'), default=-1)
+    user_message = _text(messages[last_user].get('content')) if last_user >= 0 else ''
+    turn = messages[last_user + 1:]
+
+    # このターンで呼び終えたツール
+    called = [
+        tool_call['function']['name']
+        for message in turn if message.get('role') == 'assistant'
+        for tool_call in message.get('tool_calls') or []
+    ]
+    offered = {tool['function']['name'] for tool in body.get('tools') or [] if tool.get('type') == 'function'}
+
+    for rule in script['rules']:
+        match = re.search(rule['pattern'], user_message)
+        if not match:
+            continue
+        if 'content' in rule:
+            return {'role': 'assistant', 'content': rule['content'].format(**match.groupdict())}
+        if rule['tool'] in offered and rule['tool'] not in called:
+            arguments = {key: value.format(**match.groupdict()) if isinstance(value, str) else value
+                         for key, value in rule.get('arguments', {}).items()}
+            return {'role': 'assistant', 'content': None,
+                    'tool_calls': [{'name': rule['tool'], 'arguments': arguments}]}
+
+    results = [_text(message.get('content')) for message in turn if message.get('role') == 'tool']
+    if results:
+        return {'role': 'assistant', 'content': script['final_reply'].format(tools='・'.join(called), result=results[-1][:500])}
+    return {'role': 'assistant', 'content': script['reply']}
+
+
+class StubLLM:
+    """Chat Completionsの応答を組み立て、設定された遅延の後に返す"""
+
+    def __init__(self, script: dict, latency: float, jitter: float, seed: int = 0):
+        self.script = script
+        self.latency = latency
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def delay(self) -> float:
+        """今回の遅延（秒）：latency + 0〜jitterの一様乱数"""
+        with self._lock:
+            return (self.latency + self._rng.uniform(0, self.jitter)) / 1000
+
+    def complete(self, body: dict) -> dict:
+        plan = plan_response(body, self.script)
+        with self._lock:
+            response_id = next(self._ids)
+        message = {'role': 'assistant', 'content': plan['content']}
+        if plan.get('tool_calls'):
+            message['tool_calls'] = [
+                {
+                    'id': f'call_stub_{response_id}_{index}',
+                    'type': 'function',
+                    'function': {'name': call['name'], 'arguments': json.dumps(call['arguments'], ensure_ascii=False)},
+                }
+                for index, call in enumerate(plan['tool_calls'])
+            ]
+        # トークン数は文字数からの概算
+        prompt_tokens = len(json.dumps(body.get('messages', []), ensure_ascii=False)) // 4
+        completion_tokens = len(json.dumps(message, ensure_ascii=False)) // 4
+        return {
+            'id': f'chatcmpl-stub-{response_id}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'stub'),
+            'choices': [{
+                'index': 0,
+                'message': message,
+                'finish_reason': 'tool_calls' if plan.get('tool_calls') else 'stop',
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+            },
+        }
+
+
+def make_handler(stub: StubLLM, verbose: bool = False):
+    """スタブを使うリクエストハンドラのクラスを作成"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def send_json(self, status: int, payload: dict):
+            data = json.dumps(payload, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip('/').endswith('/models'):
+                self.send_json(200, {'object': 'list', 'data': [{'id': 'gpt-4o-mini', 'object': 'model', 'owned_by': 'stub'}]})
+            else:
+                self.send_json(404, {'error': {'message': f'Unknown path: {self.path}', 'type': 'invalid_request_error'}})
+
+        def do_POST(self):
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+            except ValueError:
+                self.send_json(400, {'error': {'message': 'Invalid JSON body', 'type': 'invalid_request_error'}})
+                return
+            if not self.path.rstrip('/').endswith('/chat/completions'):
+                # Responses APIなどは未対応（エージェントはOPENAI_AGENTS_USE_RESPONSES=falseで使う）
+                self.send_json(404, {'error': {'message': f'Unknown path: {self.path}', 'type': 'invalid_request_error'}})
+                return
+            if body.get('stream'):
+                self.send_json(400, {'error': {'message': 'stream is not supported by the stub server', 'type': 'invalid_request_error'}})
+                return
+            time.sleep(stub.delay())
+            self.send_json(200, stub.complete(body))
+
+        def log_message(self, format, *args):
+            if verbose:
+                super().log_message(format, *args)
+
+    return Handler
+
+
+class Command(BaseCommand):
+    help = 'OpenAI互換のChat Completions APIのスタブサーバーを起動します（決められたツール呼び出し・応答と遅延を返します）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='待ち受けるホスト（デフォルト: 127.0.0.1）')
+        parser.add_argument('--port', type=int, default=8100, help='待ち受けるポート（デフォルト: 8100）')
+        parser.add_argument('--latency', type=float, default=300, help='応答までの遅延（ミリ秒、デフォルト: 300）')
+        parser.add_argument('--jitter', type=float, default=100, help='遅延に加える0〜指定値の揺らぎ（ミリ秒、デフォルト: 100）')
+        parser.add_argument('--random-seed', type=int, default=0, help='揺らぎの乱数シード（デフォルト: 0）')
+        parser.add_argument('--script', help='ルール・応答を定義したJSONファイル（省略時は既定のスクリプト）')
+
+    def handle(self, *args, **options):
+        script = DEFAULT_SCRIPT
+        if options['script']:
+            try:
+                with open(options['script']) as f:
+                    script = {**DEFAULT_SCRIPT, **json.load(f)}
+            except (OSError, ValueError) as e:
+                raise CommandError(f'スクリプトを読み込めません: {e}')
+
+        stub = StubLLM(script, options['latency'], options['jitter'], options['random_seed'])
+        server = ThreadingHTTPServer((options['host'], options['port']), make_handler(stub, options['verbosity'] > 1))
+        base_url = f'http://{options["host"]}:{server.server_address[1]}/v1'
+        self.stdout.write(self.style.SUCCESS(f'スタブLLMサーバーを起動しました: {base_url}'))
+        self.stdout.write(f'  遅延: {options["latency"]}ms + 0〜{options["jitter"]}ms、ルール: {len(script["rules"])}件')
+        self.stdout.write(f'  アプリは OPENAI_BASE_URL={base_url} OPENAI_AGENTS_USE_RESPONSES=false OPENAI_API_KEY=stub で起動してください')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,181 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+# Prometheus形式のメトリクス（/metrics）
+# 各プロセスはメモリ上で集計し、METRICS_DIRが設定されていればプロセスごとのJSONファイルに定期的に書き出す。
+# /metricsは全プロセスのファイルを合算して返す（uvicornの複数ワーカーでも全体の値になる）
+
+# 処理時間のヒストグラムのバケット境界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# メトリクス名 → (種類, 説明, ラベル名)
+METRICS = {
+    'bookiniad_http_request_duration_seconds': ('histogram', 'HTTPリクエストの処理時間', ('url_name', 'status')),
+    'bookiniad_http_request_db_queries_total': ('counter', 'HTTPリクエスト中に発行したDBクエリ数', ('url_name',)),
+    'bookiniad_chat_turn_duration_seconds': ('histogram', 'チャット1ターンの応答生成時間', ('session_type', 'intent')),
+    'bookiniad_agent_executor_queue_depth': ('gauge', 'AI処理スレッドプールの実行待ちタスク数', ()),
+    'bookiniad_agent_executor_active_workers': ('gauge', 'AI処理スレッドプールで実行中のタスク数', ()),
+    'bookiniad_tool_calls_total': ('counter', 'ツール呼び出し回数', ('tool',)),
+    'bookiniad_tool_db_queries_total': ('counter', 'ツール呼び出し中に発行したDBクエリ数', ('tool',)),
+    'bookiniad_cache_requests_total': ('counter', 'キャッシュの参照回数（resultはhit/miss）', ('cache', 'result')),
+}
+
+
+class MetricsRegistry:
+    """プロセス内のメトリクス集計（スレッドセーフ）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 書き出しは1スレッドずつ（同じ一時ファイルに同時に書かない）
+        self._flush_lock = threading.Lock()
+        self._values = {}
+        self._last_flush = 0.0
+
+    def _key(self, name: str, labels: dict) -> str:
+        # JSONに書き出せるよう、系列のキーは「名前|ラベル値…」の文字列にする
+        return '|'.join([name, *(str(labels.get(label, '')) for label in METRICS[name][2])])
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        self.maybe_flush()
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            series = self._values.setdefault(key, {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0})
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    series['buckets'][index] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+        self.maybe_flush()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                key: dict(value, buckets=list(value['buckets'])) if isinstance(value, dict) else value
+                for key, value in self._values.items()
+            }
+
+    def maybe_flush(self):
+        """前回の書き出しから一定時間たっていればファイルに書き出す"""
+        if settings.METRICS_DIR and time.monotonic() - self._last_flush >= settings.METRICS_FLUSH_SECONDS:
+            self.flush()
+
+    def flush(self):
+        """このプロセスの値をMETRICS_DIR/metrics_<pid>.jsonに書き出す（一時ファイルから置き換え）"""
+        if not settings.METRICS_DIR:
+            return
+        with self._flush_lock:
+            self._last_flush = time.monotonic()
+            os.makedirs(settings.METRICS_DIR, exist_ok=True)
+            path = os.path.join(settings.METRICS_DIR, f'metrics_{os.getpid()}.json')
+            temp_path = f'{path}.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump({'pid': os.getpid(), 'values': self.snapshot()}, f)
+            os.replace(temp_path, path)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+_registry = MetricsRegistry()
+atexit.register(_registry.flush)
+
+
+def get_registry() -> MetricsRegistry:
+    """プロセス共通のメトリクス集計を取得"""
+    return _registry
+
+
+def inc(name: str, amount: float = 1, **labels):
+    _registry.inc(name, amount, **labels)
+
+
+def observe(name: str, value: float, **labels):
+    _registry.observe(name, value, **labels)
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect() -> dict:
+    """全プロセスの値を合算（ゲージは稼働中のプロセス分のみ、カウンタ・ヒストグラムは終了したプロセス分も含める）"""
+    if not settings.METRICS_DIR:
+        return _registry.snapshot()
+    _registry.flush()
+    merged = {}
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, 'metrics_*.json')):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        alive = _is_alive(data['pid'])
+        for key, value in data['values'].items():
+            name = key.split('|', 1)[0]
+            if name not in METRICS or (METRICS[name][0] == 'gauge' and not alive):
+                continue
+            if isinstance(value, dict):
+                series = merged.setdefault(key, {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0})
+                series['buckets'] = [total + count for total, count in zip(series['buckets'], value['buckets'])]
+                series['sum'] += value['sum']
+                series['count'] += value['count']
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(pairs) -> str:
+    pairs = list(pairs)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{label}="{_escape(value)}"' for label, value in pairs) + '}'
+
+
+def render(values: dict = None) -> str:
+    """Prometheusのテキスト形式（version 0.0.4）に変換"""
+    values = collect() if values is None else values
+    by_name = {}
+    for key, value in values.items():
+        name, *label_values = key.split('|')
+        by_name.setdefault(name, []).append((label_values, value))
+
+    lines = []
+    for name, (kind, description, label_names) in METRICS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        for label_values, value in sorted(by_name.get(name, []), key=lambda item: item[0]):
+            labels = list(zip(label_names, label_values))
+            if kind != 'histogram':
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, value['buckets']):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels + [("le", str(bound))])} {cumulative}')
+            lines.append(f'{name}_bucket{_format_labels(labels + [("le", "+Inf")])} {value["count"]}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {value["sum"]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {value["count"]}')
+    return '\n'.join(lines) + '\n'
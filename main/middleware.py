@@ -0,0 +1,178 @@
+import functools
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from main import metrics
+
+# リクエスト単位のDBクエリ計測（QUERY_PROFILER_ENABLEDのときだけ有効）
+# クエリ数・SQL時間・重複クエリ・遅いクエリをServer-Timingヘッダーとログに出し、URL名ごとに集計する
+
+logger = logging.getLogger('main.query_profiler')
+
+# 集計に残す重複クエリ・遅いクエリの件数
+TOP_STATEMENTS = 5
+
+_IN_LIST_PATTERN = re.compile(r'\bIN \((?:%s, )*%s\)')
+_NUMBER_PATTERN = re.compile(r'\b\d+\b')
+_SPACE_PATTERN = re.compile(r'\s+')
+# トランザクション制御文は重複クエリとして数えない
+_TRANSACTION_PATTERN = re.compile(r'(BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b', re.IGNORECASE)
+
+
+def fingerprint(sql: str) -> str:
+    """SQLの形だけを残した文字列（IN句の要素数・数値リテラルの違いを同一視する）"""
+    sql = _IN_LIST_PATTERN.sub('IN (...)', sql)
+    sql = _NUMBER_PATTERN.sub('?', sql)
+    return _SPACE_PATTERN.sub(' ', sql).strip()
+
+
+class QueryRecorder:
+    """execute_wrapperとして1リクエスト分のクエリを記録"""
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.statements.append((sql, (time.perf_counter() - start) * 1000))
+
+    def summary(self) -> dict:
+        fingerprints = Counter(fingerprint(sql) for sql, _ in self.statements if not _TRANSACTION_PATTERN.match(sql))
+        slowest = sorted(self.statements, key=lambda item: item[1], reverse=True)[:TOP_STATEMENTS]
+        return {
+            'queries': len(self.statements),
+            'sql_ms': round(sum(duration for _, duration in self.statements), 2),
+            # 同じ形のSQLの実行回数（2回以上のもの）
+            'duplicates': {sql: count for sql, count in fingerprints.most_common() if count > 1},
+            'slowest': [(sql, round(duration, 2)) for sql, duration in slowest],
+        }
+
+
+class QueryProfileStore:
+    """URL名ごとのクエリ計測結果の集計（プロセス内、スレッドセーフ）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def add(self, route: str, summary: dict):
+        with self._lock:
+            entry = self._routes.setdefault(route, {
+                'requests': 0, 'queries': 0, 'sql_ms': 0.0, 'max_queries': 0,
+                'duplicates': Counter(), 'slowest': [],
+            })
+            entry['requests'] += 1
+            entry['queries'] += summary['queries']
+            entry['sql_ms'] += summary['sql_ms']
+            entry['max_queries'] = max(entry['max_queries'], summary['queries'])
+            entry['duplicates'].update(summary['duplicates'])
+            entry['slowest'] = sorted(entry['slowest'] + summary['slowest'], key=lambda item: item[1], reverse=True)[:TOP_STATEMENTS]
+
+    def report(self) -> list:
+        """クエリ数の平均が多い順のURL名ごとの集計"""
+        with self._lock:
+            rows = [
+                {
+                    'route': route,
+                    'requests': entry['requests'],
+                    'avg_queries': round(entry['queries'] / entry['requests'], 1),
+                    'max_queries': entry['max_queries'],
+                    'avg_sql_ms': round(entry['sql_ms'] / entry['requests'], 2),
+                    'duplicates': entry['duplicates'].most_common(TOP_STATEMENTS),
+                    'slowest': list(entry['slowest']),
+                }
+                for route, entry in self._routes.items()
+            ]
+        return sorted(rows, key=lambda row: row['avg_queries'], reverse=True)
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+
+_store = QueryProfileStore()
+
+
+def get_query_profile_store() -> QueryProfileStore:
+    """プロセス共通のクエリ計測結果の集計を取得"""
+    return _store
+
+
+class QueryProfilerMiddleware:
+    """リクエストごとのクエリ数・SQL時間をServer-Timingヘッダー・ログ・URL名ごとの集計に記録
+
+    記録するのはリクエストを処理するスレッドのdefault接続のクエリのみ
+    （チャットのバックグラウンド処理のクエリは含まない）。
+    """
+
+    def __init__(self, get_response):
+        if not settings.QUERY_PROFILER_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        summary = recorder.summary()
+
+        # URL名のないリクエスト（404・名前なしのURL）はパスごとに分けず1つにまとめる（MetricsMiddlewareと同じ）
+        match = request.resolver_match
+        route = match.url_name if match and match.url_name else ''
+        _store.add(route, summary)
+
+        # 重複分（同じ形のSQLの2回目以降）の実行回数
+        redundant = sum(count - 1 for count in summary['duplicates'].values())
+        timing = f'db;desc="{summary["queries"]} queries";dur={summary["sql_ms"]}'
+        if redundant:
+            timing += f', db-dup;desc="{redundant} duplicated"'
+        response['Server-Timing'] = f"{response['Server-Timing']}, {timing}" if response.has_header('Server-Timing') else timing
+
+        # 一部のリクエストと、クエリ数が閾値以上のリクエストはログに出す
+        if summary['queries'] >= settings.QUERY_PROFILER_LOG_QUERY_THRESHOLD or random.random() < settings.QUERY_PROFILER_LOG_SAMPLE_RATE:
+            top_duplicate = max(summary['duplicates'].items(), key=lambda item: item[1], default=('', 0))
+            logger.info(
+                'route=%s path=%s status=%s queries=%d sql_ms=%.2f duplicated=%d top_duplicate=%r slowest=%r',
+                route, request.path, response.status_code, summary['queries'], summary['sql_ms'],
+                redundant, top_duplicate[0][:200],
+                summary['slowest'][0][0][:200] if summary['slowest'] else '',
+            )
+        return response
+
+
+class MetricsMiddleware:
+    """リクエストの処理時間（URL名・ステータス別）とDBクエリ数を/metrics用に記録（METRICS_ENABLEDのとき有効）"""
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = {'queries': 0}
+        start = time.perf_counter()
+        with connection.execute_wrapper(functools.partial(_count_query, counter)):
+            response = self.get_response(request)
+        # URLに一致しないリクエストは系列を増やさないよう空のURL名にまとめる
+        match = request.resolver_match
+        url_name = match.url_name if match and match.url_name else ''
+        metrics.observe('bookiniad_http_request_duration_seconds', time.perf_counter() - start,
+                        url_name=url_name, status=response.status_code)
+        metrics.inc('bookiniad_http_request_db_queries_total', counter['queries'], url_name=url_name)
+        return response
+
+
+def _count_query(counter, execute, sql, params, many, context):
+    counter['queries'] += 1
+    return execute(sql, params, many, context)
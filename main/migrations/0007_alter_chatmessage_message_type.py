@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-19 03:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_cart_cartitem'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='message_type',
+            field=models.CharField(choices=[('user', 'ユーザー'), ('ai_agent', 'AIエージェント'), ('ai_assistant', 'AIアシスタント'), ('rule_bot', 'ルールベースBot'), ('context', 'LLMコンテキスト')], max_length=20, verbose_name='メッセージタイプ'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-19 03:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_alter_chatmessage_message_type'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='accommodations',
+            index=models.Index(fields=['location', 'price_per_night'], name='main_accomm_locatio_ef26b2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='air',
+            index=models.Index(fields=['place_from', 'place_to', 'departure_time'], name='main_air_place_f_4a9434_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='air',
+            index=models.Index(fields=['departure_time'], name='main_air_departu_87a664_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-19 03:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_travel_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BotDialogueState',
+            fields=[
+                ('session', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='dialogue_state', serialize=False, to='main.chatsession')),
+                ('state', models.CharField(blank=True, default='', max_length=50, verbose_name='対話状態')),
+                ('last_intent', models.CharField(blank=True, default='', max_length=50, verbose_name='直前のインテント')),
+                ('search_type', models.CharField(blank=True, default='', max_length=20, verbose_name='検索タイプ')),
+                ('location', models.CharField(blank=True, default='', max_length=100, verbose_name='宿泊地')),
+                ('checkin_date', models.CharField(blank=True, default='', max_length=100, verbose_name='チェックイン日')),
+                ('checkout_date', models.CharField(blank=True, default='', max_length=100, verbose_name='チェックアウト日')),
+                ('departure', models.CharField(blank=True, default='', max_length=100, verbose_name='出発地')),
+                ('destination', models.CharField(blank=True, default='', max_length=100, verbose_name='目的地')),
+                ('departure_date', models.CharField(blank=True, default='', max_length=100, verbose_name='出発日')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-19 03:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_botdialoguestate'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['session', 'timestamp', 'id'], name='main_chatme_session_94e31a_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.7 on 2026-10-19 03:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_chatmessage_history_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='集計名')),
+                ('last_id', models.BigIntegerField(default=0, verbose_name='処理済みの最大ID')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ResponseRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_start', models.DateTimeField(verbose_name='集計期間の開始')),
+                ('session_type', models.CharField(choices=[('ai_agent', 'AIエージェント'), ('ai_assistant', 'AIアシスタント'), ('rule_bot', 'ルールベースBot')], max_length=20, verbose_name='セッションタイプ')),
+                ('intent', models.CharField(blank=True, default='', max_length=100, verbose_name='インテント')),
+                ('count', models.IntegerField(default=0, verbose_name='応答数')),
+                ('error_count', models.IntegerField(default=0, verbose_name='エラー数')),
+                ('session_count', models.IntegerField(default=0, verbose_name='開始セッション数')),
+                ('total_time', models.FloatField(default=0, verbose_name='処理時間の合計（秒）')),
+                ('min_time', models.FloatField(blank=True, null=True, verbose_name='最小処理時間（秒）')),
+                ('max_time', models.FloatField(blank=True, null=True, verbose_name='最大処理時間（秒）')),
+                ('latency_histogram', models.JSONField(default=dict, verbose_name='処理時間のヒストグラム')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket_start'], name='main_respon_bucket__693a0e_idx')],
+                'unique_together': {('bucket_start', 'session_type', 'intent')},
+            },
+        ),
+    ]
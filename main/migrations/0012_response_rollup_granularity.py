@@ -0,0 +1,41 @@
+# Generated by Django 5.1.7 on 2026-10-19 03:36
+
+from django.db import migrations, models
+
+
+def reset_rollups(apps, schema_editor):
+    # 既存の時間別集計を破棄し、次回の集計で全応答を分・時間・日単位に畳み込み直す
+    apps.get_model('main', 'ResponseRollup').objects.all().delete()
+    apps.get_model('main', 'RollupCheckpoint').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_response_rollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(reset_rollups, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='responserollup',
+            name='main_respon_bucket__693a0e_idx',
+        ),
+        migrations.AlterUniqueTogether(
+            name='responserollup',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='responserollup',
+            name='granularity',
+            field=models.CharField(choices=[('minute', '分'), ('hour', '時間'), ('day', '日')], default='hour', max_length=10, verbose_name='集計単位'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='responserollup',
+            unique_together={('granularity', 'bucket_start', 'session_type', 'intent')},
+        ),
+        migrations.AddIndex(
+            model_name='responserollup',
+            index=models.Index(fields=['granularity', 'bucket_start'], name='main_respon_granula_02448f_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-19 03:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_response_rollup_granularity'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='performancemetrics',
+            name='number_of_turns',
+            field=models.IntegerField(default=0, verbose_name='会話ターン数'),
+        ),
+        migrations.AlterField(
+            model_name='performancemetrics',
+            name='response_time',
+            field=models.FloatField(default=0, verbose_name='累計応答時間（秒）'),
+        ),
+        migrations.AlterField(
+            model_name='performancemetrics',
+            name='session',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='performance_metrics', to='main.chatsession'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-19 03:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_performance_metrics_per_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='responserollup',
+            name='stage_count',
+            field=models.IntegerField(default=0, verbose_name='区間を記録した応答数'),
+        ),
+        migrations.AddField(
+            model_name='responserollup',
+            name='stage_time',
+            field=models.JSONField(default=dict, verbose_name='区間種別ごとの合計時間（ミリ秒）'),
+        ),
+    ]
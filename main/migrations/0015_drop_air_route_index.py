@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-19 04:20
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_response_rollup_stages'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='air',
+            name='main_air_place_f_4a9434_idx',
+        ),
+    ]
@@ -38,6 +38,12 @@ class Accommodations(models.Model):
         default=50,
         verbose_name="総部屋数"
     )
+    
+    class Meta:
+        indexes = [
+            # 料金順での検索用
+            models.Index(fields=['location', 'price_per_night']),
+        ]
 
 
 # 宿泊施設の空室管理モデル
@@ -105,6 +111,12 @@ class Air(models.Model):
         default=100,
         verbose_name="空席数"
     )
+    
+    class Meta:
+        indexes = [
+            # 出発日時の範囲での検索・並び替え用（出発地・目的地は部分一致で検索するためインデックスを使えない）
+            models.Index(fields=['departure_time']),
+        ]
 
 
 # 航空券の空席管理モデル
@@ -213,6 +225,13 @@ class ChatSession(models.Model):
     )
 
 
+class ChatMessageManager(models.Manager):
+    """画面・管理画面・集計用のメッセージ（LLM用のコンテキスト行を除く）"""
+
+    def get_queryset(self):
+        return super().get_queryset().exclude(message_type='context')
+
+
 # 会話メッセージを記録するモデル
 class ChatMessage(models.Model):
     MESSAGE_TYPES = [
@@ -220,6 +239,7 @@ class ChatMessage(models.Model):
         ('ai_agent', 'AIエージェント'),
         ('ai_assistant', 'AIアシスタント'),
         ('rule_bot', 'ルールベースBot'),
+        ('context', 'LLMコンテキスト'),
     ]
     
     session = models.ForeignKey(
@@ -245,6 +265,93 @@ class ChatMessage(models.Model):
         blank=True,
         verbose_name="推論プロセス"
     )
+    
+    # 既定ではLLM用のコンテキスト行（DatabaseConversationStoreの会話アイテム）を含めない
+    objects = ChatMessageManager()
+    # コンテキスト行を含むすべての行（会話履歴ストア用）
+    all_objects = models.Manager()
+    
+    class Meta:
+        indexes = [
+            # 会話履歴のキーセットページング用（セッション内を時刻・IDの順で走査）
+            models.Index(fields=['session', 'timestamp', 'id']),
+        ]
+
+
+# ルールベースBotの対話状態（セッションごとに1行、主キー検索で読み込む）
+class BotDialogueState(models.Model):
+    # 検索の途中で保持する入力項目
+    SLOT_FIELDS = ('location', 'checkin_date', 'checkout_date', 'departure', 'destination', 'departure_date')
+    
+    session = models.OneToOneField(
+        ChatSession,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='dialogue_state'
+    )
+    state = models.CharField(
+        max_length=50,
+        blank=True,
+        default='',
+        verbose_name="対話状態"
+    )
+    last_intent = models.CharField(
+        max_length=50,
+        blank=True,
+        default='',
+        verbose_name="直前のインテント"
+    )
+    search_type = models.CharField(
+        max_length=20,
+        blank=True,
+        default='',
+        verbose_name="検索タイプ"
+    )
+    location = models.CharField(
+        max_length=100,
+        blank=True,
+        default='',
+        verbose_name="宿泊地"
+    )
+    checkin_date = models.CharField(
+        max_length=100,
+        blank=True,
+        default='',
+        verbose_name="チェックイン日"
+    )
+    checkout_date = models.CharField(
+        max_length=100,
+        blank=True,
+        default='',
+        verbose_name="チェックアウト日"
+    )
+    departure = models.CharField(
+        max_length=100,
+        blank=True,
+        default='',
+        verbose_name="出発地"
+    )
+    destination = models.CharField(
+        max_length=100,
+        blank=True,
+        default='',
+        verbose_name="目的地"
+    )
+    departure_date = models.CharField(
+        max_length=100,
+        blank=True,
+        default='',
+        verbose_name="出発日"
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name="更新日時"
+    )
+    
+    def clear_slots(self):
+        """検索の入力項目をすべてクリア"""
+        for field in self.SLOT_FIELDS:
+            setattr(self, field, '')
 
 
 # 検索条件を記録するモデル
@@ -347,13 +454,15 @@ class TravelPackage(models.Model):
 
 # AIエージェント/アシスタント/Botのパフォーマンスを記録
 class PerformanceMetrics(models.Model):
-    session = models.ForeignKey(
+    # セッションごとに1件（応答の書き込み時にターン数・応答時間・エラー数をF()で加算して更新）
+    session = models.OneToOneField(
         ChatSession,
         on_delete=models.CASCADE,
         related_name='performance_metrics'
     )
     response_time = models.FloatField(
-        verbose_name="応答時間（秒）"
+        default=0,
+        verbose_name="累計応答時間（秒）"
     )
     successful_booking = models.BooleanField(
         default=False,
@@ -366,6 +475,7 @@ class PerformanceMetrics(models.Model):
         verbose_name="ユーザー満足度（1-5）"
     )
     number_of_turns = models.IntegerField(
+        default=0,
         verbose_name="会話ターン数"
     )
     task_completion_rate = models.FloatField(
@@ -416,6 +526,99 @@ class SystemResponse(models.Model):
     )
 
 
+# チャット応答の期間別集計（SystemResponseを分・時間・日単位に畳み込み、分析画面はこのテーブルだけを読む）
+class ResponseRollup(models.Model):
+    GRANULARITIES = [
+        ('minute', '分'),
+        ('hour', '時間'),
+        ('day', '日'),
+    ]
+
+    granularity = models.CharField(
+        max_length=10,
+        choices=GRANULARITIES,
+        default='hour',
+        verbose_name="集計単位"
+    )
+    bucket_start = models.DateTimeField(
+        verbose_name="集計期間の開始"
+    )
+    session_type = models.CharField(
+        max_length=20,
+        choices=ChatSession.SESSION_TYPES,
+        verbose_name="セッションタイプ"
+    )
+    intent = models.CharField(
+        max_length=100,
+        blank=True,
+        default='',
+        verbose_name="インテント"
+    )
+    count = models.IntegerField(
+        default=0,
+        verbose_name="応答数"
+    )
+    error_count = models.IntegerField(
+        default=0,
+        verbose_name="エラー数"
+    )
+    session_count = models.IntegerField(
+        default=0,
+        verbose_name="開始セッション数"
+    )
+    total_time = models.FloatField(
+        default=0,
+        verbose_name="処理時間の合計（秒）"
+    )
+    min_time = models.FloatField(
+        null=True,
+        blank=True,
+        verbose_name="最小処理時間（秒）"
+    )
+    max_time = models.FloatField(
+        null=True,
+        blank=True,
+        verbose_name="最大処理時間（秒）"
+    )
+    # 対数バケットのヒストグラム（バケット番号→件数、期間をまたいで足し合わせられる）
+    latency_histogram = models.JSONField(
+        default=dict,
+        verbose_name="処理時間のヒストグラム"
+    )
+    # 処理区間の種別ごとの合計時間（区間種別→ミリ秒、区間を記録した応答のみ）
+    stage_count = models.IntegerField(
+        default=0,
+        verbose_name="区間を記録した応答数"
+    )
+    stage_time = models.JSONField(
+        default=dict,
+        verbose_name="区間種別ごとの合計時間（ミリ秒）"
+    )
+    
+    class Meta:
+        unique_together = ['granularity', 'bucket_start', 'session_type', 'intent']
+        indexes = [
+            models.Index(fields=['granularity', 'bucket_start']),
+        ]
+
+
+# 集計ジョブの処理済み位置（どのSystemResponseまで畳み込んだか）
+class RollupCheckpoint(models.Model):
+    name = models.CharField(
+        max_length=50,
+        unique=True,
+        verbose_name="集計名"
+    )
+    last_id = models.BigIntegerField(
+        default=0,
+        verbose_name="処理済みの最大ID"
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name="更新日時"
+    )
+
+
 # ショッピングカート機能
 class Cart(models.Model):
     session_id = models.CharField(
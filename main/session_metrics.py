@@ -0,0 +1,77 @@
+import contextvars
+from contextlib import contextmanager
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from main.models import PerformanceMetrics, SystemResponse
+from main.write_behind import on_written
+
+# チャットセッションごとのパフォーマンス指標（PerformanceMetrics）の記録
+# ターン数・累計応答時間・エラー数は、SystemResponseが遅延書き込みキューから書き込まれたときに
+# セッション単位でまとめてF()で加算する（リクエスト処理中には書き込まない）。
+# 予約成功は予約を作成した時点で、明示したセッションに結び付ける
+
+# エラー応答として数えるインテント（analyticsの集計でも使う）
+ERROR_INTENTS = {'error'}
+
+# 処理中のチャットセッション（予約ツールから参照する）
+_current_session = contextvars.ContextVar('session_metrics_session', default=None)
+
+
+@contextmanager
+def track_session(session):
+    """このブロック内（同じコンテキスト）で処理中のチャットセッションを設定"""
+    token = _current_session.set(session)
+    try:
+        yield
+    finally:
+        _current_session.reset(token)
+
+
+def current_session():
+    """処理中のチャットセッション（チャットのターン外ではNone）"""
+    return _current_session.get()
+
+
+def _update_or_create(session_pk, updates: dict, initial: dict):
+    """既存のレコードを更新し、なければ作成（同時に作成された場合は更新し直す）"""
+    if PerformanceMetrics.objects.filter(session_id=session_pk).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            PerformanceMetrics.objects.create(session_id=session_pk, **initial)
+    except IntegrityError:
+        PerformanceMetrics.objects.filter(session_id=session_pk).update(**updates)
+
+
+def add_turns(session_pk, turns: int, response_time: float, errors: int = 0):
+    """ターン数・累計応答時間・エラー数をまとめて加算"""
+    _update_or_create(
+        session_pk,
+        updates={
+            'number_of_turns': F('number_of_turns') + turns,
+            'response_time': F('response_time') + response_time,
+            'error_count': F('error_count') + errors,
+        },
+        initial={'number_of_turns': turns, 'response_time': response_time, 'error_count': errors},
+    )
+
+
+@on_written(SystemResponse)
+def record_responses(responses: list):
+    """書き込まれた応答をセッションごとに集計して加算（1回の書き込みでセッションごとに1回のUPDATE）"""
+    sessions = {}
+    for response in responses:
+        turns = sessions.setdefault(response.session_id, {'turns': 0, 'response_time': 0.0, 'errors': 0})
+        turns['turns'] += 1
+        turns['response_time'] += response.processing_time
+        turns['errors'] += response.intent_detected in ERROR_INTENTS
+    for session_pk, turns in sessions.items():
+        add_turns(session_pk, turns['turns'], turns['response_time'], turns['errors'])
+
+
+def record_booking(session) -> None:
+    """予約成功を指定したチャットセッションの成果として記録"""
+    outcome = {'successful_booking': True, 'task_completion_rate': 1.0}
+    _update_or_create(session.pk, updates=outcome, initial=outcome)
@@ -1,3 +1,1098 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.db import connection, transaction
+from django.core.exceptions import ImproperlyConfigured
+from django.test import Client, TestCase, SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from main.ai_agents.intents import (
+    chat_classifier, bot_menu_classifier, bot_search_type_classifier, advanced_classifier
+)
+from main.ai_agents.intent_corpus import CHAT_CORPUS, BOT_MENU_CORPUS, BOT_SEARCH_TYPE_CORPUS
+from main.ai_agents import fast_path, spans, travel_service
+from main.ai_agents.bot import handle_rule_bot, perform_accommodation_search, perform_flight_search
+from main.ai_agents.slots import extract_slots
+from main.ai_agents.response_cache import ResponseCache, get_response_cache, is_cacheable, is_storable_answer
+from main.ai_agents.tool_cache import TTLCache, ToolError, cached_tool, get_tool_cache
+from main.ai_agents.tool_format import TOOL_FIELDS, CELL_SEPARATOR, format_tool_output
+from main.ai_agents.assistant import TravelChatAssistant
+from main.ai_agents.llm_client import get_openai_client, get_async_openai_client
+from main.ai_agents.context_window import ContextWindowBuilder, estimate_message_tokens
+from main.ai_agents.conversation_store import (
+    InMemoryConversationStore, DatabaseConversationStore, SQLiteConversationStore,
+)
+from main.ai_agents.travel_service import TOOL_FUNCTIONS
+from main.ai_agents.slot_corpus import SLOT_CORPUS, SLOT_CORPUS_TODAY
+from main.write_behind import WriteBehindQueue
+from main.middleware import fingerprint, get_query_profile_store
+from main.management.commands.benchmark_endpoints import seed_dataset, summarize_samples, compare_results
+from main.management.commands.stub_llm_server import DEFAULT_SCRIPT, StubLLM
+from main import analytics, metrics, session_metrics, views
+from main.analytics import LatencyHistogram
+from main.models import (
+    ChatSession, ChatMessage, SystemResponse, ResponseRollup, PerformanceMetrics, BotDialogueState, Accommodations, AccommodationAvailability, Air, FlightAvailability,
+    Booking, TravelPackage, Cart, CartItem
+)
+
+
+# 意図検出エンジンのテスト
+class IntentClassifierTests(SimpleTestCase):
+
+    def assertCorpus(self, classifier, corpus):
+        for message, expected in corpus:
+            with self.subTest(message=message):
+                self.assertEqual(classifier.classify(message)[0], expected)
+
+    def test_chat_corpus(self):
+        self.assertCorpus(chat_classifier, CHAT_CORPUS)
+
+    def test_bot_menu_corpus(self):
+        self.assertCorpus(bot_menu_classifier, BOT_MENU_CORPUS)
+
+    def test_bot_search_type_corpus(self):
+        self.assertCorpus(bot_search_type_classifier, BOT_SEARCH_TYPE_CORPUS)
+
+    def test_priority_follows_table_order(self):
+        # 航空券と宿泊の両方を含む場合は表の上位（航空券）を優先
+        self.assertEqual(chat_classifier.classify('ホテルと航空券をまとめて')[0], 'flight_search')
+
+    def test_multiple_keywords_raise_confidence(self):
+        _, single = chat_classifier.classify('フライト')
+        _, multiple = chat_classifier.classify('飛行機のフライトと航空券')
+        self.assertGreater(multiple, single)
+        self.assertLess(multiple, 1.0)
+
+    def test_match_all_returns_every_intent(self):
+        self.assertEqual(advanced_classifier.match_all('こんにちは、予約を検索したい'), ['search', 'booking', 'greeting'])
+        self.assertEqual(advanced_classifier.match_all('天気'), [])
+
+
+# 応答キャッシュのテスト
+@override_settings(RESPONSE_CACHE_ENABLED=True, RESPONSE_CACHE_INTENTS=['greeting', 'courtesy', 'info'])
+class ResponseCacheTests(SimpleTestCase):
+
+    def test_similar_question_hits_within_scope(self):
+        cache = ResponseCache(threshold=0.5)
+        cache.store('ai_agent', 'キャンセルはどうすればいいですか', 'info', 'マイページから取り消せます')
+        hit = cache.lookup('ai_agent', 'キャンセルはどうすればいいですか？', 'info')
+        self.assertEqual(hit['content'], 'マイページから取り消せます')
+        self.assertEqual(hit['similarity'], 1.0)
+        self.assertIsNone(cache.lookup('ai_assistant', 'キャンセルはどうすればいいですか', 'info'))
+
+    def test_expired_and_evicted_entries_miss(self):
+        cache = ResponseCache(maxsize=2, ttl=0)
+        cache.store('ai_agent', 'こんにちは', 'greeting', 'こんにちは！')
+        self.assertIsNone(cache.lookup('ai_agent', 'こんにちは', 'greeting'))
+
+        cache = ResponseCache(maxsize=2)
+        for message in ('こんにちは', 'ありがとう', 'このサイトの使い方'):
+            cache.store('ai_agent', message, 'info', message)
+        self.assertIsNone(cache.lookup('ai_agent', 'こんにちは', 'info'))
+        self.assertIsNotNone(cache.lookup('ai_agent', 'このサイトの使い方', 'info'))
+
+    def test_questions_with_search_conditions_are_not_cacheable(self):
+        for message in ['沖縄のホテルを予約できますか', '福岡行きの便は予約できますか', '札幌への行き方はどうすればいいですか',
+                        '明日でもキャンセルできますか', '3名でも使い方は同じですか']:
+            with self.subTest(message=message):
+                self.assertFalse(is_cacheable(chat_classifier.classify(message)[0], message))
+        self.assertTrue(is_cacheable('info', '支払いはカードでできますか'))
+
+    def test_other_city_does_not_receive_cached_answer(self):
+        # 都市だけが違う質問は類似度が閾値を超えるため、キャッシュの読み書きの対象にしない
+        cache = ResponseCache(threshold=0.75)
+        first, second = '沖縄の温泉付きホテルを今から予約することはできますか', '札幌の温泉付きホテルを今から予約することはできますか'
+        cache.store('ai_agent', first, 'info', '沖縄のホテルの空室はこちらです')
+        self.assertIsNotNone(cache.lookup('ai_agent', second, 'info'))
+        for message in (first, second):
+            with self.subTest(message=message):
+                self.assertFalse(is_cacheable(chat_classifier.classify(message)[0], message))
+
+
+class _ScriptedAssistant:
+    """会話履歴に応じた応答を返すTravelChatAssistantの代わり（LLMを呼ばない）"""
+
+    calls = []
+
+    def __init__(self, session_id=None, store=None):
+        self.session_id, self.store = session_id, store
+        self.last_context_stats = {}
+
+    def chat(self, message):
+        history = self.store.load(self.session_id)
+        content = '先ほどの沖縄のホテルの予約内容で承ります。' if history else 'どういたしまして。ご旅行の計画をお手伝いします。'
+        self.calls.append(self.session_id)
+        self.store.append(self.session_id, [{'role': 'user', 'content': message}, {'role': 'assistant', 'content': content}])
+        return content
+
+    def get_conversation_history(self):
+        return self.store.load(self.session_id)
+
+
+# 応答キャッシュとセッションの会話履歴のテスト
+@override_settings(RESPONSE_CACHE_ENABLED=True, RESPONSE_CACHE_INTENTS=['greeting', 'courtesy', 'info'])
+class ResponseCacheSessionTests(TestCase):
+
+    MESSAGE = 'ありがとうございます、よろしくお願いします'
+
+    def setUp(self):
+        get_response_cache().clear()
+        self.addCleanup(get_response_cache().clear)
+        _ScriptedAssistant.calls = []
+        patcher = mock.patch.object(views, 'TravelChatAssistant', _ScriptedAssistant)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def chat_session(self, session_id):
+        return ChatSession.objects.create(session_id=session_id, session_type='ai_assistant')
+
+    def test_answer_that_depends_on_history_is_not_shared(self):
+        booked = self.chat_session('cache-booked')
+        views.get_conversation_store().append('cache-booked', [
+            {'role': 'user', 'content': '沖縄のホテルを予約したい'},
+            {'role': 'assistant', 'content': '沖縄のホテルを予約しました。'},
+        ])
+        private = views.handle_ai_assistant(self.MESSAGE, booked)['content']
+        self.assertIn('沖縄', private)
+
+        other = views.handle_ai_assistant(self.MESSAGE, self.chat_session('cache-other'))
+        self.assertNotIn('response_cache', other['reasoning'])
+        self.assertNotEqual(other['content'], private)
+        self.assertEqual(_ScriptedAssistant.calls, ['cache-booked', 'cache-other'])
+
+    def test_first_turn_answer_is_shared(self):
+        first = views.handle_ai_assistant(self.MESSAGE, self.chat_session('cache-first'))
+        second = views.handle_ai_assistant(self.MESSAGE, self.chat_session('cache-second'))
+        self.assertTrue(second['reasoning']['response_cache']['hit'])
+        self.assertEqual(second['content'], first['content'])
+        self.assertEqual(_ScriptedAssistant.calls, ['cache-first'])
+
+        # キャッシュ命中はLLMを呼んでいないため、応答経路はllmではなくresponse_cacheとして集計する
+        self.assertEqual((views._llm_route(first), views._llm_route(second)), ('llm', 'response_cache'))
+        self.assertTrue(views._bypassed_llm('response_cache'))
+        self.assertTrue(views._bypassed_llm('fast_path_faq'))
+        self.assertFalse(views._bypassed_llm('llm'))
+
+    def test_answers_with_numbers_are_not_stored(self):
+        self.assertTrue(is_storable_answer('どういたしまして。'))
+        for content in ['合計は¥25,000です', '予約番号は3f2a9c1e-0b7d-4e5f-8a6b-9c0d1e2f3a4bです',
+                        'ご予約は１２月です', '検索中にエラーが発生しました: timeout']:
+            with self.subTest(content=content):
+                self.assertFalse(is_storable_answer(content))
+
+
+# LLMを通さない定型応答ルーティングのテスト
+class FastPathRoutingTests(SimpleTestCase):
+
+    def test_short_greeting_and_thanks_bypass_llm(self):
+        self.assertEqual(fast_path.route('こんにちは！')['route'], 'fast_path_greeting')
+        self.assertEqual(fast_path.route('ありがとうございます')['route'], 'fast_path_thanks')
+
+    def test_faq_uses_template(self):
+        result = fast_path.route('予約のキャンセル方法')
+        self.assertEqual(result['faq_topic'], 'cancel')
+        self.assertEqual(result['intent'], 'info')
+
+    def test_faq_phrases(self):
+        self.assertEqual(fast_path.route('料金は税込ですか')['faq_topic'], 'price_includes')
+        self.assertEqual(fast_path.route('予約の日程を変更したい')['faq_topic'], 'change')
+
+    def test_unrelated_messages_do_not_match_faq_stems(self):
+        # 「申し込み」は「込み」、「パスワードを変更」は「変更」を含むが、FAQの定型文では答えない
+        for message in ['予約を申し込みたい', 'パスワードを変更したい', 'メールアドレスの変更はどこですか']:
+            with self.subTest(message=message):
+                self.assertIsNone(fast_path.route(message))
+
+    def test_substantive_requests_reach_llm(self):
+        for message in ['こんにちは、来月北海道に旅行したいのですが', '沖縄のホテルをキャンセルしたい', '予約番号 1234 を変更']:
+            with self.subTest(message=message):
+                self.assertIsNone(fast_path.route(message))
+
+
+
+# ルールベースBotのスロット抽出のテスト
+class SlotExtractionTests(SimpleTestCase):
+
+    def test_slot_corpus(self):
+        for message, expected in SLOT_CORPUS:
+            slots = extract_slots(message, today=SLOT_CORPUS_TODAY)
+            for key, value in expected.items():
+                with self.subTest(message=message, slot=key):
+                    self.assertEqual(slots[key], value)
+
+# ルールベースBotの対話状態のテスト
+class RuleBotDialogueStateTests(TestCase):
+
+    def setUp(self):
+        self.session = ChatSession.objects.create(session_id='rule-bot-test', session_type='rule_bot')
+
+    def converse(self, messages):
+        return [handle_rule_bot(message, self.session)['intent'] for message in messages]
+
+    def test_slots_are_kept_between_turns(self):
+        self.converse(['1', '航空券', '東京', '沖縄'])
+        dialogue = BotDialogueState.objects.get(session=self.session)
+        self.assertEqual((dialogue.state, dialogue.departure, dialogue.destination),
+                         ('awaiting_departure_date', '東京', '沖縄'))
+
+    def test_retry_stays_in_current_step(self):
+        intents = self.converse(['1', '航空券', '東京', '不明な場所', '沖縄'])
+        self.assertEqual(intents[-2:], ['flight_destination_retry', 'flight_destination_set'])
+
+    def test_new_search_clears_slots(self):
+        self.converse(['1', '宿泊', '沖縄', '2025-08-20', '2025-08-22', '2名', '1'])
+        dialogue = BotDialogueState.objects.get(session=self.session)
+        self.assertEqual((dialogue.state, dialogue.location), ('awaiting_search_type', ''))
+
+
+# ルールベースBotの検索結果（空き状況の反映）のテスト
+class RuleBotAvailabilityTests(TestCase):
+
+    def setUp(self):
+        self.today = timezone.localdate()
+        self.full = Accommodations.objects.create(name='満室ホテル', location='沖縄', price_per_night=5000)
+        self.open = Accommodations.objects.create(name='空室ホテル', location='沖縄', price_per_night=8000)
+        AccommodationAvailability.objects.create(
+            accommodation=self.full, date=self.today + timedelta(days=2), available_rooms=0
+        )
+
+        departure = timezone.now() + timedelta(days=2)
+        self.past = Air.objects.create(name='過去航空', flight_number='PA1', place_from='東京', place_to='沖縄',
+                                       departure_time=timezone.now() - timedelta(days=1),
+                                       arrival_time=timezone.now() - timedelta(hours=21), fee=10000)
+        self.few = Air.objects.create(name='少席航空', flight_number='FS1', place_from='東京', place_to='沖縄',
+                                      departure_time=departure, arrival_time=departure + timedelta(hours=3), fee=10000)
+        self.many = Air.objects.create(name='空席航空', flight_number='MS1', place_from='東京', place_to='沖縄',
+                                       departure_time=departure, arrival_time=departure + timedelta(hours=3), fee=12000)
+        FlightAvailability.objects.create(flight=self.few, date=timezone.localdate(departure), available_seats=1)
+
+    def test_accommodations_without_rooms_are_excluded_in_two_queries(self):
+        checkin, checkout = self.today + timedelta(days=1), self.today + timedelta(days=3)
+        with self.assertNumQueries(2):
+            results = perform_accommodation_search('沖縄', checkin.isoformat(), checkout.isoformat(), 2)
+        self.assertEqual(results, [self.open])
+
+    def test_only_upcoming_flights_with_enough_seats(self):
+        with self.assertNumQueries(2):
+            results = perform_flight_search('東京', '沖縄', '', 2)
+        self.assertEqual(results, [self.many])
+
+
+# 旅行検索サービスのテスト
+class TravelServiceTests(TestCase):
+
+    def test_departure_date_filter_uses_local_day_boundaries(self):
+        day = timezone.localdate() + timedelta(days=3)
+        day_start, day_end = travel_service.day_range(day)
+        for flight_number, departure in [('BF1', day_start - timedelta(minutes=30)), ('IN1', day_start),
+                                         ('IN2', day_end - timedelta(minutes=1)), ('AF1', day_end)]:
+            Air.objects.create(name='テスト航空', flight_number=flight_number, place_from='東京', place_to='沖縄',
+                               departure_time=departure, arrival_time=departure + timedelta(hours=3), fee=10000)
+
+        flights = travel_service.find_flights('東京', '沖縄', day.isoformat(), fallback=False)
+        self.assertEqual([flight.flight_number for flight in flights], ['IN1', 'IN2'])
+
+
+# 検索ツール結果キャッシュのテスト
+class ToolCacheTests(TestCase):
+
+    def setUp(self):
+        get_tool_cache().clear()
+        self.calls = []
+
+    def test_entries_expire_after_ttl(self):
+        cache = TTLCache(maxsize=4, ttl=60)
+        cache.set('fresh', 1)
+        cache.set('expired', 2, ttl=0)
+        self.assertEqual(cache.get('fresh'), (True, 1))
+        self.assertEqual(cache.get('expired'), (False, None))
+        self.assertEqual(cache.stats()['size'], 1)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), (True, 1))
+        self.assertEqual(cache.get('b'), (False, None))
+        self.assertEqual(cache.get('c'), (True, 3))
+
+    def test_normalized_arguments_share_an_entry(self):
+        @cached_tool('test_search')
+        def search(location: str, guests: int = 2):
+            self.calls.append(location)
+            return f'{location}の結果'
+
+        search('沖縄')
+        search('  沖縄 ', guests=2)
+        self.assertEqual(self.calls, ['沖縄'])
+
+    def test_model_changes_invalidate_cache(self):
+        @cached_tool('test_search')
+        def search(location: str):
+            self.calls.append(location)
+            return f'{location}の結果'
+
+        search('沖縄')
+        Accommodations.objects.create(name='新しいホテル', location='沖縄', price_per_night=9000)
+        search('沖縄')
+        self.assertEqual(self.calls, ['沖縄', '沖縄'])
+
+    def test_errors_are_not_cached(self):
+        @cached_tool('test_search')
+        def search(location: str):
+            self.calls.append(location)
+            return ToolError('検索中にエラーが発生しました: database is locked')
+
+        self.assertEqual(search('沖縄'), '検索中にエラーが発生しました: database is locked')
+        search('沖縄')
+        self.assertEqual(self.calls, ['沖縄', '沖縄'])
+
+
+# OpenAIクライアントの設定のテスト
+class LLMClientTests(SimpleTestCase):
+
+    @override_settings(OPENAI_API_KEY='')
+    def test_missing_api_key_fails_clearly(self):
+        for get_client in (get_openai_client, get_async_openai_client):
+            with self.subTest(client=get_client.__name__):
+                with self.assertRaisesMessage(ImproperlyConfigured, 'OPENAI_API_KEY'):
+                    get_client()
+
+
+# AIアシスタントのツール並列実行のテスト
+class AssistantToolCallTests(SimpleTestCase):
+
+    @staticmethod
+    def tool_call(name, arguments='{}'):
+        return SimpleNamespace(function=SimpleNamespace(name=name, arguments=arguments))
+
+    def test_results_keep_call_order(self):
+        def slow(**kwargs):
+            time.sleep(0.1)
+            return 'slow'
+
+        with mock.patch.dict(TOOL_FUNCTIONS, {'slow_tool': slow, 'fast_tool': lambda **kwargs: 'fast'}):
+            results = TravelChatAssistant.execute_tool_calls([
+                self.tool_call('slow_tool'), self.tool_call('fast_tool'), self.tool_call('unknown_tool'),
+            ])
+        self.assertEqual(results, ['slow', 'fast', '未知の関数が呼び出されました。'])
+
+    @override_settings(TOOL_TURN_TIMEOUT=0.05)
+    def test_calls_over_the_turn_budget_get_a_timeout_message(self):
+        release = threading.Event()
+
+        def blocked(**kwargs):
+            release.wait(5)
+            return 'late'
+
+        try:
+            with mock.patch.dict(TOOL_FUNCTIONS, {'blocked_tool': blocked, 'fast_tool': lambda **kwargs: 'fast'}):
+                results = TravelChatAssistant.execute_tool_calls([self.tool_call('blocked_tool'), self.tool_call('fast_tool')])
+        finally:
+            release.set()
+        self.assertEqual(results, ['blocked_toolの実行がタイムアウトしました（0.05秒）。', 'fast'])
+
+
+# チャット・テレメトリ行の遅延書き込みキューのテスト
+class WriteBehindQueueTests(TestCase):
+
+    def setUp(self):
+        self.session = ChatSession.objects.create(session_id='write-behind-test', session_type='rule_bot')
+
+    def enqueue_turn(self, queue):
+        queue.enqueue(ChatMessage(session=self.session, message_type='user', content='こんにちは'))
+        queue.enqueue(ChatMessage(session=self.session, message_type='rule_bot', content='こんにちは！'))
+        queue.enqueue(SystemResponse(session=self.session, intent_detected='greeting',
+                                     processing_time=0.01, response_generated='こんにちは！'))
+
+    def test_rows_are_batched_per_model_and_written_before_reads(self):
+        queue = WriteBehindQueue(flush_interval=3600, batch_size=50, max_buffer=100)
+        self.enqueue_turn(queue)
+        self.assertEqual(len(queue.pending(self.session.pk)), 3)
+        self.assertFalse(ChatMessage.objects.filter(session=self.session).exists())
+
+        with CaptureQueriesContext(connection) as queries:
+            queue.ensure_written(self.session.pk)
+        # モデルごとに1回のINSERT
+        self.assertEqual(sum(query['sql'].startswith(('INSERT INTO "main_chatmessage"', 'INSERT INTO "main_systemresponse"'))
+                             for query in queries), 2)
+        self.assertEqual(list(ChatMessage.objects.filter(session=self.session).order_by('id')
+                              .values_list('message_type', flat=True)), ['user', 'rule_bot'])
+        self.assertEqual(SystemResponse.objects.filter(session=self.session).count(), 1)
+
+    def test_full_buffer_is_written_by_caller(self):
+        queue = WriteBehindQueue(flush_interval=3600, batch_size=50, max_buffer=3)
+        self.enqueue_turn(queue)
+        self.assertEqual(queue.stats()['pending'], 0)
+        self.assertEqual(ChatMessage.objects.filter(session=self.session).count(), 2)
+
+
+# 会話履歴API（キーセットページング・ETag）のテスト
+class ConversationHistoryTests(TestCase):
+
+    def setUp(self):
+        self.session = ChatSession.objects.create(session_id='history-test', session_type='rule_bot')
+        for index in range(5):
+            ChatMessage.objects.create(session=self.session, message_type='user', content=f'質問{index}')
+            ChatMessage.objects.create(session=self.session, message_type='rule_bot', content=f'回答{index}')
+        ChatMessage.objects.create(session=self.session, message_type='context', content='LLM用')
+
+    def history(self, etag=None, **params):
+        headers = {'If-None-Match': etag} if etag else {}
+        return self.client.get('/api/conversation/history/', {'session_id': 'history-test', **params}, headers=headers)
+
+    def contents(self, response):
+        return [message['content'] for message in response.json()['conversation_history']]
+
+    def test_pages_walk_back_without_context_rows(self):
+        first = self.history(limit=4)
+        self.assertEqual(self.contents(first), ['質問3', '回答3', '質問4', '回答4'])
+        second = self.history(limit=4, before=first.json()['next_cursor'])
+        self.assertEqual(self.contents(second), ['質問1', '回答1', '質問2', '回答2'])
+        last = self.history(limit=4, before=second.json()['next_cursor'])
+        self.assertEqual(self.contents(last), ['質問0', '回答0'])
+        self.assertFalse(last.json()['has_more'])
+
+    def test_after_returns_newer_messages(self):
+        oldest = self.history(limit=1, before=self.history(limit=9).json()['next_cursor'])
+        newer = self.history(limit=2, after=oldest.json()['conversation_history'][0]['cursor'])
+        self.assertEqual(self.contents(newer), ['回答0', '質問1'])
+
+    def test_unchanged_history_returns_304(self):
+        etag = self.history()['ETag']
+        self.assertEqual(self.history(etag=etag).status_code, 304)
+        ChatMessage.objects.create(session=self.session, message_type='user', content='追加')
+        self.assertEqual(self.history(etag=etag).status_code, 200)
+
+
+# 会話履歴ストアのテスト（どのバックエンドでも同じ履歴を返す）
+class ConversationStoreTests(TestCase):
+
+    ITEMS = [
+        {'role': 'user', 'content': '沖縄のホテル'},
+        {'role': 'assistant', 'content': None, 'tool_calls': [
+            {'id': 'call_1', 'type': 'function',
+             'function': {'name': 'search_accommodations', 'arguments': '{"location": "沖縄"}'}},
+        ]},
+        {'role': 'tool', 'content': '1件\n施設名|1泊料金\n海辺ホテル|¥8,000', 'tool_call_id': 'call_1', 'name': 'search_accommodations'},
+        {'role': 'assistant', 'content': '海辺ホテルがございます。'},
+    ]
+
+    def setUp(self):
+        ChatSession.objects.create(session_id='store-test', session_type='ai_assistant')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.stores = [
+            InMemoryConversationStore(),
+            DatabaseConversationStore(),
+            SQLiteConversationStore(os.path.join(directory.name, 'conversations.sqlite3')),
+        ]
+
+    def test_backends_return_the_same_history(self):
+        for store in self.stores:
+            with self.subTest(store=store.name):
+                store.append('store-test', self.ITEMS[:2])
+                store.append('store-test', self.ITEMS[2:])
+                self.assertEqual(store.load('store-test'), self.ITEMS)
+                self.assertEqual(store.load('store-test', limit=2), self.ITEMS[2:])
+                self.assertEqual(store.load('other-session'), [])
+
+    def test_pop_and_clear(self):
+        for store in self.stores:
+            with self.subTest(store=store.name):
+                store.append('store-test', self.ITEMS)
+                self.assertEqual(store.pop('store-test'), self.ITEMS[-1])
+                self.assertEqual(store.load('store-test'), self.ITEMS[:-1])
+                store.clear('store-test')
+                self.assertEqual(store.load('store-test'), [])
+                self.assertIsNone(store.pop('store-test'))
+
+    def test_context_rows_are_hidden_from_chat_messages(self):
+        session = ChatSession.objects.get(session_id='store-test')
+        ChatMessage.objects.create(session=session, message_type='user', content='沖縄のホテル')
+        DatabaseConversationStore().append('store-test', self.ITEMS)
+        self.assertEqual(list(session.messages.values_list('message_type', flat=True)), ['user'])
+        self.assertEqual(ChatMessage.objects.count(), 1)
+        self.assertEqual(ChatMessage.all_objects.filter(message_type='context').count(), len(self.ITEMS))
+        self.assertEqual(DatabaseConversationStore().load('store-test'), self.ITEMS)
+
+    def test_database_store_requires_session(self):
+        with self.assertRaises(ChatSession.DoesNotExist):
+            DatabaseConversationStore().append('missing-session', self.ITEMS[:1])
+
+
+# LLMに送る履歴の組み立て（トークン予算・tool結果の要約）のテスト
+class ContextWindowTests(SimpleTestCase):
+
+    @staticmethod
+    def tool_turn(call_id, question, tool_name, rows):
+        result = f'{rows}件\n施設名|1泊料金\n' + '\n'.join(f'ホテル{index}|¥{8000 + index:,}' for index in range(rows))
+        return [
+            {'role': 'user', 'content': question},
+            {'role': 'assistant', 'content': None, 'tool_calls': [
+                {'id': call_id, 'type': 'function', 'function': {'name': tool_name, 'arguments': '{}'}},
+            ]},
+            {'role': 'tool', 'content': result, 'tool_call_id': call_id, 'name': tool_name},
+            {'role': 'assistant', 'content': f'{question}の結果をご案内しました。'},
+        ]
+
+    def test_orphaned_tool_messages_are_dropped(self):
+        history = [
+            {'role': 'user', 'content': '沖縄のホテル'},
+            {'role': 'tool', 'content': '対応する呼び出しのない結果', 'tool_call_id': 'call_orphan'},
+            {'role': 'assistant', 'content': None, 'tool_calls': [
+                {'id': 'call_unanswered', 'type': 'function', 'function': {'name': 'search_air', 'arguments': '{}'}},
+            ]},
+            {'role': 'user', 'content': '札幌はどうですか'},
+            {'role': 'assistant', 'content': '札幌のホテルをお探しします。'},
+        ]
+        messages, stats = ContextWindowBuilder(budget_tokens=10000, keep_tool_turns=1).build('システム', history, '続けて')
+        self.assertEqual([message['content'] for message in messages],
+                         ['システム', '沖縄のホテル', '札幌はどうですか', '札幌のホテルをお探しします。', '続けて'])
+        self.assertEqual(stats['dropped_messages'], 2)
+
+    def test_old_tool_results_are_compacted(self):
+        old = self.tool_turn('call_1', '沖縄のホテル', 'search_accommodations', 30)
+        recent = self.tool_turn('call_2', '札幌のホテル', 'search_accommodations', 30)
+        messages, stats = ContextWindowBuilder(budget_tokens=10000, keep_tool_turns=1).build('システム', old + recent, '続けて')
+        old_result, recent_result = [message['content'] for message in messages if message['role'] == 'tool']
+        self.assertTrue(old_result.startswith('[search_accommodationsの結果(要約): 30件'))
+        self.assertEqual(recent_result, recent[2]['content'])
+        self.assertEqual(stats['compacted_tool_results'], 1)
+        self.assertGreater(stats['saved_tokens'], 0)
+
+    def test_history_is_trimmed_to_the_budget_in_whole_blocks(self):
+        old = self.tool_turn('call_1', '沖縄のホテル', 'search_accommodations', 30)
+        recent = self.tool_turn('call_2', '札幌のホテル', 'search_accommodations', 30)
+        system, user = {'role': 'system', 'content': 'システム'}, {'role': 'user', 'content': '続けて'}
+        budget = sum(estimate_message_tokens(message) for message in [system, *recent, user])
+
+        messages, stats = ContextWindowBuilder(budget_tokens=budget, keep_tool_turns=1).build('システム', old + recent, '続けて')
+        self.assertEqual(messages, [system, *recent, user])
+        self.assertEqual(stats['prompt_tokens'], budget)
+        self.assertFalse(stats['over_budget'])
+        self.assertEqual(stats['dropped_messages'], len(old))
+
+
+# ツール結果の出力形式（compact / verbose）のテスト
+class ToolFormatTests(SimpleTestCase):
+
+    FLIGHTS = [
+        {'便名': 'JL901', '航空会社': '日本航空', '出発地': '東京', '目的地': '沖縄', '出発時刻': '2026-10-20 08:00',
+         '到着時刻': '2026-10-20 10:45', '料金': '¥25,000', '空席数': 12, '便種別': '直行便', '曜日': '火'},
+        {'便名': 'NH463', '航空会社': '全日空', '出発地': '東京', '目的地': '沖縄', '出発時刻': '2026-10-20 09:30',
+         '到着時刻': '2026-10-20 12:15', '料金': '¥23,500', '空席数': 3, '便種別': '直行便', '曜日': '火'},
+    ]
+
+    @staticmethod
+    def parse_compact(output):
+        """compact形式の表を (件数, 辞書のリスト) に戻す"""
+        count, header, *rows = output.splitlines()
+        columns = header.split(CELL_SEPARATOR)
+        parsed = [dict(zip(columns, row.split(CELL_SEPARATOR))) for row in rows]
+        return int(count.removesuffix('件')), parsed
+
+    def test_compact_and_verbose_carry_the_same_fields(self):
+        with override_settings(TOOL_OUTPUT_FORMAT='verbose'):
+            verbose = json.loads(format_tool_output('search_air', self.FLIGHTS))
+        with override_settings(TOOL_OUTPUT_FORMAT='compact'):
+            count, compact = self.parse_compact(format_tool_output('search_air', self.FLIGHTS))
+
+        self.assertEqual(verbose, self.FLIGHTS)
+        self.assertEqual(count, len(verbose))
+        # compact形式は登録された列だけを、同じ値で返す
+        self.assertEqual(compact, [
+            {column: str(row[column]) for column in TOOL_FIELDS['search_air']} for row in verbose
+        ])
+
+    def test_unregistered_tools_keep_every_column(self):
+        rows = [{'名前': '那覇', '人口': 317000}, {'名前': '石垣', '備考': '離島'}]
+        with override_settings(TOOL_OUTPUT_FORMAT='compact'):
+            _, compact = self.parse_compact(format_tool_output('unknown_tool', rows))
+        self.assertEqual(compact, [{'名前': '那覇', '人口': '317000', '備考': ''}, {'名前': '石垣', '人口': '', '備考': '離島'}])
+
+    def test_separators_in_values_do_not_break_rows(self):
+        rows = [{**self.FLIGHTS[0], '航空会社': '日本航空|JAL\n国内線'}]
+        with override_settings(TOOL_OUTPUT_FORMAT='compact'):
+            _, compact = self.parse_compact(format_tool_output('search_air', rows))
+        self.assertEqual(compact[0]['航空会社'], '日本航空｜JAL 国内線')
+        self.assertEqual(compact[0]['便名'], 'JL901')
+
+    def test_note_is_appended_in_both_formats(self):
+        note = '\n\n※表示料金は2名様でのご利用を想定しています。'
+        with override_settings(TOOL_OUTPUT_FORMAT='verbose'):
+            self.assertTrue(format_tool_output('search_air', self.FLIGHTS, note).endswith(note))
+        with override_settings(TOOL_OUTPUT_FORMAT='compact'):
+            self.assertTrue(format_tool_output('search_air', self.FLIGHTS, note).endswith('\n' + note.strip()))
+
+
+# 分析用の集計（ヒストグラム・時間別集計）のテスト
+class LatencyHistogramTests(SimpleTestCase):
+
+    def test_percentiles_within_relative_error(self):
+        histogram = LatencyHistogram()
+        for millis in range(1, 1001):
+            histogram.add(millis / 1000)
+        for q, expected in [(50, 0.5), (90, 0.9), (99, 0.99)]:
+            with self.subTest(q=q):
+                self.assertAlmostEqual(histogram.percentile(q), expected, delta=expected * (LatencyHistogram.GROWTH - 1))
+
+    def test_merge_matches_single_histogram(self):
+        values = [0.01, 0.2, 0.35, 1.5, 3.0, 12.0]
+        whole, first, second = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+        for index, value in enumerate(values):
+            whole.add(value)
+            (first if index % 2 else second).add(value)
+        merged = LatencyHistogram(first.to_dict()).merge(LatencyHistogram(second.to_dict()))
+        self.assertEqual(merged.counts, whole.counts)
+
+
+class ResponseRollupTests(TestCase):
+
+    def setUp(self):
+        for session_id, times in [('rollup-a', [0.1, 0.2]), ('rollup-b', [0.3, 5.0])]:
+            session = ChatSession.objects.create(session_id=session_id, session_type='ai_agent')
+            for processing_time in times:
+                SystemResponse.objects.create(session=session, intent_detected='general',
+                                              processing_time=processing_time, response_generated='応答')
+        SystemResponse.objects.create(session=session, intent_detected='error',
+                                      processing_time=0.05, response_generated='内部エラー')
+
+    def test_rows_are_folded_once(self):
+        self.assertEqual(analytics.refresh_rollups(lag_seconds=0), 5)
+        self.assertEqual(analytics.refresh_rollups(lag_seconds=0), 0)
+        for granularity in ['minute', 'hour', 'day']:
+            with self.subTest(granularity=granularity):
+                rollups = ResponseRollup.objects.filter(granularity=granularity)
+                self.assertEqual(sum(rollups.values_list('count', flat=True)), 5)
+                self.assertEqual(sum(rollups.values_list('session_count', flat=True)), 2)
+
+    def test_summary_reads_rollups(self):
+        analytics.refresh_rollups(lag_seconds=0)
+        with self.assertNumQueries(1):
+            summary = analytics.summarize()['ai_agent']
+        self.assertEqual(summary['total_responses'], 5)
+        self.assertEqual(summary['total_sessions'], 2)
+        self.assertEqual(summary['turns_per_session'], 2.5)
+        self.assertEqual(summary['error_rate'], 20.0)
+        self.assertEqual(summary['p99_response_time'], 5.0)
+        self.assertEqual(summary['intent_breakdown'], [('general', 4), ('error', 1)])
+
+    def test_prune_keeps_day_rollups_and_session_counts(self):
+        # 40日前の応答として集計し、保持期間（生の行30日・分単位2日）を過ぎたものを削除
+        SystemResponse.objects.update(timestamp=timezone.now() - timedelta(days=40))
+        analytics.refresh_rollups(lag_seconds=0)
+        deleted = analytics.prune()
+        self.assertEqual(deleted['raw'], 3)
+        self.assertEqual(deleted['minute'], 2)
+        self.assertEqual(SystemResponse.objects.count(), 2)
+        self.assertEqual(analytics.summarize()['ai_agent']['total_responses'], 5)
+
+        # 各セッションの最初の応答は残るため、新しい応答で開始セッション数は増えない
+        SystemResponse.objects.create(session=ChatSession.objects.get(session_id='rollup-a'), intent_detected='general',
+                                      processing_time=0.1, response_generated='応答')
+        analytics.refresh_rollups(lag_seconds=0)
+        summary = analytics.summarize()['ai_agent']
+        self.assertEqual(summary['total_responses'], 6)
+        self.assertEqual(summary['total_sessions'], 2)
+
+
+    def test_performance_page_does_not_fold_responses(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/performance/')
+        self.assertContains(response, 'まだ集計されていません')
+        self.assertTrue(all(query['sql'].startswith('SELECT') for query in context.captured_queries))
+        self.assertFalse(ResponseRollup.objects.exists())
+
+        analytics.refresh_rollups(lag_seconds=0)
+        self.assertContains(self.client.get('/performance/'), '集計時点')
+
+
+# セッション単位のパフォーマンス指標のテスト
+class SessionMetricsTests(TestCase):
+
+    def setUp(self):
+        self.session = ChatSession.objects.create(session_id='metrics-test', session_type='ai_agent')
+
+    def respond(self, session, processing_time, queue, intent='general'):
+        queue.enqueue(SystemResponse(session=session, intent_detected=intent,
+                                     processing_time=processing_time, response_generated='応答'))
+
+    def test_turns_are_added_when_responses_are_written(self):
+        queue = WriteBehindQueue(flush_interval=3600, batch_size=50, max_buffer=100)
+        self.respond(self.session, 0.5, queue=queue)
+        self.respond(self.session, 1.5, intent='error', queue=queue)
+        self.assertFalse(PerformanceMetrics.objects.exists())
+        # 1回の書き込みでセッションごとに1回だけ加算する（初回はUPDATEで0件のためINSERT）
+        with CaptureQueriesContext(connection) as queries:
+            queue.flush()
+        self.assertEqual(sum('main_performancemetrics' in query['sql'] for query in queries), 2)
+        self.respond(self.session, 1.0, queue=queue)
+        queue.flush()
+        metrics = PerformanceMetrics.objects.get(session=self.session)
+        self.assertEqual(metrics.number_of_turns, 3)
+        self.assertAlmostEqual(metrics.response_time, 3.0)
+        self.assertEqual(metrics.error_count, 1)
+
+    @override_settings(CHAT_WRITE_BEHIND_ENABLED=False)
+    def test_turns_are_added_when_write_behind_is_disabled(self):
+        self.respond(self.session, 1.0, queue=WriteBehindQueue())
+        self.assertEqual(PerformanceMetrics.objects.get(session=self.session).number_of_turns, 1)
+
+    def test_rollup_does_not_count_turns_again(self):
+        queue = WriteBehindQueue(flush_interval=3600)
+        self.respond(self.session, 1.0, queue=queue)
+        queue.flush()
+        analytics.refresh_rollups(lag_seconds=0)
+        self.assertEqual(PerformanceMetrics.objects.get(session=self.session).number_of_turns, 1)
+
+    def test_booking_is_linked_to_the_given_session(self):
+        session_metrics.record_booking(self.session)
+        queue = WriteBehindQueue(flush_interval=3600)
+        self.respond(self.session, 2.0, queue=queue)
+        queue.flush()
+        metrics = PerformanceMetrics.objects.get(session=self.session)
+        self.assertTrue(metrics.successful_booking)
+        self.assertEqual(metrics.number_of_turns, 1)
+
+    def test_current_session_is_set_only_inside_a_turn(self):
+        self.assertIsNone(session_metrics.current_session())
+        with session_metrics.track_session(self.session):
+            self.assertEqual(session_metrics.current_session(), self.session)
+        self.assertIsNone(session_metrics.current_session())
+
+    def test_outcomes_compare_systems(self):
+        other = ChatSession.objects.create(session_id='metrics-other', session_type='ai_agent')
+        queue = WriteBehindQueue(flush_interval=3600)
+        for _ in range(4):
+            self.respond(self.session, 1.0, queue=queue)
+        self.respond(other, 1.0, intent='error', queue=queue)
+        queue.flush()
+        session_metrics.record_booking(self.session)
+        outcome = analytics.session_outcomes()['ai_agent']
+        self.assertEqual(outcome['booking_rate'], 50.0)
+        self.assertEqual(outcome['avg_turns'], 2.5)
+        self.assertEqual(outcome['turns_to_booking'], 4.0)
+        self.assertEqual(outcome['errors_per_session'], 0.5)
+
+
+# チャット1ターンの処理区間の計測のテスト
+class TurnSpanTests(TestCase):
+
+    def test_tool_span_counts_queries(self):
+        @spans.traced_tool('count_sessions')
+        def count_sessions():
+            return ChatSession.objects.count() + ChatSession.objects.filter(is_active=True).count()
+
+        self.assertEqual(count_sessions(), 0)
+        with spans.track_turn() as trace:
+            count_sessions()
+        [tool_span] = trace['spans']
+        self.assertEqual((tool_span['kind'], tool_span['name'], tool_span['queries']), ('tool', 'count_sessions', 2))
+
+    def test_stage_totals_exclude_spans_after_processing(self):
+        with spans.track_turn(started=100.0) as trace:
+            spans.add_span('queue', 'agent_executor', 100.0, 100.01)
+            spans.add_span('llm', 'chat.completions', 100.01, 100.21)
+            spans.add_span('tool', 'search_air', 100.21, 100.26)
+            spans.add_span('persist', 'chat_message', 100.31, 100.32)
+        stages = spans.stage_totals(trace, processing_time=0.3, processed_at=100.31)
+        self.assertEqual(stages, {'queue': 10.0, 'llm': 200.0, 'tool': 50.0, 'persist': 10.0, 'other': 50.0})
+
+    def test_rollups_average_stages(self):
+        session = ChatSession.objects.create(session_id='span-test', session_type='ai_assistant')
+        for llm_ms in (100.0, 300.0):
+            SystemResponse.objects.create(session=session, intent_detected='general', processing_time=0.4,
+                                          response_generated='応答', api_call_info={'stages': {'llm': llm_ms, 'other': 100.0}})
+        SystemResponse.objects.create(session=session, intent_detected='general', processing_time=0.1,
+                                      response_generated='区間なし')
+        analytics.refresh_rollups(lag_seconds=0)
+        breakdown = {stage['kind']: stage for stage in analytics.summarize()['ai_assistant']['stage_breakdown']}
+        self.assertEqual(breakdown['llm']['avg_ms'], 200.0)
+        self.assertEqual(breakdown['other']['percent'], 33.3)
+
+
+# リクエスト単位のDBクエリ計測のテスト
+class QueryProfilerTests(TestCase):
+
+    def setUp(self):
+        get_query_profile_store().clear()
+
+    def test_fingerprint_ignores_in_list_size_and_numbers(self):
+        self.assertEqual(
+            fingerprint('SELECT * FROM "main_air" WHERE "id" IN (%s, %s, %s) LIMIT 21'),
+            fingerprint('SELECT * FROM "main_air"  WHERE "id" IN (%s) LIMIT 5'),
+        )
+
+    def test_disabled_by_default(self):
+        self.assertFalse(self.client.get('/performance/queries/').has_header('Server-Timing'))
+
+    @override_settings(QUERY_PROFILER_ENABLED=True, QUERY_PROFILER_LOG_SAMPLE_RATE=0)
+    def test_records_queries_per_url_name(self):
+        response = self.client.get('/cart/')
+        self.assertRegex(response['Server-Timing'], r'^db;desc="\d+ queries";dur=')
+        [row] = get_query_profile_store().report()
+        self.assertEqual((row['route'], row['requests']), ('cart', 1))
+        self.assertGreater(row['avg_queries'], 0)
+
+    @override_settings(QUERY_PROFILER_ENABLED=True, QUERY_PROFILER_LOG_SAMPLE_RATE=0)
+    def test_unresolved_paths_share_one_entry(self):
+        for path in ('/no-such-page/1/', '/no-such-page/2/', '/another/missing/'):
+            self.client.get(path)
+        [row] = get_query_profile_store().report()
+        self.assertEqual((row['route'], row['requests']), ('', 3))
+        self.assertContains(self.client.get('/performance/queries/'), '（URL名なし）')
+
+
+# /metrics（Prometheus形式のメトリクス）のテスト
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        metrics.get_registry().clear()
+
+    def test_histogram_is_rendered_cumulatively(self):
+        for value in (0.003, 0.2, 120):
+            metrics.observe('bookiniad_chat_turn_duration_seconds', value, session_type='rule_bot', intent='greeting')
+        text = metrics.render()
+        labels = 'session_type="rule_bot",intent="greeting"'
+        self.assertIn(f'bookiniad_chat_turn_duration_seconds_bucket{{{labels},le="0.005"}} 1', text)
+        self.assertIn(f'bookiniad_chat_turn_duration_seconds_bucket{{{labels},le="0.25"}} 2', text)
+        self.assertIn(f'bookiniad_chat_turn_duration_seconds_bucket{{{labels},le="+Inf"}} 3', text)
+        self.assertIn(f'bookiniad_chat_turn_duration_seconds_count{{{labels}}} 3', text)
+
+    def test_worker_files_are_merged(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            metrics.inc('bookiniad_tool_calls_total', tool='search_air')
+            metrics.inc('bookiniad_agent_executor_active_workers', 1)
+            # 終了したワーカーの値：カウンタは合算し、ゲージは除外する
+            with open(os.path.join(directory, 'metrics_999999999.json'), 'w') as f:
+                json.dump({'pid': 999999999, 'values': {
+                    'bookiniad_tool_calls_total|search_air': 4,
+                    'bookiniad_agent_executor_active_workers': 3,
+                }}, f)
+            response = self.client.get('/metrics')
+        text = response.content.decode()
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('bookiniad_tool_calls_total{tool="search_air"} 5', text)
+        self.assertIn('bookiniad_agent_executor_active_workers 1', text)
+        self.assertIn('bookiniad_http_request_db_queries_total', text)
+
+
+# 負荷試験コマンドのテスト
+class BenchmarkEndpointsTests(TestCase):
+
+    def test_seed_replaces_previous_bench_data(self):
+        seed_dataset(hotels=3, flights=4, days=2)
+        dataset = seed_dataset(hotels=5, flights=2, days=3)
+        self.assertEqual(Accommodations.objects.filter(name__startswith='BENCH ').count(), 5)
+        self.assertEqual(AccommodationAvailability.objects.filter(accommodation_id__in=dataset['accommodation_ids']).count(), 15)
+        self.assertEqual(len(dataset['flight_ids']), 6)
+        self.assertEqual(FlightAvailability.objects.filter(flight_id__in=dataset['flight_ids']).count(), 6)
+        self.assertFalse(Air.objects.filter(id__in=dataset['flight_ids'], departure_time__lte=timezone.now()).exists())
+
+    def test_summary_and_comparison(self):
+        samples = [('flight_search', seconds / 1000, 200, 5) for seconds in range(1, 101)]
+        samples.append(('flight_search', 0.5, 500, None))
+        result = summarize_samples(samples, elapsed=2.0)['flight_search']
+        self.assertEqual(result['requests'], 101)
+        self.assertEqual(result['errors'], 1)
+        self.assertEqual(result['throughput'], 50.5)
+        self.assertEqual(result['p50_ms'], 51.0)
+        self.assertEqual(result['p99_ms'], 100.0)
+        self.assertEqual(result['avg_queries'], 5)
+
+        baseline = {'flight_search': dict(result, p50_ms=25.5, avg_queries=None)}
+        changes = compare_results({'flight_search': result}, baseline)['flight_search']
+        self.assertEqual(changes['p50_ms'], 100.0)
+        self.assertNotIn('avg_queries', changes)
+
+    def test_add_to_cart_returns_item_id(self):
+        dataset = seed_dataset(hotels=1, flights=1, days=1)
+        response = self.client.post('/api/cart/add-flight/', {'flight_id': dataset['flight_ids'][0]}, content_type='application/json')
+        item_id = response.json()['item_id']
+        response = self.client.post('/api/cart/remove/', {'item_id': item_id}, content_type='application/json')
+        self.assertEqual(response.json()['cart_count'], 0)
+
+
+# スタブLLMサーバーのテスト
+class StubLLMTests(SimpleTestCase):
+
+    tools = [{'type': 'function', 'function': {'name': name, 'parameters': {}}} for name in ('search_air', 'search_accommodations')]
+
+    def test_scripted_tool_call_then_final_reply(self):
+        stub = StubLLM(DEFAULT_SCRIPT, latency=0, jitter=0)
+        messages = [{'role': 'user', 'content': '東京から札幌への航空券を探して'}]
+        choice = stub.complete({'model': 'gpt-4o-mini', 'messages': messages, 'tools': self.tools})['choices'][0]
+        self.assertEqual(choice['finish_reason'], 'tool_calls')
+        tool_call = choice['message']['tool_calls'][0]
+        self.assertEqual(tool_call['function']['name'], 'search_air')
+        self.assertEqual(json.loads(tool_call['function']['arguments']), {'place_from': '東京', 'place_to': '札幌'})
+
+        # ツール結果を受け取った後は、同じツールを呼び直さずに応答する
+        messages += [choice['message'], {'role': 'tool', 'tool_call_id': tool_call['id'], 'content': 'BX00001 東京→札幌'}]
+        choice = stub.complete({'model': 'gpt-4o-mini', 'messages': messages, 'tools': self.tools})['choices'][0]
+        self.assertEqual(choice['finish_reason'], 'stop')
+        self.assertIn('BX00001', choice['message']['content'])
+
+    def test_tools_not_offered_are_not_called(self):
+        stub = StubLLM(DEFAULT_SCRIPT, latency=100, jitter=50)
+        choice = stub.complete({'messages': [{'role': 'user', 'content': '大阪のホテル'}]})['choices'][0]
+        self.assertEqual(choice['message']['content'], DEFAULT_SCRIPT['reply'])
+        self.assertTrue(0.1 <= stub.delay() <= 0.15)
+
+
+# URLごとのクエリ数の上限（件数が増えてもクエリ数が増えないこと）のテスト
+# チャットAPI（/api/chat/）は応答生成が別スレッド・別接続で動くため対象外
+class QueryBudgetTests(TestCase):
+
+    SIZES = (1, 5, 15)
+
+    def build_dataset(self, client, size):
+        """size件ずつの宿泊施設・航空券・パッケージ・カート・予約・チャット履歴を作成"""
+        today = timezone.localdate()
+        data = {'checkin': today + timedelta(days=1), 'checkout': today + timedelta(days=3), 'flights': []}
+        for index in range(size):
+            accommodation = Accommodations.objects.create(name=f'予算ホテル{index}', location='東京', amenities=['WiFi'])
+            AccommodationAvailability.objects.bulk_create([
+                AccommodationAvailability(accommodation=accommodation, date=today + timedelta(days=offset), available_rooms=3)
+                for offset in (1, 2)
+            ])
+            departure = timezone.now() + timedelta(days=1, minutes=index)
+            outbound = Air.objects.create(name='ANA', flight_number=f'QB{index}', place_from='東京', place_to='大阪',
+                                          departure_time=departure, arrival_time=departure + timedelta(hours=1), fee=10000)
+            inbound = Air.objects.create(name='JAL', flight_number=f'QR{index}', place_from='大阪', place_to='東京',
+                                         departure_time=departure + timedelta(days=2), arrival_time=departure + timedelta(days=2, hours=1), fee=10000)
+            FlightAvailability.objects.create(flight=outbound, date=timezone.localdate(departure), available_seats=5)
+            TravelPackage.objects.create(name=f'予算パッケージ{index}', description='東京→大阪', total_price=50000,
+                                         outbound_flight=outbound, return_flight=inbound, accommodation=accommodation, stay_duration=2)
+            data['flights'].append(outbound)
+        data['accommodation'] = accommodation
+        data['departure_date'] = timezone.localdate(data['flights'][0].departure_time)
+
+        # このクライアントのセッションのカート
+        client.get('/cart/')
+        cart = Cart.objects.get(session_id=client.session.session_key)
+        for flight in data['flights']:
+            CartItem.objects.create(cart=cart, item_type='flight', flight=flight, flight_direction='outbound', unit_price=flight.fee)
+        for accommodation in Accommodations.objects.all():
+            CartItem.objects.create(cart=cart, item_type='accommodation', accommodation=accommodation,
+                                    check_in_date=data['checkin'], check_out_date=data['checkout'], unit_price=10000)
+        data['cart_item'] = cart.items.first()
+
+        data['booking'] = Booking.objects.create(from_date=timezone.now(), to_date=timezone.now(), place='東京', accommodations=accommodation)
+        data['booking'].air.set(data['flights'])
+
+        data['chat_session'] = ChatSession.objects.create(session_id=str(uuid.uuid4()), session_type='rule_bot')
+        ChatMessage.objects.bulk_create([
+            ChatMessage(session=data['chat_session'], message_type='user', content=f'メッセージ{index}') for index in range(size)
+        ])
+        return data
+
+    def assertQueryBudget(self, budget, request):
+        """データ件数ごとにrequest(client, data)のクエリ数を数え、件数によらずbudget以下であることを確認"""
+        counts = {}
+        for size in self.SIZES:
+            with transaction.atomic():
+                client = Client()
+                data = self.build_dataset(client, size)
+                with CaptureQueriesContext(connection) as context:
+                    response = request(client, data)
+                self.assertLess(response.status_code, 400)
+                counts[size] = len(context)
+                transaction.set_rollback(True)
+        self.assertEqual(len(set(counts.values())), 1, f'件数に応じてクエリ数が増えています: {counts}')
+        self.assertLessEqual(counts[self.SIZES[0]], budget, f'クエリ数が上限を超えています: {counts}')
+
+    def post_json(self, client, path, payload):
+        return client.post(path, payload, content_type='application/json')
+
+    def test_index(self):
+        self.assertQueryBudget(1, lambda client, data: client.get('/'))
+
+    def test_search_results(self):
+        self.assertQueryBudget(2, lambda client, data: client.get('/search/', {'departure': '東京'}))
+
+    def test_search_results_are_paginated(self):
+        client = Client()
+        self.build_dataset(client, 15)
+        response = client.get('/search/', {'departure': '東京', 'page': 2})
+        self.assertEqual(response.context['total_results'], 15)
+        self.assertEqual(len(response.context['packages']), 5)
+        self.assertContains(response, 'departure=%E6%9D%B1%E4%BA%AC&page=1')
+
+    def test_accommodation_search(self):
+        self.assertQueryBudget(3, lambda client, data: client.get('/accommodations/', {
+            'location': '東京', 'checkin_date': data['checkin'].isoformat(), 'checkout_date': data['checkout'].isoformat(),
+        }))
+
+    def test_flight_search(self):
+        self.assertQueryBudget(8, lambda client, data: client.get('/flights/', {
+            'departure': '東京', 'destination': '大阪', 'departure_date': data['departure_date'].isoformat(),
+            'return_date': (data['departure_date'] + timedelta(days=2)).isoformat(),
+        }))
+
+    def test_booking_form(self):
+        self.assertQueryBudget(4, lambda client, data: client.get('/booking/from-cart/'))
+
+    def test_booking_from_cart(self):
+        self.assertQueryBudget(13, lambda client, data: client.post('/booking/from-cart/', {
+            'customer_name': '予算太郎', 'customer_email': 'budget@example.com', 'guests': 2,
+        }))
+
+    def test_booking_inquiry(self):
+        self.assertQueryBudget(3, lambda client, data: client.post('/booking/inquiry/', {
+            'reservation_number': str(data['booking'].reservation_number),
+        }))
+
+    def test_static_pages(self):
+        for path in ('/ai-comparison/', '/booking-complete/', '/booking/inquiry/'):
+            with self.subTest(path=path):
+                self.assertQueryBudget(0, lambda client, data: client.get(path))
+
+    def test_chat_interface(self):
+        self.assertQueryBudget(5, lambda client, data: client.get('/chat/rule_bot/'))
+
+    def test_conversation_history(self):
+        self.assertQueryBudget(3, lambda client, data: client.get('/api/conversation/history/', {
+            'session_id': data['chat_session'].session_id,
+        }))
+
+    def test_clear_conversation_history(self):
+        self.assertQueryBudget(2, lambda client, data: self.post_json(client, '/api/conversation/clear/', {
+            'session_id': data['chat_session'].session_id,
+        }))
+
+    def test_performance_pages(self):
+        for path, budget in (('/performance/', 4), ('/performance/queries/', 0), ('/metrics', 0)):
+            with self.subTest(path=path):
+                self.assertQueryBudget(budget, lambda client, data: client.get(path))
+
+    def test_cart(self):
+        self.assertQueryBudget(8, lambda client, data: client.get('/cart/'))
+
+    def test_cart_api(self):
+        requests = {
+            ('add-flight', 6): lambda client, data: self.post_json(client, '/api/cart/add-flight/', {
+                'flight_id': data['flights'][0].id, 'direction': 'return',
+            }),
+            ('add-accommodation', 6): lambda client, data: self.post_json(client, '/api/cart/add-accommodation/', {
+                'accommodation_id': data['accommodation'].id,
+                'checkin_date': data['checkout'].isoformat(),
+                'checkout_date': (data['checkout'] + timedelta(days=1)).isoformat(),
+            }),
+            ('remove', 6): lambda client, data: self.post_json(client, '/api/cart/remove/', {'item_id': data['cart_item'].id}),
+            ('clear', 2): lambda client, data: self.post_json(client, '/api/cart/clear/', {}),
+        }
+        for (name, budget), request in requests.items():
+            with self.subTest(name=name):
+                self.assertQueryBudget(budget, request)
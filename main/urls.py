@@ -14,6 +14,8 @@ urlpatterns = [
     path('api/conversation/history/', views.get_conversation_history, name="get_conversation_history"),
     path('api/conversation/clear/', views.clear_conversation_history, name="clear_conversation_history"),
     path('performance/', views.performance_analysis, name="performance_analysis"),
+    path('performance/queries/', views.query_profile_report, name="query_profile_report"),
+    path('metrics', views.metrics_endpoint, name="metrics"),
     
     # カート機能
     path('cart/', views.cart, name="cart"),
@@ -1,5 +1,8 @@
 from django.shortcuts import render, get_object_or_404
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, HttpResponseNotModified
+from django.conf import settings
+from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
 from django.views.decorators.csrf import csrf_exempt
 from django.db import models
 from django.core.paginator import Paginator
@@ -8,30 +11,43 @@ import json
 import uuid
 import time
 import os
+from datetime import datetime, timedelta, timezone as dt_timezone
 from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from main.ai_agents.agent import TravelAgentSystem
 from main.ai_agents.bot import handle_rule_bot
 from main.ai_agents.assistant import TravelChatAssistant
+from main.ai_agents.conversation_store import get_conversation_store
+from main.ai_agents import tool_cache, spans
+from main.ai_agents.response_cache import get_response_cache, is_cacheable, is_storable_answer
+from main.ai_agents.intents import chat_classifier, advanced_classifier
+from main.ai_agents import fast_path
+from main.write_behind import get_write_queue
+from main.middleware import get_query_profile_store
+from main import analytics, metrics, session_metrics
 
 from .models import (
-    Accommodations, Air, Booking, TravelPackage,
+    Accommodations, AccommodationAvailability, Air, FlightAvailability, Booking, TravelPackage,
     ChatSession, ChatMessage,
     SystemResponse, Cart, CartItem
 )
 
-# セッションごとのTravelChatAssistantインスタンスを管理
-session_assistants = {}
-
 # AI処理用のスレッドプール（長時間処理のバックグラウンド実行に使用）
 AGENT_WORKERS = int(os.environ.get('AGENT_WORKERS', '4'))
 _agent_executor = ThreadPoolExecutor(max_workers=AGENT_WORKERS)
 AGENT_SYNC_TIMEOUT = float(os.environ.get('AGENT_SYNC_TIMEOUT', '20'))
 
+# 会話履歴APIの1ページあたりの件数（デフォルト・上限）
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+HISTORY_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
 
 # トップページ
 def index(request):
-    # 人気の旅行パッケージを表示（完売も含めて表示）
-    popular_packages = TravelPackage.objects.all()[:6]
+    # 人気の旅行パッケージを表示（完売も含めて表示、カードに出す列のみ取得）
+    popular_packages = TravelPackage.objects.only(
+        'name', 'description', 'total_price', 'stay_duration', 'is_available'
+    ).order_by('id')[:6]
     
     contexts = {
         'popular_packages': popular_packages,
@@ -49,15 +65,30 @@ def search_results(request):
     people = request.GET.get('people', 1)
     
     # 検索条件に基づいてパッケージを絞り込み（完売も含めて表示）
-    packages = TravelPackage.objects.all()
+    # 往路・復路の航空券と宿泊施設はJOINで同時に取得し、カードに出す列のみ読み込む
+    packages = TravelPackage.objects.select_related(
+        'outbound_flight', 'return_flight', 'accommodation'
+    ).only(
+        'name', 'description', 'total_price', 'stay_duration', 'is_available',
+        'outbound_flight__place_from', 'outbound_flight__place_to',
+        'return_flight__place_from', 'return_flight__place_to',
+        'accommodation__name',
+    ).order_by('id')
     
     if departure:
         packages = packages.filter(outbound_flight__place_from__icontains=departure)
     if destination:
         packages = packages.filter(outbound_flight__place_to__icontains=destination)
     
+    # ページネーション
+    paginator = Paginator(packages, 10)  # 1ページあたり10件表示
+    page_packages = paginator.get_page(request.GET.get('page'))
+    
     contexts = {
-        'packages': packages,
+        'packages': page_packages,
+        'is_paginated': page_packages.has_other_pages(),
+        'page_obj': page_packages,
+        'total_results': paginator.count,
         'search_params': {
             'departure': departure,
             'destination': destination,
@@ -152,10 +183,17 @@ def accommodation_search(request):
             }
             return render(request, "main/accommodation_search.html", contexts)
         
-        # 各宿泊施設の空き状況をチェック
+        # 各宿泊施設の空き状況をチェック（期間中の空き状況は1回のクエリでまとめて取得）
+        availabilities = {}
+        for accommodation_id, date, rooms in AccommodationAvailability.objects.filter(
+            accommodation__in=accommodations, date__gte=checkin, date__lt=checkout
+        ).values_list('accommodation_id', 'date', 'available_rooms'):
+            availabilities.setdefault(accommodation_id, {})[date] = rooms
         available_accommodations = []
         for accommodation in accommodations:
-            is_available = check_accommodation_availability(accommodation, checkin, checkout, int(guests))
+            is_available = check_accommodation_availability(
+                accommodation, checkin, checkout, int(guests), availabilities.get(accommodation.id, {})
+            )
             accommodation.available_for_dates = is_available
             available_accommodations.append(accommodation)
         
@@ -190,9 +228,9 @@ def accommodation_search(request):
     
     # 利用可能なアメニティリストを取得
     all_amenities = set()
-    for acc in Accommodations.objects.all():
-        if acc.amenities and isinstance(acc.amenities, list):
-            all_amenities.update(acc.amenities)
+    for acc_amenities in Accommodations.objects.values_list('amenities', flat=True):
+        if acc_amenities and isinstance(acc_amenities, list):
+            all_amenities.update(acc_amenities)
     
     contexts = {
         'accommodations': page_accommodations,
@@ -216,24 +254,26 @@ def accommodation_search(request):
     return render(request, "main/accommodation_search.html", contexts)
 
 
-def check_accommodation_availability(accommodation, checkin_date, checkout_date, guests):
-    """宿泊施設の指定期間の空き状況をチェック"""
+def check_accommodation_availability(accommodation, checkin_date, checkout_date, guests, availabilities=None):
+    """宿泊施設の指定期間の空き状況をチェック（availabilitiesは取得済みの{日付: 空室数}）"""
     from datetime import timedelta
-    from .models import AccommodationAvailability
+    
+    if availabilities is None:
+        availabilities = dict(AccommodationAvailability.objects.filter(
+            accommodation=accommodation,
+            date__gte=checkin_date,
+            date__lt=checkout_date
+        ).values_list('date', 'available_rooms'))
     
     current_date = checkin_date
     while current_date < checkout_date:
-        try:
-            availability = AccommodationAvailability.objects.get(
-                accommodation=accommodation,
-                date=current_date
-            )
-            if availability.available_rooms < 1:
-                return False
-        except AccommodationAvailability.DoesNotExist:
+        available_rooms = availabilities.get(current_date)
+        if available_rooms is None:
             # 空き状況データがない場合は、デフォルトの総部屋数を使用
             if accommodation.total_rooms < 1:
                 return False
+        elif available_rooms < 1:
+            return False
         
         current_date += timedelta(days=1)
     
@@ -297,10 +337,11 @@ def flight_search(request):
             outbound_search_date = datetime.strptime(departure_date, '%Y-%m-%d').date()
             outbound_flights = outbound_flights.filter(departure_time__date=outbound_search_date)
             
-            # 空き状況をチェック
+            # 空き状況をチェック（当日の空き状況は1回のクエリでまとめて取得）
+            availabilities = flight_availabilities(outbound_flights, outbound_search_date)
             available_outbound_flights = []
             for flight in outbound_flights:
-                is_available = check_flight_availability(flight, outbound_search_date, int(passengers))
+                is_available = check_flight_availability(flight, outbound_search_date, int(passengers), availabilities)
                 flight.available_for_date = is_available
                 flight.flight_direction = 'outbound'
                 available_outbound_flights.append(flight)
@@ -354,9 +395,10 @@ def flight_search(request):
             return_flights = return_flights.filter(departure_time__date=return_search_date)
             
             # 復路の空き状況をチェック
+            availabilities = flight_availabilities(return_flights, return_search_date)
             available_return_flights = []
             for flight in return_flights:
-                is_available = check_flight_availability(flight, return_search_date, int(passengers))
+                is_available = check_flight_availability(flight, return_search_date, int(passengers), availabilities)
                 flight.available_for_date = is_available
                 flight.flight_direction = 'return'
                 available_return_flights.append(flight)
@@ -452,19 +494,24 @@ def flight_search(request):
     return render(request, "main/flight_search.html", contexts)
 
 
-def check_flight_availability(flight, departure_date, passengers):
-    """航空券の指定日時の空き状況をチェック"""
-    from .models import FlightAvailability
+def flight_availabilities(flights, date):
+    """指定日の航空券の空席数（{便ID: 空席数}）を1回のクエリで取得"""
+    return dict(FlightAvailability.objects.filter(
+        flight__in=flights,
+        date=date
+    ).values_list('flight_id', 'available_seats'))
+
+
+def check_flight_availability(flight, departure_date, passengers, availabilities=None):
+    """航空券の指定日時の空き状況をチェック（availabilitiesは取得済みの{便ID: 空席数}）"""
+    if availabilities is None:
+        availabilities = flight_availabilities([flight], departure_date)
     
-    try:
-        availability = FlightAvailability.objects.get(
-            flight=flight,
-            date=departure_date
-        )
-        return availability.available_seats >= passengers
-    except FlightAvailability.DoesNotExist:
+    available_seats = availabilities.get(flight.id)
+    if available_seats is None:
         # 空き状況データがない場合は、デフォルトの空席数を使用
         return flight.available_seats >= passengers
+    return available_seats >= passengers
 
 
 # 予約作成ページ
@@ -506,6 +553,8 @@ def chat_interface(request, system_type):
         session_id=session_id,
         session_type=system_type
     )
+    # カートからの予約をこのチャットの成果として記録するため、ブラウザのセッションに保持
+    request.session['chat_session_id'] = session_id
     
     contexts = {
         'session_id': session_id,
@@ -532,46 +581,85 @@ def chat_message(request):
         
         session = get_object_or_404(ChatSession, session_id=session_id)
         
-        # ユーザーメッセージを記録
-        ChatMessage.objects.create(
+        # ユーザーメッセージを記録（遅延書き込みキュー経由でまとめて保存）
+        write_queue = get_write_queue()
+        write_queue.enqueue(ChatMessage(
             session=session,
             message_type='user',
             content=message
-        )
+        ))
         
         def _generate_and_persist():
-            start_time = time.time()
+            metrics.inc('bookiniad_agent_executor_queue_depth', -1)
+            metrics.inc('bookiniad_agent_executor_active_workers', 1)
             try:
-                if session.session_type == 'ai_agent':
-                    response = handle_ai_agent(message, session)
-                elif session.session_type == 'ai_assistant':
-                    response = handle_ai_assistant(message, session)
-                elif session.session_type == 'rule_bot':
-                    response = handle_rule_bot(message, session)
-                else:
-                    response = {'content': 'システムエラーが発生しました。', 'intent': 'error', 'confidence': 0.0}
-            except Exception as e:
-                response = {
-                    'content': f'内部エラーが発生しました: {str(e)}',
-                    'intent': 'error',
-                    'confidence': 0.0,
-                    'reasoning': {'error': str(e)}
-                }
+                with spans.track_turn(started=submitted_at) as trace:
+                    # スレッドプールの空き待ちの時間
+                    spans.add_span('queue', 'agent_executor', submitted_at, time.perf_counter())
+                    return _generate_and_persist_traced(trace)
+            finally:
+                metrics.inc('bookiniad_agent_executor_active_workers', -1)
+
+        def _generate_and_persist_traced(trace):
+            start_time = time.time()
+            route = session.session_type
+            # このターンのツール結果キャッシュの命中数を集計し、予約ツールに処理中のセッションを渡す
+            with tool_cache.track_turn() as cache_stats, session_metrics.track_session(session):
+                try:
+                    # 挨拶・お礼・よくある質問はLLMを呼ばずに定型文で応答
+                    fast = fast_path.route(message) if session.session_type in ('ai_agent', 'ai_assistant') else None
+                    if fast:
+                        route = fast['route']
+                        response = handle_fast_path(message, session, fast)
+                    elif session.session_type == 'ai_agent':
+                        response = handle_ai_agent(message, session)
+                        route = _llm_route(response)
+                    elif session.session_type == 'ai_assistant':
+                        response = handle_ai_assistant(message, session)
+                        route = _llm_route(response)
+                    elif session.session_type == 'rule_bot':
+                        response = handle_rule_bot(message, session)
+                    else:
+                        response = {'content': 'システムエラーが発生しました。', 'intent': 'error', 'confidence': 0.0}
+                except Exception as e:
+                    response = {
+                        'content': f'内部エラーが発生しました: {str(e)}',
+                        'intent': 'error',
+                        'confidence': 0.0,
+                        'reasoning': {'error': str(e)}
+                    }
             processing_time = time.time() - start_time
+            processed_at = time.perf_counter()
+            metrics.observe('bookiniad_chat_turn_duration_seconds', processing_time,
+                            session_type=session.session_type, intent=response.get('intent', ''))
             try:
-                ChatMessage.objects.create(
-                    session=session,
-                    message_type=session.session_type,
-                    content=response['content'],
-                    reasoning_process=response.get('reasoning', {})
-                )
-                SystemResponse.objects.create(
+                # 応答の保存（キューに積むだけ。セッション単位の指標はSystemResponseの書き込み時に加算する）
+                with spans.span('persist', 'chat_message'):
+                    write_queue.enqueue(ChatMessage(
+                        session=session,
+                        message_type=session.session_type,
+                        content=response['content'],
+                        reasoning_process=response.get('reasoning', {})
+                    ))
+                # 応答経路（fast_path_* / response_cache / llm / rule_bot）ごとのバイパス率・レイテンシ集計用
+                # spans/stagesは処理区間の一覧と区間種別ごとの合計（ミリ秒）
+                api_call_info = {
+                    'route': route,
+                    'bypassed_llm': _bypassed_llm(route),
+                    'tool_cache': cache_stats,
+                    'spans': trace['spans'],
+                    'stages': spans.stage_totals(trace, processing_time, processed_at),
+                }
+                if trace['dropped']:
+                    api_call_info['dropped_spans'] = trace['dropped']
+                write_queue.enqueue(SystemResponse(
                     session=session,
                     intent_detected=response.get('intent', ''),
                     confidence_score=response.get('confidence', None),
+                    api_call_info=api_call_info,
                     processing_time=processing_time,
                     response_generated=response['content']
-                )
+                ))
             except Exception:
                 # 永続化の失敗はレスポンス生成を妨げない
                 pass
@@ -584,6 +672,8 @@ def chat_message(request):
             }
 
         # バックグラウンドで実行しつつ、一定時間でタイムアウトしたら即時応答
+        submitted_at = time.perf_counter()
+        metrics.inc('bookiniad_agent_executor_queue_depth', 1)
         future = _agent_executor.submit(_generate_and_persist)
         try:
             result = future.result(timeout=AGENT_SYNC_TIMEOUT)
@@ -602,9 +692,24 @@ def chat_message(request):
 
 
 # 会話履歴管理API
+def _history_cursor(message):
+    """会話履歴のページ位置（送信日時のマイクロ秒とIDの組、URLにそのまま使える形式）"""
+    return f"{(message['timestamp'] - HISTORY_EPOCH) // timedelta(microseconds=1)}_{message['id']}"
+
+
+def _parse_history_cursor(value):
+    """ページ位置の文字列を (送信日時, ID) に戻す（不正な形式はValueError）"""
+    microseconds, _, message_id = value.partition('_')
+    return HISTORY_EPOCH + timedelta(microseconds=int(microseconds)), int(message_id)
+
+
 @csrf_exempt
 def get_conversation_history(request):
-    """会話履歴を取得するAPI"""
+    """会話履歴を取得するAPI（ChatMessageをキーセットページングで返す）
+
+    before: このページ位置より古いメッセージ / after: このページ位置より新しいメッセージ
+    （どちらもなければ最新のメッセージ）。結果は常に古い順。
+    """
     if request.method != 'GET':
         return JsonResponse({'error': 'GET method required'}, status=405)
     
@@ -616,24 +721,63 @@ def get_conversation_history(request):
         # セッションが存在するかチェック
         session = get_object_or_404(ChatSession, session_id=session_id)
         
-        # TravelChatAssistantのインスタンスから履歴を取得
-        session_id_str = str(session_id)
-        if session_id_str in session_assistants:
-            assistant = session_assistants[session_id_str]
-            history = assistant.get_conversation_history()
-            
-            return JsonResponse({
-                'conversation_history': history,
-                'total_messages': len(history),
-                'session_id': session_id
-            })
-        else:
-            return JsonResponse({
-                'conversation_history': [],
-                'total_messages': 0,
-                'session_id': session_id,
-                'message': 'No conversation history found for this session'
-            })
+        # このセッションの書き込み待ちの行があれば先に保存（read-your-writes）
+        get_write_queue().ensure_written(session.pk)
+        
+        # ユーザーとシステムのメッセージ（既定のマネージャーはLLM用のコンテキスト行を含まない）
+        messages = ChatMessage.objects.filter(session=session)
+        
+        # 最新メッセージのIDと条件からETagを作り、変化がなければ本文を返さない（ポーリング用）
+        latest_id = messages.order_by('-timestamp', '-id').values_list('id', flat=True).first()
+        etag = quote_etag(f"{session.pk}-{latest_id or 0}-{request.GET.urlencode()}")
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+        
+        try:
+            limit = min(max(int(request.GET.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+            before = request.GET.get('before')
+            after = request.GET.get('after')
+            if after:
+                timestamp, message_id = _parse_history_cursor(after)
+                messages = messages.filter(
+                    Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=message_id)
+                ).order_by('timestamp', 'id')
+            else:
+                if before:
+                    timestamp, message_id = _parse_history_cursor(before)
+                    messages = messages.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id))
+                messages = messages.order_by('-timestamp', '-id')
+        except ValueError:
+            return JsonResponse({'error': 'invalid limit or cursor'}, status=400)
+        
+        # 1件多く取得して続きがあるかを判定（COUNTは使わない）
+        page = list(messages.values('id', 'message_type', 'content', 'timestamp')[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+        if not after:
+            page.reverse()
+        
+        response = JsonResponse({
+            'session_id': session_id,
+            'conversation_history': [
+                {
+                    'id': message['id'],
+                    'message_type': message['message_type'],
+                    'content': message['content'],
+                    'timestamp': message['timestamp'].isoformat(),
+                    'cursor': _history_cursor(message),
+                }
+                for message in page
+            ],
+            'has_more': has_more,
+            # afterでは続きの新しいページ、それ以外はさらに古いページの位置
+            'next_cursor': _history_cursor(page[-1 if after else 0]) if has_more else None,
+        })
+        response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'
+        return response
     
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
@@ -655,11 +799,10 @@ def clear_conversation_history(request):
         # セッションが存在するかチェック
         session = get_object_or_404(ChatSession, session_id=session_id)
         
-        # TravelChatAssistantのインスタンスの履歴をクリア
-        session_id_str = str(session_id)
-        if session_id_str in session_assistants:
-            assistant = session_assistants[session_id_str]
-            assistant.clear_history()
+        # 共有の会話履歴ストアから履歴をクリア
+        store = get_conversation_store()
+        if store.load(str(session.session_id), limit=1):
+            store.clear(str(session.session_id))
             
             return JsonResponse({
                 'message': 'Conversation history cleared successfully',
@@ -676,64 +819,71 @@ def clear_conversation_history(request):
 
 
 # AI応答処理関数群
+def handle_fast_path(message, session, fast):
+    """定型文での応答（会話履歴にも追加し、次のターンでLLMが文脈を参照できるようにする）"""
+    get_conversation_store().append(str(session.session_id), [
+        {"role": "user", "content": message},
+        {"role": "assistant", "content": fast['content']},
+    ])
+    reasoning = {'route': fast['route'], 'session_id': str(session.session_id)}
+    if fast.get('faq_topic'):
+        reasoning['faq_topic'] = fast['faq_topic']
+    return {
+        'content': fast['content'],
+        'intent': fast['intent'],
+        'confidence': fast['confidence'],
+        'reasoning': reasoning
+    }
+
+
+def _llm_route(response):
+    """AIエージェント/アシスタントの応答経路（応答キャッシュから返した場合はLLMを呼んでいない）"""
+    if (response.get('reasoning') or {}).get('response_cache', {}).get('hit'):
+        return 'response_cache'
+    return 'llm'
+
+
+def _bypassed_llm(route):
+    """LLMを呼ばずに応答した経路か"""
+    return route.startswith('fast_path') or route == 'response_cache'
+
+
 def handle_ai_agent(message, session):
     """AIエージェント（TravelAgentSystem使用）の応答処理"""
-    import asyncio
     session_id = str(session.session_id)
     
+    # 意図検出（メッセージ内容に基づく分類）
+    intent, confidence = detect_message_intent(message)
+    
+    # 状態に依存しない質問は応答キャッシュから返す（LLM呼び出しを省略）
+    cached = _cached_response(message, session, intent, confidence)
+    if cached:
+        return cached
+    cacheable = _is_cacheable_turn(message, session, intent)
+    
     try:
-        # 非同期処理を同期環境で実行するためのヘルパー関数
+        # エージェントは共有の常駐イベントループ上で実行される（TravelAgentSystem.chat内）
         def run_agent_sync():
             try:
-                # 新しいイベントループを作成して実行
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
+                # TravelAgentSystemのインスタンスを作成（履歴は共有ストアでセッションIDごとに管理）
+                agent_system = TravelAgentSystem(
+                    session_id=session_id,
+                    store=get_conversation_store()
+                )
                 
-                try:
-                    # TravelAgentSystemのインスタンスを作成（セッションIDで管理）
-                    agent_system = TravelAgentSystem(
-                        session_id=f"bookiniad_chat_{session_id}",
-                        db_path="./agents_conversation.db"
-                    )
-                    
-                    # ベースエージェントで応答を生成
-                    response_content = agent_system.chat(message, "base_agent")
-                    return response_content
-                    
-                finally:
-                    loop.close()
+                # ベースエージェントで応答を生成
+                return agent_system.chat(message, "base_agent")
                     
             except Exception:
                 # TravelAgentSystemでエラーが発生した場合、フォールバックとしてTravelChatAssistantを使用
-                from main.agents.assistant import TravelChatAssistant
+                # （共有クライアントを使うため新規接続は発生しない）
                 fallback_assistant = TravelChatAssistant()
                 return fallback_assistant.chat(message)
         
         # 同期的に非同期処理を実行
         response_content = run_agent_sync()
-        
-        # 意図検出（メッセージ内容に基づく分類）
-        intent = 'general'
-        confidence = 0.8
-        
-        if any(word in message.lower() for word in ['航空券', 'フライト', '飛行機', 'air', '便']):
-            intent = 'flight_search'
-            confidence = 0.9
-        elif any(word in message.lower() for word in ['ホテル', '宿泊', '泊まり', 'hotel', 'accommodation', '宿']):
-            intent = 'accommodation_search'
-            confidence = 0.9
-        elif any(word in message.lower() for word in ['予約', 'booking', '予約番号', '照会']):
-            intent = 'booking_inquiry'
-            confidence = 0.9
-        elif any(word in message.lower() for word in ['推奨', 'おすすめ', 'recommend', '旅行', 'travel']):
-            intent = 'travel_recommendation'
-            confidence = 0.8
-        elif any(word in message.lower() for word in ['こんにちは', 'hello', 'はじめまして', 'こんばんは']):
-            intent = 'greeting'
-            confidence = 0.95
-        elif any(word in message.lower() for word in ['ありがとう', 'thank', 'thanks', 'すみません']):
-            intent = 'courtesy'
-            confidence = 0.9
+        if cacheable:
+            _store_cached_response(message, session, intent, response_content)
         
         return {
             'content': response_content,
@@ -743,15 +893,14 @@ def handle_ai_agent(message, session):
                 'model': 'TravelAgentSystem (Multi-Agent)',
                 'session_id': session_id,
                 'agent_system': 'base_agent',
-                'db_path': './agents_conversation.db',
-                'execution_mode': 'sync_wrapper'
+                'conversation_store': get_conversation_store().name,
+                'execution_mode': 'shared_event_loop'
             }
         }
         
     except Exception as e:
         # エラーが発生した場合のフォールバック（TravelChatAssistantを使用）
         try:
-            from main.agents.assistant import TravelChatAssistant
             fallback_assistant = TravelChatAssistant()
             fallback_response = fallback_assistant.chat(message)
             
@@ -784,29 +933,23 @@ def handle_ai_assistant(message, session):
     """AIアシスタント（OpenAI Chat Completions API使用）の応答処理"""
     session_id = str(session.session_id)
     
-    # セッションごとのTravelChatAssistantインスタンスを取得または作成
-    if session_id not in session_assistants:
-        session_assistants[session_id] = TravelChatAssistant()
+    # 意図検出（メッセージ内容に基づく分類）
+    intent, confidence = detect_message_intent(message)
     
-    assistant = session_assistants[session_id]
+    # 状態に依存しない質問は応答キャッシュから返す（LLM呼び出しを省略）
+    cached = _cached_response(message, session, intent, confidence)
+    if cached:
+        return cached
+    cacheable = _is_cacheable_turn(message, session, intent)
+    
+    # 会話履歴は共有ストアにあるため、どのワーカーでもインスタンスを作成して継続できる
+    assistant = TravelChatAssistant(session_id=session_id, store=get_conversation_store())
     
     try:
         # TravelChatAssistantで応答を生成
         response_content = assistant.chat(message)
-        
-        # 意図検出（簡単な分類）
-        intent = 'general'
-        confidence = 0.8
-        
-        if any(word in message.lower() for word in ['航空券', 'フライト', '飛行機', 'air']):
-            intent = 'flight_search'
-        elif any(word in message.lower() for word in ['ホテル', '宿泊', '泊まり', 'hotel', 'accommodation']):
-            intent = 'accommodation_search'
-        elif any(word in message.lower() for word in ['推奨', 'おすすめ', 'recommend']):
-            intent = 'travel_recommendation'
-        elif any(word in message.lower() for word in ['こんにちは', 'hello', 'はじめまして']):
-            intent = 'greeting'
-            confidence = 0.9
+        if cacheable:
+            _store_cached_response(message, session, intent, response_content)
         
         return {
             'content': response_content,
@@ -815,7 +958,8 @@ def handle_ai_assistant(message, session):
             'reasoning': {
                 'model': 'OpenAI GPT-4o-mini',
                 'session_id': session_id,
-                'conversation_length': len(assistant.get_conversation_history())
+                'conversation_length': len(assistant.get_conversation_history()),
+                'context_window': assistant.last_context_stats
             }
         }
         
@@ -832,17 +976,60 @@ def handle_ai_assistant(message, session):
         }
 
 
+def detect_message_intent(message):
+    """AIエージェント/アシスタント共通の意図検出（インテント, 信頼度）"""
+    return chat_classifier.classify(message)
+
+
+def _cached_response(message, session, intent, confidence):
+    """応答キャッシュに類似の質問があれば、その応答を返す（会話履歴にも追加）"""
+    if not is_cacheable(intent, message):
+        return None
+    start = time.perf_counter()
+    cached = get_response_cache().lookup(session.session_type, message, intent)
+    lookup_ms = round((time.perf_counter() - start) * 1000, 3)
+    metrics.inc('bookiniad_cache_requests_total', cache='response', result='miss' if cached is None else 'hit')
+    if cached is None:
+        return None
+    # 次のターンでLLMが文脈を参照できるよう、キャッシュ応答も履歴に残す
+    get_conversation_store().append(str(session.session_id), [
+        {"role": "user", "content": message},
+        {"role": "assistant", "content": cached['content']},
+    ])
+    return {
+        'content': cached['content'],
+        'intent': intent,
+        'confidence': confidence,
+        'reasoning': {
+            'response_cache': {
+                'hit': True,
+                'similarity': cached['similarity'],
+                'matched_message': cached['matched_message'],
+                'lookup_ms': lookup_ms
+            },
+            'session_id': str(session.session_id)
+        }
+    }
+
+
+def _is_cacheable_turn(message, session, intent):
+    """このターンの応答をキャッシュに保存してよいか（LLMの呼び出し前に判定する）
+
+    キャッシュはセッションタイプ全体で共有するため、会話履歴のない最初のターン
+    （応答が他の会話に依存しない場合）だけを対象にする。
+    """
+    return is_cacheable(intent, message) and not get_conversation_store().load(str(session.session_id), limit=1)
+
+
+def _store_cached_response(message, session, intent, content):
+    """LLMの応答を保存（数字・予約番号を含む応答やエラー応答は保存しない）"""
+    if is_storable_answer(content):
+        get_response_cache().store(session.session_type, message, intent, content)
+
+
 def detect_intent_advanced(message):
-    """高度な意図検出（実際の実装ではNLPライブラリやAPIを使用）"""
-    # シンプルな実装例
-    intents = []
-    if any(word in message for word in ['検索', '探す', 'search', '探して']):
-        intents.append('search')
-    if any(word in message for word in ['予約', 'booking', '申し込み']):
-        intents.append('booking')
-    if any(word in message for word in ['こんにちは', 'hello', 'はじめまして']):
-        intents.append('greeting')
-    return intents
+    """高度な意図検出（一致したインテントをすべて返す）"""
+    return advanced_classifier.match_all(message)
 
 
 # 予約照会ページ
@@ -952,33 +1139,30 @@ def booking_inquiry(request):
 
 # パフォーマンス分析ページ
 def performance_analysis(request):
-    # 各システムのパフォーマンスデータを集計
-    performance_data = {}
-    
-    for system_type in ['ai_agent', 'ai_assistant', 'rule_bot']:
-        sessions = ChatSession.objects.filter(session_type=system_type)
-        responses = SystemResponse.objects.filter(session__session_type=system_type)
-        
-        if responses.exists():
-            avg_response_time = responses.aggregate(avg_time=models.Avg('processing_time'))['avg_time']
-            total_sessions = sessions.count()
-            
-            performance_data[system_type] = {
-                'avg_response_time': round(avg_response_time or 0, 3),
-                'total_sessions': total_sessions,
-                'system_name': {
-                    'ai_agent': 'AIエージェント',
-                    'ai_assistant': 'AIアシスタント',
-                    'rule_bot': 'ルールベースBot'
-                }.get(system_type)
-            }
-    
+    # 集計テーブルだけを読む（畳み込みはrollup_responsesコマンドの定期実行で行い、GETでは書き込まない）
     contexts = {
-        'performance_data': performance_data
+        'rolled_up_at': analytics.last_rollup_time(),
+        'performance_data': analytics.summarize(),
+        'recent_data': analytics.summarize(since=timezone.now() - timedelta(hours=24), granularity='hour'),
+        'outcome_data': analytics.session_outcomes(),
     }
     return render(request, "main/performance_analysis.html", contexts)
 
 
+# Prometheus形式のメトリクス（METRICS_DIR指定時は全ワーカーの合計）
+def metrics_endpoint(request):
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# URL名ごとのDBクエリ計測結果（QueryProfilerMiddlewareの集計、このプロセス分）
+def query_profile_report(request):
+    contexts = {
+        'enabled': settings.QUERY_PROFILER_ENABLED,
+        'routes': get_query_profile_store().report(),
+    }
+    return render(request, "main/query_profile.html", contexts)
+
+
 # カート機能のヘルパー関数
 def get_or_create_cart(request):
     """セッションのカートを取得または作成"""
@@ -995,7 +1179,8 @@ def get_or_create_cart(request):
 def cart(request):
     """カート内容を表示"""
     cart_obj = get_or_create_cart(request)
-    cart_items = cart_obj.items.all().order_by('-added_at')
+    # テンプレートで参照する航空券・宿泊施設・パッケージはJOINでまとめて取得
+    cart_items = cart_obj.items.select_related('flight', 'accommodation', 'package').order_by('-added_at')
     
     # 航空券と宿泊施設の料金を分けて計算
     flight_total = 0
@@ -1048,7 +1233,7 @@ def add_flight_to_cart(request):
             }, status=400)
         
         # カートに追加
-        CartItem.objects.create(
+        item = CartItem.objects.create(
             cart=cart_obj,
             item_type='flight',
             flight=flight,
@@ -1060,6 +1245,7 @@ def add_flight_to_cart(request):
         return JsonResponse({
             'success': True,
             'message': f'{flight.name} ({direction}) をカートに追加しました',
+            'item_id': item.id,
             'cart_count': cart_obj.items.count(),
             'total_price': cart_obj.get_total_price()
         })
@@ -1109,7 +1295,7 @@ def add_accommodation_to_cart(request):
             }, status=400)
         
         # カートに追加
-        CartItem.objects.create(
+        item = CartItem.objects.create(
             cart=cart_obj,
             item_type='accommodation',
             accommodation=accommodation,
@@ -1123,6 +1309,7 @@ def add_accommodation_to_cart(request):
         return JsonResponse({
             'success': True,
             'message': f'{accommodation.name} ({nights}泊) をカートに追加しました',
+            'item_id': item.id,
             'cart_count': cart_obj.items.count(),
             'total_price': cart_obj.get_total_price(),
             'accommodation': {
@@ -1192,7 +1379,7 @@ def create_booking_from_cart(request):
     """カートの内容から予約を作成"""
     if request.method == 'POST':
         cart_obj = get_or_create_cart(request)
-        cart_items = cart_obj.items.all()
+        cart_items = cart_obj.items.select_related('flight', 'accommodation', 'package')
         
         if not cart_items.exists():
             return JsonResponse({
@@ -1303,11 +1490,17 @@ def create_booking_from_cart(request):
                 accommodations=accommodation
             )
             
-            # 航空券を追加
+            # 直前に利用したチャットがあれば、そのセッションの予約成功として記録
+            chat_session = ChatSession.objects.filter(session_id=request.session.get('chat_session_id')).first()
+            if chat_session:
+                session_metrics.record_booking(chat_session)
+            
+            # 航空券を追加（まとめて1回で関連付け）
             flights_list = []
+            booking_flights = []
             for item in cart_items:
                 if item.item_type == 'flight' and item.flight:
-                    booking.air.add(item.flight)
+                    booking_flights.append(item.flight)
                     flights_list.append({
                         'id': item.flight.pk,
                         'airline': item.flight.name,
@@ -1316,6 +1509,7 @@ def create_booking_from_cart(request):
                         'departure_time': item.flight.departure_time.strftime('%H:%M') if item.flight.departure_time else '',
                         'price': item.flight.fee
                     })
+            booking.air.add(*booking_flights)
             
             # 宿泊施設情報
             accommodations_list = []
@@ -1358,7 +1552,7 @@ def create_booking_from_cart(request):
     
     # GET リクエストの場合は予約フォームを表示
     cart_obj = get_or_create_cart(request)
-    cart_items = cart_obj.items.all()
+    cart_items = cart_obj.items.select_related('flight', 'accommodation', 'package')
     
     if not cart_items.exists():
         from django.contrib import messages
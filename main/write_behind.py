@@ -0,0 +1,154 @@
+import atexit
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+# チャット・テレメトリ行（ChatMessage / SystemResponse）の遅延書き込みキュー
+# リクエスト処理中はバッファに積むだけにし、バックグラウンドのワーカーが
+# 一定時間ごと・一定件数ごとにモデル単位のbulk_createでまとめて書き込む
+# （SQLiteの書き込みロックを1ターン3回から、数ターンに1回に減らす）
+
+# モデルごとの書き込み後の処理（書き込んだインスタンスのリストを渡す）
+_written_hooks = {}
+
+
+def on_written(model):
+    """指定モデルの行を書き込んだ後に呼ぶ関数を登録するデコレータ（無効時の即時保存でも呼ぶ）"""
+
+    def decorator(func):
+        _written_hooks.setdefault(model, []).append(func)
+        return func
+
+    return decorator
+
+
+def _run_written_hooks(model, instances):
+    for hook in _written_hooks.get(model, []):
+        try:
+            hook(instances)
+        except Exception as e:
+            # 書き込み後の処理の失敗は書き込み自体には影響させない
+            print(f"Write-behind hook error ({model.__name__}, {hook.__name__}): {e}")
+
+
+class WriteBehindQueue:
+    """未保存のモデルインスタンスをまとめてbulk_createするキュー（スレッドセーフ）"""
+
+    def __init__(self, flush_interval: float = 0.2, batch_size: int = 50, max_buffer: int = 1000):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        # 書き込みは1スレッドずつ（バッファから取り出した順に書き込む）
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker = None
+        self.flushed = 0
+        self.batches = 0
+        self.failed = 0
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            with self._lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                    self._worker.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+    def enqueue(self, instance):
+        """書き込み待ちに追加（無効時・バッファ満杯時は呼び出し元で書き込む）"""
+        if not settings.CHAT_WRITE_BEHIND_ENABLED:
+            instance.save()
+            _run_written_hooks(type(instance), [instance])
+            return
+        with self._lock:
+            self._buffer.append(instance)
+            size = len(self._buffer)
+        if size >= self.max_buffer:
+            # バッファの上限に達した場合は呼び出し元で書き込んで溢れを防ぐ（データは捨てない）
+            self.flush()
+        elif size >= self.batch_size:
+            self._wakeup.set()
+        self._ensure_worker()
+
+    def pending(self, session_pk) -> list:
+        """指定セッションの書き込み待ちの行"""
+        with self._lock:
+            return [instance for instance in self._buffer if getattr(instance, 'session_id', None) == session_pk]
+
+    def ensure_written(self, session_pk):
+        """指定セッションに書き込み待ちの行があれば書き込む（読み込み前に呼ぶとread-your-writesになる）"""
+        # 書き込み中の行はバッファから取り出し済みのため、書き込み中なら完了を待つ
+        if self.pending(session_pk) or self._flush_lock.locked():
+            self.flush()
+
+    def flush(self):
+        """バッファの内容をモデルごとにbulk_createで書き込む"""
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._buffer)
+                self._buffer.clear()
+            if not batch:
+                return 0
+
+            # 同じモデルの行は追加順のまま1回のbulk_createにまとめる
+            by_model = {}
+            for instance in batch:
+                by_model.setdefault(type(instance), []).append(instance)
+            for model, instances in by_model.items():
+                written = instances
+                try:
+                    with transaction.atomic():
+                        model.objects.bulk_create(instances, batch_size=self.batch_size)
+                except Exception as e:
+                    # 一括書き込みに失敗した場合は1行ずつ書き込み、失敗した行だけを諦める
+                    print(f"Write-behind bulk_create error ({model.__name__}): {e}")
+                    written = []
+                    for instance in instances:
+                        try:
+                            with transaction.atomic():
+                                instance.save()
+                            written.append(instance)
+                        except Exception:
+                            self.failed += 1
+                if written:
+                    _run_written_hooks(model, written)
+            self.flushed += len(batch)
+            self.batches += 1
+            return len(batch)
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._buffer)
+        return {'pending': size, 'max_buffer': self.max_buffer, 'flushed': self.flushed,
+                'batches': self.batches, 'failed': self.failed}
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_write_queue() -> WriteBehindQueue:
+    """プロセス共通の書き込みキューを取得（終了時に残りを書き込む）"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = WriteBehindQueue(
+                    flush_interval=settings.CHAT_WRITE_BEHIND_FLUSH_MS / 1000,
+                    batch_size=settings.CHAT_WRITE_BEHIND_BATCH_SIZE,
+                    max_buffer=settings.CHAT_WRITE_BEHIND_MAX_BUFFER,
+                )
+                atexit.register(_queue.flush)
+    return _queue
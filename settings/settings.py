@@ -10,11 +10,17 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+import dotenv
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# .env の環境変数を設定値より先に読み込む
+dotenv.load_dotenv(BASE_DIR / '.env')
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
@@ -43,6 +49,10 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # /metrics用のリクエスト処理時間・クエリ数（METRICS_ENABLED=falseで外れる）
+    'main.middleware.MetricsMiddleware',
+    # QUERY_PROFILER_ENABLEDのときだけ有効（無効時はミドルウェアごと外れる）
+    'main.middleware.QueryProfilerMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -132,3 +142,90 @@ CSRF_TRUSTED_ORIGINS = [
     "https://omakasetodo.xyz",
     "https://*.omakasetodo.xyz",        # 全てのサブドメインを許可
 ]
+
+# Webアプリの会話履歴ストア（'database' | 'sqlite' | 'memory'）
+# 複数ワーカー・複数コンテナで会話を継続するには 'database' を使用する
+# （CLIで直接起動したTravelChatAssistant・TravelAgentSystemはストア未指定ならプロセス内メモリを使う）
+CONVERSATION_STORE = os.environ.get('CONVERSATION_STORE', 'database')
+CONVERSATION_STORE_PATH = os.environ.get('CONVERSATION_STORE_PATH', str(BASE_DIR / 'agents_conversation.db'))
+
+# OpenAI互換APIの接続設定（プロセス共通のプール済みクライアントで使用）
+# APIキーは環境変数（または.env）でのみ設定する
+OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY', '')
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL', 'https://api.openai.iniad.org/api/v1')
+OPENAI_MAX_CONNECTIONS = int(os.environ.get('OPENAI_MAX_CONNECTIONS', '20'))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('OPENAI_MAX_KEEPALIVE_CONNECTIONS', '10'))
+OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get('OPENAI_KEEPALIVE_EXPIRY', '60'))
+OPENAI_TIMEOUT = float(os.environ.get('OPENAI_TIMEOUT', '60'))
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get('OPENAI_CONNECT_TIMEOUT', '5'))
+OPENAI_MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', '2'))
+# エージェントがResponses APIを使うか（falseならChat Completions API。stub_llm_serverで計測するときはfalse）
+OPENAI_AGENTS_USE_RESPONSES = os.environ.get('OPENAI_AGENTS_USE_RESPONSES', 'true').lower() == 'true'
+
+# AIアシスタントに送る会話履歴のトークン予算と、tool結果を要約せずに残すターン数
+ASSISTANT_CONTEXT_BUDGET_TOKENS = int(os.environ.get('ASSISTANT_CONTEXT_BUDGET_TOKENS', '4000'))
+ASSISTANT_CONTEXT_KEEP_TOOL_TURNS = int(os.environ.get('ASSISTANT_CONTEXT_KEEP_TOOL_TURNS', '1'))
+
+# ツール結果の出力形式（compact: 表形式で省トークン / verbose: 整形JSON、デバッグ用）
+TOOL_OUTPUT_FORMAT = os.environ.get('TOOL_OUTPUT_FORMAT', 'compact')
+
+# 検索ツール結果のキャッシュ（有効期限秒数・最大件数）
+# キャッシュはプロセスごと。データ更新時の破棄も更新したプロセスにしか効かないため、TTLが古い結果を返しうる上限になる
+TOOL_CACHE_ENABLED = os.environ.get('TOOL_CACHE_ENABLED', 'true').lower() == 'true'
+TOOL_CACHE_TTL = int(os.environ.get('TOOL_CACHE_TTL', '60'))
+TOOL_CACHE_MAXSIZE = int(os.environ.get('TOOL_CACHE_MAXSIZE', '256'))
+
+# AIアシスタントのツール並列実行（スレッド数・1回の応答内のツール呼び出し全体の待ち時間の上限秒数）
+# 上限を過ぎたツールは応答からは外れるが、実行中の処理は止まらずにワーカーを占有し続ける
+ASSISTANT_TOOL_WORKERS = int(os.environ.get('ASSISTANT_TOOL_WORKERS', '4'))
+TOOL_TURN_TIMEOUT = float(os.environ.get('TOOL_TURN_TIMEOUT', os.environ.get('TOOL_CALL_TIMEOUT', '15')))
+
+# FAQ的な質問の応答キャッシュ（オプトイン。類似度しきい値はn-gramのJaccard係数）
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'false').lower() == 'true'
+RESPONSE_CACHE_INTENTS = os.environ.get('RESPONSE_CACHE_INTENTS', 'greeting,courtesy,info').split(',')
+RESPONSE_CACHE_THRESHOLD = float(os.environ.get('RESPONSE_CACHE_THRESHOLD', '0.75'))
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', '3600'))
+RESPONSE_CACHE_MAXSIZE = int(os.environ.get('RESPONSE_CACHE_MAXSIZE', '200'))
+
+# 挨拶・お礼・よくある質問をLLMを通さずに定型文で応答する（信頼度の下限、挨拶・お礼とみなす最大文字数）
+FAST_PATH_ENABLED = os.environ.get('FAST_PATH_ENABLED', 'true').lower() == 'true'
+FAST_PATH_MIN_CONFIDENCE = float(os.environ.get('FAST_PATH_MIN_CONFIDENCE', '0.85'))
+FAST_PATH_MAX_LENGTH = int(os.environ.get('FAST_PATH_MAX_LENGTH', '20'))
+
+# チャット・テレメトリ行の遅延書き込み（書き込み間隔ms、1回の最大件数、バッファ上限）
+CHAT_WRITE_BEHIND_ENABLED = os.environ.get('CHAT_WRITE_BEHIND_ENABLED', 'true').lower() == 'true'
+CHAT_WRITE_BEHIND_FLUSH_MS = int(os.environ.get('CHAT_WRITE_BEHIND_FLUSH_MS', '200'))
+CHAT_WRITE_BEHIND_BATCH_SIZE = int(os.environ.get('CHAT_WRITE_BEHIND_BATCH_SIZE', '50'))
+CHAT_WRITE_BEHIND_MAX_BUFFER = int(os.environ.get('CHAT_WRITE_BEHIND_MAX_BUFFER', '1000'))
+
+# 分析用の集計（直近N秒の応答は書き込み途中の可能性があるため次回の集計に回す）
+ANALYTICS_ROLLUP_LAG_SECONDS = float(os.environ.get('ANALYTICS_ROLLUP_LAG_SECONDS', '5'))
+# 保持期間（日）：生の応答行（0で無期限）、分・時間単位の集計（日単位の集計は無期限）
+ANALYTICS_RAW_RETENTION_DAYS = int(os.environ.get('ANALYTICS_RAW_RETENTION_DAYS', '30'))
+ANALYTICS_ROLLUP_RETENTION_DAYS = {
+    'minute': int(os.environ.get('ANALYTICS_MINUTE_ROLLUP_RETENTION_DAYS', '2')),
+    'hour': int(os.environ.get('ANALYTICS_HOUR_ROLLUP_RETENTION_DAYS', '90')),
+}
+
+# リクエスト単位のDBクエリ計測（Server-Timingヘッダー・サンプリングしたログ・/performance/queries/）
+QUERY_PROFILER_ENABLED = os.environ.get('QUERY_PROFILER_ENABLED', 'false').lower() == 'true'
+QUERY_PROFILER_LOG_SAMPLE_RATE = float(os.environ.get('QUERY_PROFILER_LOG_SAMPLE_RATE', '0.1'))
+# このクエリ数以上のリクエストはサンプリングに関係なくログに出す
+QUERY_PROFILER_LOG_QUERY_THRESHOLD = int(os.environ.get('QUERY_PROFILER_LOG_QUERY_THRESHOLD', '30'))
+
+# Prometheus形式のメトリクス（/metrics）
+# 複数ワーカーで動かす場合はMETRICS_DIRに共有のディレクトリを指定する（プロセスごとのファイルを合算）
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', '1'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'main.query_profiler': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}